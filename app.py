@@ -1,13 +1,16 @@
 from concurrent.futures import thread
 from doctest import debug
-from flask import Flask
+from flask import Flask, Response, g, request
 from flask_restx import Api
 from routes.crop import api as crop_api
 from routes.average_intensity import api as average_intensity_api
 from routes.rotate import api as rotate_api
 from routes.create_variants import api as create_variants_api
 from routes.process_image import api as process_image_api
+from routes.health import api as health_api
 from config.database import MongoDBClient
+from utils.metrics import metrics
+from utils.image_limits import ImageTooLarge
 from dotenv import load_dotenv
 import os
 
@@ -15,6 +18,8 @@ import os
 load_dotenv(dotenv_path="/app/.env")
 
 app = Flask(__name__)
+# Larger bodies are refused with 413 before they are read
+app.config["MAX_CONTENT_LENGTH"] = int(os.getenv("MAX_CONTENT_LENGTH", str(32 * 1024 * 1024)))
 api = Api(
     app,
     version="1.0",
@@ -23,18 +28,46 @@ api = Api(
     doc="/api-docs/",
 )
 
-# Initialize MongoDB connection
+# Record MongoDB settings; each worker connects lazily after gunicorn forks
 mongo_client = MongoDBClient()
 mongo_client.initialize(
     os.getenv("DB_USERNAME"), os.getenv("DB_PASSWORD"), os.getenv("DB_HOST")
 )
 
+
+@api.errorhandler(ImageTooLarge)
+def handle_image_too_large(error):
+    return {"error": str(error)}, 413
+
+
 # Register namespaces with updated paths
 api.add_namespace(crop_api, path="/image-processing/crop")
 api.add_namespace(average_intensity_api, path="/image-processing/average-intensity")
 api.add_namespace(rotate_api, path="/image-processing/rotate")
 api.add_namespace(create_variants_api, path="/image-processing/create-variants")
 api.add_namespace(process_image_api, path="/image-processing/process")
+api.add_namespace(health_api, path="/image-processing/health")
+
+
+# Per-stage timings; a no-op unless METRICS_ENABLED or SERVER_TIMING is set
+@app.before_request
+def start_request_timings():
+    # Unmatched paths share one label so clients can't mint new series
+    g.request_timings = metrics.begin(request.url_rule.rule if request.url_rule else "unmatched")
+
+
+@app.after_request
+def finish_request_timings(response):
+    timings = g.pop("request_timings", None)
+    if timings is not None:
+        metrics.finish(timings, response.status_code, response.headers)
+    return response
+
+
+@app.route("/metrics")
+def prometheus_metrics():
+    return Response(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
 
 # on development enviorment remove the comments
 if __name__ == "__main__":
@@ -0,0 +1,404 @@
+# ASGI serving mode: the same five image-processing endpoints as app.py, with
+# blueprint lookups through motor and the OpenCV work on a bounded executor.
+#
+#   uvicorn asgi:app --host 0.0.0.0 --port 3002 --workers 4
+import asyncio
+import contextlib
+import contextvars
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from bson.errors import InvalidId
+from dotenv import load_dotenv
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+from werkzeug.exceptions import HTTPException, RequestEntityTooLarge
+
+from config.database import MongoDBClient
+from routes.average_intensity import average_intensity_of
+from routes.create_variants import (
+    NDJSON_FORMAT,
+    negotiate_stream_format,
+    stream_multipart,
+    stream_ndjson,
+    create_variants_response,
+    variant_options,
+)
+from routes.crop import crop_cache_key, crop_frame
+from routes.process_image import (
+    action_params,
+    process_cache_key,
+    process_cacheable,
+    process_payload,
+)
+from routes.rotate import rotate_frame
+from utils.database_utils import CameraNotFound, fetch_blueprint_async
+from utils.firebase_logger import firebase_logger, log_message
+from utils.image_utils import decode_image_from_bytes
+from utils.metrics import metrics
+from utils.image_limits import ImageTooLarge, check_decoded_size, check_image_size
+from utils.request_utils import (
+    METADATA_HEADERS,
+    RAW_MIMETYPES,
+    JSONImageReader,
+    normalize_metadata,
+)
+from utils.response_cache import response_cache
+from utils.response_utils import MULTIPART_FORMAT, negotiate_crop_format, crop_response_body
+from utils.roi_encoder import EncodeOptions
+from utils.variant_utils import iter_random_variants
+
+# Load environment variables
+load_dotenv(dotenv_path="/app/.env")
+
+# Same body size limit as the Flask app
+max_content_length = int(os.getenv("MAX_CONTENT_LENGTH", str(32 * 1024 * 1024)))
+
+# CPU-bound OpenCV work runs here; the semaphore bounds how many jobs can be
+# queued so a burst can't pile up unbounded decoded frames in memory
+cpu_workers = int(os.getenv("ASGI_CPU_WORKERS", str(os.cpu_count() or 4)))
+max_pending = int(os.getenv("ASGI_MAX_PENDING", str(cpu_workers * 2)))
+cpu_executor = ThreadPoolExecutor(max_workers=cpu_workers, thread_name_prefix="asgi-cpu")
+cpu_slots = None
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    global cpu_slots
+    # Created inside the worker's event loop
+    cpu_slots = asyncio.Semaphore(max_pending)
+    yield
+    firebase_logger.close()
+
+
+async def run_cpu(fn, *args):
+    # Runs in a copy of the request's context so its stages are still timed
+    context = contextvars.copy_context()
+    async with cpu_slots:
+        return await asyncio.get_running_loop().run_in_executor(
+            cpu_executor, context.run, fn, *args
+        )
+
+
+class MetricsMiddleware(BaseHTTPMiddleware):
+    async def dispatch(self, request, call_next):
+        # Unknown paths share one label so clients can't mint new series
+        path = request.url.path
+        timings = metrics.begin(path if path in ROUTE_PATHS else "unmatched")
+        response = await call_next(request)
+        if timings is not None:
+            metrics.finish(timings, response.status_code, response.headers)
+        return response
+
+
+async def fetch_blueprint_timed(camera_id):
+    with metrics.stage("fetch_blueprint"):
+        return await fetch_blueprint_async(camera_id)
+
+
+async def async_log_message(message, level="INFO"):
+    # With the blocking overflow policy a full queue would stall the event loop
+    if firebase_logger.overflow == "block":
+        await asyncio.get_running_loop().run_in_executor(None, log_message, message, level)
+    else:
+        log_message(message, level)
+
+
+def limited_receive(receive):
+    # Counts body bytes as they arrive; chunked uploads have no Content-Length
+    received = 0
+
+    async def wrapped():
+        nonlocal received
+        message = await receive()
+        received += len(message.get("body", b""))
+        if received > max_content_length:
+            raise RequestEntityTooLarge()
+        return message
+
+    return wrapped
+
+
+async def read_body(request):
+    chunks = []
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > max_content_length:
+            raise RequestEntityTooLarge()
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+async def read_image_payload(request, route):
+    # Async counterpart of utils.request_utils.read_image_payload
+    mimetype = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    content_length = int(request.headers.get("content-length") or 0) or None
+    if content_length and content_length > max_content_length:
+        raise RequestEntityTooLarge()
+
+    if mimetype == "multipart/form-data":
+        # The form parser reads through the same byte limit
+        form = await Request(request.scope, limited_receive(request.receive)).form()
+        data = {key: value for key, value in form.items() if isinstance(value, str)}
+        if "actions" in form:
+            data["actions"] = ",".join(form.getlist("actions"))
+        upload = form.get("image")
+        image_bytes = await upload.read() if upload is not None and not isinstance(upload, str) else None
+        if image_bytes:
+            check_image_size(image_bytes, route)
+        return normalize_metadata(data), image_bytes
+
+    if mimetype in RAW_MIMETYPES:
+        data = dict(request.query_params)
+        for field, header in METADATA_HEADERS.items():
+            if header in request.headers:
+                data[field] = request.headers[header]
+        body = await read_body(request)
+        if body:
+            check_image_size(body, route)
+        return normalize_metadata(data), body or None
+
+    # The base64 image is decoded while the body streams in
+    reader = JSONImageReader(content_length, route)
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > max_content_length:
+            raise RequestEntityTooLarge()
+        reader.feed(chunk)
+    return reader.finish()
+
+
+async def read_request(request, route):
+    with metrics.stage("read"):
+        data, image_bytes = await read_image_payload(request, route)
+    metrics.label(data.get("camera_id"), data.get("actions"))
+    return data, image_bytes
+
+
+def error(message, status_code):
+    return JSONResponse({"error": message}, status_code=status_code)
+
+
+def decode_or_raise(image_bytes, route):
+    with metrics.stage("decode"):
+        img = decode_image_from_bytes(image_bytes)
+    if img is None:
+        raise ValueError("Image data could not be decoded")
+    check_decoded_size(img, route)
+    return img
+
+
+def cached_body(cache_key, build):
+    # (body, content type, hit) from the response cache or build(); runs on
+    # the CPU executor so a shared cache backend never blocks the loop
+    with metrics.stage("response_cache"):
+        cached = response_cache.get(cache_key)
+    if cached is not None:
+        return cached + (True,)
+    result = build()
+    if result is None:
+        return None
+    response_cache.put(cache_key, *result)
+    return result + (False,)
+
+
+def body_response(body, content_type, hit=False):
+    response = Response(body, media_type=content_type)
+    if hit:
+        response.headers["X-Response-Cache"] = "hit"
+    return response
+
+
+async def crop(request):
+    data, image_bytes = await read_request(request, "crop")
+    camera_id = data.get("camera_id")
+    image_name = data.get("image_name")
+
+    if not camera_id or not image_name or not image_bytes:
+        return error("camera_id, image_name, and image are required", 400)
+
+    await fetch_blueprint_timed(camera_id)
+    response_format = negotiate_crop_format(request.headers.get("accept", ""))
+    try:
+        encode_options = EncodeOptions.from_request(data)
+    except ValueError as e:
+        return error(str(e), 400)
+
+    def work():
+        cache_key = crop_cache_key(
+            response_cache.digest(image_bytes), camera_id, image_name, encode_options, response_format
+        )
+
+        def build():
+            response = crop_frame(
+                decode_or_raise(image_bytes, "crop"), image_name, camera_id, encode_options, response_format
+            )
+            return crop_response_body(response, response_format)
+
+        return cached_body(cache_key, build)
+
+    body, content_type, hit = await run_cpu(work)
+    await async_log_message("Cropped image successfully", "INFO")
+    return body_response(body, content_type, hit)
+
+
+async def average_intensity(request):
+    data, image_bytes = await read_request(request, "average_intensity")
+
+    if not image_bytes:
+        return error("Image data must be provided", 400)
+
+    response = await run_cpu(average_intensity_of, image_bytes)
+    if response is None:
+        return error("Image data could not be decoded", 400)
+
+    await async_log_message("Calculated average intensity successfully", "INFO")
+    return JSONResponse(response)
+
+
+async def rotate(request):
+    data, image_bytes = await read_request(request, "rotate")
+
+    if not image_bytes:
+        return error("Image data must be provided", 400)
+
+    response = await run_cpu(
+        lambda: rotate_frame(decode_or_raise(image_bytes, "rotate"), data.get("image_name"), data.get("angle"))
+    )
+    await async_log_message("Rotated image successfully", "INFO")
+    return JSONResponse(response)
+
+
+async def create_variants(request):
+    data, image_bytes = await read_request(request, "create_variants")
+    image_name = data.get("image_name")
+
+    if not image_bytes:
+        return error("Image data must be provided", 400)
+
+    stream_format = negotiate_stream_format(data, request.headers.get("accept", ""))
+    try:
+        options = variant_options(data)
+    except ValueError as e:
+        return error(str(e), 400)
+    img = await run_cpu(decode_or_raise, image_bytes, "create_variants")
+
+    if stream_format:
+        try:
+            variants = iter_random_variants(img, **options)
+        except ValueError as e:
+            return error(str(e), 400)
+        # Starlette iterates sync generators on its own threadpool
+        if stream_format == NDJSON_FORMAT:
+            return StreamingResponse(stream_ndjson(variants, image_name), media_type=NDJSON_FORMAT)
+        boundary = uuid.uuid4().hex
+        return StreamingResponse(
+            stream_multipart(variants, image_name, boundary),
+            media_type=f"{MULTIPART_FORMAT}; boundary={boundary}",
+        )
+
+    try:
+        response = await run_cpu(create_variants_response, img, options, image_name)
+    except ValueError as e:
+        return error(str(e), 400)
+    await async_log_message("Created image variants successfully", "INFO")
+    return JSONResponse(response)
+
+
+async def process(request):
+    data, image_bytes = await read_request(request, "process")
+    camera_id = data.get("camera_id")
+
+    if not image_bytes or not camera_id:
+        return error("Image data and camera ID must be provided", 400)
+
+    # Make sure the camera and its blueprint exist before doing any work
+    await fetch_blueprint_timed(camera_id)
+    response_format = negotiate_crop_format(request.headers.get("accept", ""))
+    try:
+        params = action_params(data)
+    except ValueError as e:
+        return error(str(e), 400)
+
+    def work():
+        digest = response_cache.digest(image_bytes) if process_cacheable(data, params) else None
+
+        def build():
+            response = process_payload(data, image_bytes, params, response_format)
+            if response is None:
+                return None
+            return crop_response_body(response, response_format)
+
+        return cached_body(process_cache_key(digest, data, params, response_format), build)
+
+    result = await run_cpu(work)
+    if result is None:
+        return error("Image data could not be decoded", 400)
+
+    await async_log_message("Processed image and updated blueprint successfully", "INFO")
+    return body_response(*result)
+
+
+async def prometheus_metrics(request):
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+async def handle_camera_not_found(request, exc):
+    return error(str(exc), 404)
+
+
+async def handle_value_error(request, exc):
+    # Malformed JSON and invalid parameters
+    return error(str(exc), 400)
+
+
+async def handle_invalid_id(request, exc):
+    return error("Invalid camera ID", 400)
+
+
+async def handle_image_too_large(request, exc):
+    return error(str(exc), 413)
+
+
+async def handle_http_exception(request, exc):
+    # Body size limit (413) and malformed JSON (400) from the payload reader
+    return error(exc.description, exc.code)
+
+
+async def handle_exception(request, exc):
+    return error("An error occurred: " + str(exc), 500)
+
+
+# Records the MongoDB settings; the motor client is created lazily per worker
+MongoDBClient().initialize(
+    os.getenv("DB_USERNAME"), os.getenv("DB_PASSWORD"), os.getenv("DB_HOST")
+)
+
+app = Starlette(
+    routes=[
+        Route("/image-processing/crop", crop, methods=["POST"]),
+        Route("/image-processing/average-intensity", average_intensity, methods=["POST"]),
+        Route("/image-processing/rotate", rotate, methods=["POST"]),
+        Route("/image-processing/create-variants", create_variants, methods=["POST"]),
+        Route("/image-processing/process", process, methods=["POST"]),
+        Route("/metrics", prometheus_metrics, methods=["GET"]),
+    ],
+    middleware=[Middleware(MetricsMiddleware)],
+    exception_handlers={
+        CameraNotFound: handle_camera_not_found,
+        InvalidId: handle_invalid_id,
+        ValueError: handle_value_error,
+        ImageTooLarge: handle_image_too_large,
+        HTTPException: handle_http_exception,
+        Exception: handle_exception,
+    },
+    lifespan=lifespan,
+)
+ROUTE_PATHS = {route.path for route in app.routes}
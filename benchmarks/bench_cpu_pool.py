@@ -0,0 +1,83 @@
+# Throughput scaling of the shared-memory process pool: crop+encode jobs on
+# one frame from as many client threads as there are pool processes, for
+# 1..N processes, next to the same load run in-process.
+#
+#   python -m benchmarks.bench_cpu_pool --width 3840 --height 2160 --slots 60
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from benchmarks.bench_crop import make_blueprint
+from utils.cpu_pool import CPUPool
+from utils.crop_engine import compile_slot_rects
+from utils.roi_encoder import EncodeOptions
+
+
+def throughput(pool, frame, rects, options, clients, jobs):
+    # Frames per second with `clients` requests in flight at a time
+    pool.run("crop", frame, rects, options)  # warm up the pool processes
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        list(executor.map(lambda _: pool.run("crop", frame, rects, options), range(jobs)))
+    return jobs / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--width", type=int, default=3840)
+    parser.add_argument("--height", type=int, default=2160)
+    parser.add_argument("--slots", type=int, default=60)
+    parser.add_argument("--jobs", type=int, default=64)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 4)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 256, (args.height, args.width, 3), dtype=np.uint8)
+    rects, has_coordinate = compile_slot_rects(
+        make_blueprint(args.width, args.height, args.slots), frame.shape
+    )
+    rects = rects[has_coordinate]
+    options = EncodeOptions()
+
+    # In-process baseline: one job at a time, like a gunicorn sync worker
+    inline_fps = throughput(CPUPool(workers=0), frame, rects, options, 1, args.jobs)
+
+    counts = sorted({1, *range(2, args.max_workers + 1, 2), args.max_workers})
+    results = []
+    for workers in counts:
+        pooled = CPUPool(workers=workers, slots=workers * 2)
+        try:
+            results.append(
+                {
+                    "workers": workers,
+                    "pooled_fps": throughput(pooled, frame, rects, options, workers, args.jobs),
+                    # Jobs that fell back to running in-process
+                    "inline_jobs": pooled.inline,
+                }
+            )
+        finally:
+            pooled.close()
+
+    base = results[0]["pooled_fps"]
+    for result in results:
+        result["scaling"] = result["pooled_fps"] / base
+
+    print(
+        json.dumps(
+            {
+                "frame": [args.width, args.height],
+                "slots": args.slots,
+                "inline_fps": inline_fps,
+                "results": results,
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
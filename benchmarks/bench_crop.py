@@ -0,0 +1,103 @@
+# Microbenchmark: per-slot Python crop loop vs the compiled crop engine.
+#
+#   python -m benchmarks.bench_crop --width 3840 --height 2160 --slots 60
+import argparse
+import json
+import time
+
+import numpy as np
+
+from utils.crop_engine import compile_slot_rects, crop_rois, slot_statistics
+
+
+def make_blueprint(width, height, num_slots, seed=0):
+    rng = np.random.default_rng(seed)
+    slots = []
+    for i in range(num_slots):
+        w = float(rng.uniform(80, 300))
+        h = float(rng.uniform(80, 300))
+        slots.append(
+            {
+                "lot_name": f"A{i + 1}",
+                "coordinate": {
+                    "x1": str(rng.uniform(0, width - w)),
+                    "y1": str(rng.uniform(0, height - h)),
+                    "w": w,
+                    "h": h,
+                },
+            }
+        )
+    return {"slots": slots}
+
+
+def legacy_crop_and_intensity(img, blueprint):
+    # The original handle_cropping loop followed by one np.mean per crop
+    cropped_images = []
+    for slot in blueprint.get("slots", []):
+        coordinates = slot.get("coordinate")
+        if coordinates:
+            x1 = float(coordinates["x1"])
+            y1 = float(coordinates["y1"])
+            w = float(coordinates["w"])
+            h = float(coordinates["h"])
+            cropped_images.append(img[int(y1) : int(y1 + h), int(x1) : int(x1 + w)])
+    return cropped_images, [np.mean(c) for c in cropped_images]
+
+
+def engine_crop_and_intensity(img, blueprint):
+    rects, has_coordinate = compile_slot_rects(blueprint, img.shape)
+    rects = rects[has_coordinate]
+    return crop_rois(img, rects), slot_statistics(img, rects)["mean"]
+
+
+def timeit(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return result, {
+        "min_ms": min(timings) * 1000,
+        "median_ms": sorted(timings)[len(timings) // 2] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--width", type=int, default=3840)
+    parser.add_argument("--height", type=int, default=2160)
+    parser.add_argument("--slots", type=int, default=60)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    img = rng.integers(0, 256, (args.height, args.width, 3), dtype=np.uint8)
+    blueprint = make_blueprint(args.width, args.height, args.slots)
+
+    (legacy_crops, legacy_means), legacy = timeit(
+        lambda: legacy_crop_and_intensity(img, blueprint), args.repeat
+    )
+    (engine_crops, engine_means), engine = timeit(
+        lambda: engine_crop_and_intensity(img, blueprint), args.repeat
+    )
+
+    assert all(np.array_equal(a, b) for a, b in zip(legacy_crops, engine_crops))
+    max_error = float(np.max(np.abs(np.asarray(legacy_means) - engine_means)))
+
+    print(
+        json.dumps(
+            {
+                "frame": [args.width, args.height],
+                "slots": args.slots,
+                "legacy": legacy,
+                "engine": engine,
+                "speedup": legacy["median_ms"] / engine["median_ms"],
+                "max_mean_error": max_error,
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
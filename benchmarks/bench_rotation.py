@@ -0,0 +1,83 @@
+# Benchmark: full-frame warpAffine + crop vs the geometry-aware rotation path.
+# Right angles and the default path must match the affine implementation pixel
+# for pixel; the opt-in approximate path for arbitrary angles is reported with
+# its max difference (fixed-point interpolation can round a handful of pixels
+# differently when the warp origin moves).
+#
+#   python -m benchmarks.bench_rotation --width 3840 --height 2160 --slots 60
+import argparse
+import json
+
+import cv2
+import numpy as np
+
+from benchmarks.bench_crop import make_blueprint, timeit
+from utils.crop_engine import compile_slot_rects, crop_rois
+from utils.image_utils import handle_rotation, rotate_and_crop
+
+
+def legacy_rotation(img, angle):
+    (h, w) = img.shape[:2]
+    center = (w // 2, h // 2)
+    M = cv2.getRotationMatrix2D(center, angle, 1.0)
+    return cv2.warpAffine(img, M, (w, h))
+
+
+def compare(expected, actual):
+    diffs = [
+        np.abs(a.astype(np.int16) - b.astype(np.int16))
+        for a, b in zip(expected, actual)
+        if a.size
+    ]
+    if not diffs:
+        return {"max_diff": 0, "mismatched_pixels": 0.0}
+    total = sum(d.size for d in diffs)
+    return {
+        "max_diff": int(max(d.max() for d in diffs)),
+        "mismatched_pixels": sum(int(np.count_nonzero(d)) for d in diffs) / total,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--width", type=int, default=3840)
+    parser.add_argument("--height", type=int, default=2160)
+    parser.add_argument("--slots", type=int, default=60)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--angles", type=float, nargs="+", default=[90, 180, 270, -90, 12.5, 37])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    img = rng.integers(0, 256, (args.height, args.width, 3), dtype=np.uint8)
+    blueprint = make_blueprint(args.width, args.height, args.slots)
+    rects, has_coordinate = compile_slot_rects(blueprint, img.shape)
+    rects = rects[has_coordinate]
+
+    results = []
+    for angle in args.angles:
+        legacy_rois, legacy = timeit(
+            lambda: crop_rois(legacy_rotation(img, angle), rects), args.repeat
+        )
+        rois, fast = timeit(lambda: rotate_and_crop(img, angle, rects, approximate=True), args.repeat)
+        assert compare(legacy_rois, rotate_and_crop(img, angle, rects))["max_diff"] == 0, angle
+        result = {
+            "angle": angle,
+            "legacy": legacy,
+            "geometry_aware": fast,
+            "speedup": legacy["median_ms"] / fast["median_ms"],
+            **compare(legacy_rois, rois),
+        }
+
+        if angle % 90 == 0:
+            frame, full = timeit(lambda: handle_rotation(img, angle), args.repeat)
+            assert np.array_equal(frame, legacy_rotation(img, angle)), angle
+            assert result["max_diff"] == 0, angle
+            result["full_frame"] = full
+
+        results.append(result)
+
+    print(json.dumps({"frame": [args.width, args.height], "slots": args.slots, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+# Benchmark: the original one-variant-at-a-time augmentation loop vs the
+# batched VariantEngine.
+#
+#   python -m benchmarks.bench_variants --width 320 --height 240 --count 5
+import argparse
+import json
+import random
+
+import cv2
+import numpy as np
+from skimage.util import random_noise
+
+from benchmarks.bench_crop import timeit
+from utils.variant_utils import VariantEngine
+
+
+def legacy_variants(image, count):
+    variants = []
+    for _ in range(count):
+        variant = image.copy()
+        variant = cv2.convertScaleAbs(variant, alpha=random.uniform(0.5, 1.5), beta=0)
+        variant = cv2.convertScaleAbs(variant, alpha=random.uniform(0.5, 1.5), beta=0)
+        hsv = cv2.cvtColor(variant, cv2.COLOR_BGR2HSV)
+        hsv[..., 0] = hsv[..., 0] * random.uniform(0.5, 1.5)
+        variant = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
+        noise_img = random_noise(variant, mode="gaussian", var=random.uniform(0.01, 0.05))
+        variants.append(np.array(255 * noise_img, dtype="uint8"))
+    return variants
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--width", type=int, default=320)
+    parser.add_argument("--height", type=int, default=240)
+    parser.add_argument("--count", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    img = rng.integers(0, 256, (args.height, args.width, 3), dtype=np.uint8)
+
+    _, legacy = timeit(lambda: legacy_variants(img, args.count), args.repeat)
+    _, engine = timeit(lambda: VariantEngine(args.count, seed=0).generate(img), args.repeat)
+
+    first = VariantEngine(args.count, seed=7).generate(img)
+    second = VariantEngine(args.count, seed=7).generate(img)
+
+    print(
+        json.dumps(
+            {
+                "image": [args.width, args.height],
+                "count": args.count,
+                "legacy": legacy,
+                "engine": engine,
+                "speedup": legacy["median_ms"] / engine["median_ms"],
+                "reproducible": bool(np.array_equal(first, second)),
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
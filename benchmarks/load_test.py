@@ -0,0 +1,98 @@
+# Closed-loop load test: N concurrent clients POST the same frame for a fixed
+# duration and report requests per second and latency percentiles. Run it once
+# against each serving mode to compare them:
+#
+#   gunicorn -c gunicorn.conf.py app:app                       # port 3002
+#   uvicorn asgi:app --host 0.0.0.0 --port 3003 --workers 4
+#
+#   python -m benchmarks.load_test --image frame.jpg --camera-id <id> \
+#       --target wsgi=http://localhost:3002 --target asgi=http://localhost:3003
+import argparse
+import asyncio
+import base64
+import json
+import time
+
+import httpx
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(int(round(q / 100 * (len(values) - 1))), len(values) - 1)
+    return values[index]
+
+
+async def run_target(url, payload, concurrency, duration):
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async with httpx.AsyncClient(timeout=60) as client:
+
+        async def worker(index):
+            nonlocal errors
+            sent = 0
+            while time.perf_counter() < deadline:
+                # A new image name per request keeps the response cache out of it
+                sent += 1
+                request = dict(payload, image_name=f"{index}_{sent}_{payload['image_name']}")
+                start = time.perf_counter()
+                try:
+                    response = await client.post(url, json=request)
+                    ok = response.status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                if ok:
+                    latencies.append(time.perf_counter() - start)
+                else:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(i) for i in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed,
+        "p50_ms": (percentile(latencies, 50) or 0) * 1000,
+        "p99_ms": (percentile(latencies, 99) or 0) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--image", required=True)
+    parser.add_argument("--camera-id", required=True)
+    parser.add_argument("--route", default="/image-processing/process")
+    parser.add_argument("--actions", default="crop,average_intensity")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument(
+        "--target", action="append", required=True, help="name=base_url, repeatable"
+    )
+    args = parser.parse_args()
+
+    with open(args.image, "rb") as f:
+        image = base64.b64encode(f.read()).decode("utf-8")
+    payload = {
+        "image": image,
+        "image_name": "load_test.jpg",
+        "camera_id": args.camera_id,
+        "actions": [a for a in args.actions.split(",") if a],
+    }
+
+    results = {}
+    for target in args.target:
+        name, base_url = target.split("=", 1)
+        results[name] = asyncio.run(
+            run_target(base_url.rstrip("/") + args.route, payload, args.concurrency, args.duration)
+        )
+
+    print(json.dumps({"concurrency": args.concurrency, "duration": args.duration, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
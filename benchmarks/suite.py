@@ -0,0 +1,295 @@
+# Reproducible benchmark suite: synthetic frames (720p to 4K) and blueprints
+# (10 to 200 slots), an in-memory camera collection behind fetch_blueprint
+# and a no-op log sink, so it runs without MongoDB or Firebase. Covers single
+# functions and whole requests through the Flask test client, and writes
+# per-stage timings and each case's peak RSS growth as JSON.
+#
+#   python -m benchmarks.suite --output before.json
+#   python -m benchmarks.suite --output after.json --baseline before.json
+import os
+
+# Must be set before the app and its singletons are imported
+os.environ["LOG_SINK"] = "null"
+os.environ["BLUEPRINT_CACHE_WATCH"] = "false"
+os.environ["SERVER_TIMING"] = "true"
+# Every request repeats the same frame, which the response cache would answer
+os.environ["RESPONSE_CACHE_ENABLED"] = "false"
+os.environ.setdefault("DB_USERNAME", "benchmark")
+os.environ.setdefault("DB_PASSWORD", "benchmark")
+os.environ.setdefault("DB_HOST", "localhost")
+
+import argparse
+import base64
+import json
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+import cv2
+import numpy as np
+from bson.objectid import ObjectId
+
+from benchmarks.bench_crop import make_blueprint
+from utils import database_utils
+from utils.image_utils import (
+    decode_image_from_bytes,
+    encode_image_to_base64,
+    handle_cropping,
+)
+from utils.roi_encoder import roi_encoder
+from utils.variant_utils import create_random_variants
+
+FRAME_SIZES = {
+    "720p": (1280, 720),
+    "1080p": (1920, 1080),
+    "1440p": (2560, 1440),
+    "4k": (3840, 2160),
+}
+
+
+class FakeCameraCollection:
+    # Just enough of a pymongo collection for the blueprint lookups
+    def __init__(self):
+        self.docs = {}
+
+    def add(self, blueprint):
+        camera_id = ObjectId()
+        self.docs[camera_id] = {"_id": camera_id, "blueprint": blueprint}
+        return str(camera_id)
+
+    def find_one(self, query, projection=None):
+        return self.docs.get(query["_id"])
+
+    def find(self, query, projection=None):
+        return [self.docs[i] for i in query["_id"]["$in"] if i in self.docs]
+
+
+def install_fake_collection():
+    collection = FakeCameraCollection()
+    database_utils.get_camera_collection = lambda: collection
+    database_utils.blueprint_cache.clear()
+    return collection
+
+
+def synthetic_frame(width, height, seed=0):
+    # Smooth structure plus sensor-like noise, so JPEG sizes and decode
+    # times are closer to a camera frame than uniform noise would be
+    rng = np.random.default_rng(seed)
+    coarse = rng.integers(0, 256, (18, 32, 3), dtype=np.uint8)
+    frame = cv2.resize(coarse, (width, height), interpolation=cv2.INTER_CUBIC)
+    noise = rng.normal(0, 6, frame.shape)
+    return np.clip(frame + noise, 0, 255).astype(np.uint8)
+
+
+def process_status_mb(field):
+    # VmRSS / VmHWM from /proc, None where it isn't available
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak_rss():
+    # Linux lets a process reset its own RSS high-water mark, so each case
+    # reports its own peak rather than the largest of every earlier case
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    peak = process_status_mb("VmHWM")
+    if peak is not None:
+        return peak
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def parse_server_timing(header):
+    stages = {}
+    for entry in (header or "").split(","):
+        name, _, duration = entry.strip().partition(";dur=")
+        if name and duration:
+            stages[name] = float(duration)
+    return stages
+
+
+def measure(fn, repeat, warmup=1):
+    # fn returns per-stage timings in ms, or None
+    start_rss = process_status_mb("VmRSS")
+    peak_is_per_case = reset_peak_rss()
+    for _ in range(warmup):
+        fn()
+    timings = []
+    stages = {}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        stage_timings = fn()
+        timings.append((time.perf_counter() - start) * 1000)
+        for name, ms in (stage_timings or {}).items():
+            stages.setdefault(name, []).append(ms)
+    timings.sort()
+    result = {
+        "min_ms": timings[0],
+        "median_ms": timings[len(timings) // 2],
+        "p95_ms": timings[min(int(len(timings) * 0.95), len(timings) - 1)],
+    }
+    if peak_is_per_case and start_rss is not None:
+        # How far this case pushed RSS above where it started
+        result["peak_rss_growth_mb"] = peak_rss_mb() - start_rss
+    else:
+        # Lifetime peak of the process; only an upper bound for this case
+        result["process_peak_rss_mb"] = peak_rss_mb()
+    if stages:
+        result["stages_median_ms"] = {
+            name: sorted(values)[len(values) // 2] for name, values in stages.items()
+        }
+    return result
+
+
+def function_cases(frame, jpeg, blueprint, repeat):
+    crops = handle_cropping(frame, blueprint)
+    roi = next((c for c in crops if c.size), frame[:256, :256])
+    return {
+        "decode_image_from_bytes": measure(lambda: decode_image_from_bytes(jpeg), repeat),
+        "handle_cropping": measure(lambda: handle_cropping(frame, blueprint), repeat),
+        "roi_encoder.encode": measure(lambda: roi_encoder.encode(crops), repeat),
+        "encode_image_to_base64": measure(lambda: encode_image_to_base64(frame), repeat),
+        "create_random_variants": measure(
+            lambda: create_random_variants(roi, count=5, seed=0), repeat
+        ),
+    }
+
+
+def request_cases(client, camera_id, jpeg, repeat):
+    image = base64.b64encode(jpeg).decode("utf-8")
+
+    def post(path, **fields):
+        payload = dict(fields, image=image, image_name="frame.jpg", camera_id=camera_id)
+
+        def run():
+            response = client.post(path, json=payload)
+            if response.status_code != 200:
+                raise RuntimeError(f"{path} returned {response.status_code}: {response.data[:200]}")
+            return parse_server_timing(response.headers.get("Server-Timing"))
+
+        return run
+
+    # dedup is off so every repetition does the full work
+    return {
+        "POST /crop": measure(post("/image-processing/crop/"), repeat),
+        "POST /process crop": measure(
+            post("/image-processing/process/", actions=["crop"], dedup=False), repeat
+        ),
+        "POST /process average_intensity": measure(
+            post("/image-processing/process/", actions=["average_intensity"], dedup=False),
+            repeat,
+        ),
+        "POST /process rotate,crop,average_intensity": measure(
+            post(
+                "/image-processing/process/",
+                actions=["rotate", "crop", "average_intensity"],
+                angle=90,
+                dedup=False,
+            ),
+            repeat,
+        ),
+        "POST /rotate": measure(post("/image-processing/rotate/", angle=90), repeat),
+    }
+
+
+def environment():
+    try:
+        commit = subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "cpu_count": os.cpu_count(),
+        "platform": platform.platform(),
+    }
+
+
+def compare(cases, baseline):
+    # Adds the baseline median and new/old ratio to every case found in both
+    previous = {(c["kind"], c["name"], c["frame"], c["slots"]): c for c in baseline["cases"]}
+    for case in cases:
+        old = previous.get((case["kind"], case["name"], case["frame"], case["slots"]))
+        if old:
+            case["baseline_median_ms"] = old["median_ms"]
+            case["ratio"] = case["median_ms"] / old["median_ms"]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", default="720p,1080p,4k", help=f"any of {','.join(FRAME_SIZES)}")
+    parser.add_argument("--slots", default="10,50,200")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--skip-requests", action="store_true")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--baseline", help="earlier report to compare against")
+    args = parser.parse_args()
+
+    collection = install_fake_collection()
+    client = None
+    if not args.skip_requests:
+        from app import app
+
+        client = app.test_client()
+
+    cases = []
+    for frame_name in args.frames.split(","):
+        width, height = FRAME_SIZES[frame_name]
+        frame = synthetic_frame(width, height)
+        jpeg = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+
+        for num_slots in (int(n) for n in args.slots.split(",")):
+            blueprint = make_blueprint(width, height, num_slots)
+            camera_id = collection.add(blueprint)
+
+            results = [("function", function_cases(frame, jpeg, blueprint, args.repeat))]
+            if client is not None:
+                results.append(("request", request_cases(client, camera_id, jpeg, args.repeat)))
+
+            for kind, named in results:
+                for name, result in named.items():
+                    cases.append(
+                        dict(
+                            result,
+                            kind=kind,
+                            name=name,
+                            frame=frame_name,
+                            slots=num_slots,
+                        )
+                    )
+
+    report = {"environment": environment(), "repeat": args.repeat, "cases": cases}
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(cases, json.load(f))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+# Offline bulk cropping of a directory or tar archive of frames, e.g. to
+# rebuild a training set. Every image is cropped with its camera's blueprint
+# and the ROIs (plus optional random variants) are written next to each
+# other under the output directory, named like the API names them.
+#
+# Images are expected at <camera_id>/<...>/<frame>.jpg unless --camera-id is
+# given. Finished images are appended to a checkpoint file, so an
+# interrupted run picks up where it stopped when started again.
+#
+#   python -m cli.bulk_process frames.tar.gz --output dataset/ --variants 5
+#   python -m cli.bulk_process frames/ --output dataset/ --blueprints cameras.json
+import os
+
+# Workers only read blueprints, they don't need to follow changes
+os.environ.setdefault("BLUEPRINT_CACHE_WATCH", "false")
+
+import argparse
+import json
+import sys
+import tarfile
+import time
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import cv2
+from dotenv import load_dotenv
+
+load_dotenv(dotenv_path="/app/.env")
+
+from routes.create_variants import variant_name
+from utils.blueprint_utils import generate_filenames
+from utils.image_utils import decode_image_from_bytes, handle_cropping, handle_rotation
+from utils.variant_utils import create_random_variants
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+CHECKPOINT_NAME = "checkpoint.txt"
+
+# Per-process state set by _init_worker
+_worker = {}
+
+
+def load_blueprint_file(path):
+    # Either {camera_id: blueprint} or a mongoexport of the cameras
+    # collection (a JSON array or one document per line)
+    with open(path) as f:
+        text = f.read()
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        data = [json.loads(line) for line in text.splitlines() if line.strip()]
+
+    if isinstance(data, dict):
+        return data
+    blueprints = {}
+    for doc in data:
+        camera_id = doc.get("_id")
+        if isinstance(camera_id, dict):
+            camera_id = camera_id.get("$oid")
+        if camera_id and doc.get("blueprint"):
+            blueprints[str(camera_id)] = doc["blueprint"]
+    return blueprints
+
+
+def _safe_name(name):
+    # Archive member names end up in output paths; refuse to leave the output
+    name = os.path.normpath(name).replace(os.sep, "/")
+    if name.startswith(("/", "../")) or name == "..":
+        return None
+    return name
+
+
+def iter_directory(source):
+    for root, dirs, files in os.walk(source):
+        dirs.sort()
+        for file_name in sorted(files):
+            if file_name.lower().endswith(IMAGE_EXTENSIONS):
+                path = os.path.join(root, file_name)
+                yield os.path.relpath(path, source).replace(os.sep, "/"), None
+
+
+def iter_archive(source):
+    # Streamed in archive order, so compressed tars are read once
+    with tarfile.open(source, "r|*") as archive:
+        for member in archive:
+            name = _safe_name(member.name)
+            if not member.isfile() or not name or not name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            yield name, archive.extractfile(member).read()
+
+
+def iter_images(source):
+    if os.path.isdir(source):
+        return iter_directory(source)
+    return iter_archive(source)
+
+
+def camera_for(name, camera_id=None):
+    if camera_id:
+        return camera_id
+    if "/" not in name:
+        raise ValueError("Images must be under a <camera_id>/ directory, or pass --camera-id")
+    return name.split("/", 1)[0]
+
+
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        return {line.rstrip("\n") for line in f if line.strip()}
+
+
+def _init_worker(source, output, blueprints, options):
+    _worker.update(source=source, output=output, blueprints=blueprints, options=options)
+
+
+def _blueprint(camera_id):
+    blueprints = _worker["blueprints"]
+    if blueprints is not None:
+        blueprint = blueprints.get(camera_id)
+        if not blueprint:
+            raise ValueError("Blueprint not found for the given Camera")
+        return blueprint
+    from utils.database_utils import fetch_blueprint
+
+    # Cached per worker process after the first image of each camera
+    return fetch_blueprint(camera_id)
+
+
+def process_image(name, camera_id, data):
+    # Crops one image and writes its ROIs and variants; returns
+    # (name, rois written, variants written, bytes read)
+    options = _worker["options"]
+    if data is None:
+        with open(os.path.join(_worker["source"], name), "rb") as f:
+            data = f.read()
+    img = decode_image_from_bytes(data)
+    if img is None:
+        raise ValueError("Image data could not be decoded")
+    if options["angle"]:
+        img = handle_rotation(img, options["angle"])
+
+    blueprint = _blueprint(camera_id)
+    slots = blueprint.get("slots", [])
+    # handle_cropping skips slots without a coordinate; names stay per slot
+    filenames = [
+        file_name
+        for slot, file_name in zip(slots, generate_filenames(os.path.basename(name), len(slots)))
+        if slot.get("coordinate")
+    ]
+    rois = handle_cropping(img, blueprint)
+
+    directory = os.path.join(_worker["output"], os.path.dirname(name))
+    os.makedirs(directory, exist_ok=True)
+    # Same variants on every run for the same image
+    seed = zlib.crc32(name.encode()) + options["seed"]
+
+    roi_count = variant_count = 0
+    for index, (roi, file_name) in enumerate(zip(rois, filenames)):
+        if roi.size == 0:
+            continue
+        cv2.imwrite(os.path.join(directory, file_name), roi)
+        roi_count += 1
+        if not options["variants"] and not options["rotations"]:
+            continue
+        variants = create_random_variants(
+            roi, count=options["variants"], seed=seed + index, rotations=options["rotations"]
+        )
+        for i, variant in enumerate(variants):
+            cv2.imwrite(os.path.join(directory, variant_name(file_name, i)), variant)
+        variant_count += len(variants)
+    return name, roi_count, variant_count, len(data)
+
+
+class Throughput:
+    def __init__(self, workers, interval):
+        self.workers = workers
+        self.interval = interval
+        self.started = time.perf_counter()
+        self.last_report = self.started
+        self.images = self.skipped = self.failed = 0
+        self.rois = self.variants = self.bytes = 0
+
+    def add(self, rois, variants, size):
+        self.images += 1
+        self.rois += rois
+        self.variants += variants
+        self.bytes += size
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started
+        return {
+            "workers": self.workers,
+            "images": self.images,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "rois": self.rois,
+            "variants": self.variants,
+            "elapsed_s": round(elapsed, 2),
+            "images_per_s": round(self.images / elapsed, 2) if elapsed else None,
+            "rois_per_s": round(self.rois / elapsed, 2) if elapsed else None,
+            "input_mb_per_s": round(self.bytes / 2**20 / elapsed, 2) if elapsed else None,
+        }
+
+    def maybe_report(self):
+        now = time.perf_counter()
+        if now - self.last_report >= self.interval:
+            self.last_report = now
+            s = self.summary()
+            print(
+                f"{s['images']} images ({s['images_per_s']}/s), {s['rois']} ROIs, "
+                f"{s['failed']} failed, {s['skipped']} skipped",
+                file=sys.stderr,
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("source", help="Directory or tar archive (.tar, .tar.gz, ...)")
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--blueprints", help="JSON file of blueprints instead of MongoDB")
+    parser.add_argument("--camera-id", help="Use this camera for every image")
+    parser.add_argument("--angle", type=float, default=0)
+    parser.add_argument("--variants", type=int, default=0, help="Random variants per ROI")
+    parser.add_argument("--rotations", action="store_true", help="Add the 90/180/270 variants")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4)
+    parser.add_argument("--checkpoint", help=f"Defaults to <output>/{CHECKPOINT_NAME}")
+    parser.add_argument("--report-every", type=float, default=10.0, help="Seconds between progress lines")
+    parser.add_argument("--report", help="Also write the final report to this file")
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    blueprints = load_blueprint_file(args.blueprints) if args.blueprints else None
+    checkpoint_path = args.checkpoint or os.path.join(args.output, CHECKPOINT_NAME)
+    done = load_checkpoint(checkpoint_path)
+    options = {
+        "angle": args.angle,
+        "variants": args.variants,
+        "rotations": args.rotations,
+        "seed": args.seed,
+    }
+
+    throughput = Throughput(args.workers, args.report_every)
+    # Bounded so a large archive isn't read into memory ahead of the workers
+    max_pending = args.workers * 4
+    pending = set()
+
+    def collect(futures):
+        for future in futures:
+            try:
+                name, rois, variants, size = future.result()
+            except Exception as e:
+                throughput.failed += 1
+                print(f"Error processing {future.image_name}: {e}", file=sys.stderr)
+                continue
+            throughput.add(rois, variants, size)
+            checkpoint.write(name + "\n")
+        checkpoint.flush()
+        throughput.maybe_report()
+
+    with open(checkpoint_path, "a") as checkpoint, ProcessPoolExecutor(
+        max_workers=args.workers,
+        initializer=_init_worker,
+        initargs=(args.source, args.output, blueprints, options),
+    ) as executor:
+        for name, data in iter_images(args.source):
+            if name in done:
+                throughput.skipped += 1
+                continue
+            try:
+                camera_id = camera_for(name, args.camera_id)
+            except ValueError as e:
+                throughput.failed += 1
+                print(f"Error processing {name}: {e}", file=sys.stderr)
+                continue
+
+            future = executor.submit(process_image, name, camera_id, data)
+            future.image_name = name
+            pending.add(future)
+            if len(pending) >= max_pending:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(finished)
+        collect(pending)
+
+    report = throughput.summary()
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+# Runs the /process pipeline over a video file, stream URL or motion-JPEG
+# stream and writes one JSON line per sampled frame, like the
+# /image-processing/process/video endpoint.
+#
+#   python -m cli.process_video parking.mp4 --camera-id 64a9c8f4ef1f9f5a8b5d0a6d \
+#       --actions crop,features --sample-fps 2 --output results.ndjson
+#   curl -s http://camera/mjpeg | python -m cli.process_video - --mjpeg --camera-id ...
+import os
+
+# A one-off run doesn't need to follow blueprint changes
+os.environ.setdefault("BLUEPRINT_CACHE_WATCH", "false")
+
+import argparse
+import json
+import sys
+
+from dotenv import load_dotenv
+
+load_dotenv(dotenv_path="/app/.env")
+
+from routes.process_image import action_params
+from utils.database_utils import fetch_blueprint
+from utils.request_utils import STREAM_CHUNK_SIZE
+from utils.video_ingest import FrameSampler, process_samples, sample_mjpeg, sample_video
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("source", help="Video file or URL, '-' for motion-JPEG on stdin")
+    parser.add_argument("--camera-id", required=True)
+    parser.add_argument("--actions", default="crop", help="Comma separated actions")
+    parser.add_argument("--image-name", default="frame.jpg")
+    parser.add_argument("--mjpeg", action="store_true", help="Read source as motion-JPEG")
+    parser.add_argument("--sample-fps", type=float, default=float(os.getenv("VIDEO_SAMPLE_FPS", "1")))
+    parser.add_argument("--sample-every", type=int)
+    parser.add_argument("--max-frames", type=int)
+    parser.add_argument("--angle", type=int, default=0)
+    parser.add_argument("--histogram-bins", type=int, default=4)
+    parser.add_argument("--output", help="Write to this file instead of stdout")
+    args = parser.parse_args()
+
+    actions = [a.strip() for a in args.actions.split(",") if a.strip()]
+    params = action_params({"angle": args.angle, "histogram_bins": args.histogram_bins})
+    sampler = FrameSampler(args.sample_fps, args.sample_every, args.max_frames)
+
+    # Fails fast on an unknown camera; the frames then hit the cache
+    fetch_blueprint(args.camera_id)
+
+    if args.source == "-" or args.mjpeg:
+        stream = sys.stdin.buffer if args.source == "-" else open(args.source, "rb")
+        samples = sample_mjpeg(iter(lambda: stream.read1(STREAM_CHUNK_SIZE), b""), sampler)
+    else:
+        samples = sample_video(args.source, sampler)
+
+    out = open(args.output, "w") if args.output else sys.stdout
+    frames = 0
+    try:
+        for item in process_samples(samples, args.image_name, args.camera_id, actions, params):
+            out.write(json.dumps(item, default=str) + "\n")
+            out.flush()
+            frames += 1
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print(f"Processed {frames} frames", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,76 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, ReadPreference, monitoring
 import os
+import threading
+
+READ_PREFERENCES = {
+    "primary": ReadPreference.PRIMARY,
+    "primarypreferred": ReadPreference.PRIMARY_PREFERRED,
+    "secondary": ReadPreference.SECONDARY,
+    "secondarypreferred": ReadPreference.SECONDARY_PREFERRED,
+    "nearest": ReadPreference.NEAREST,
+}
+
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    # Connection pool counters for this worker's client
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {
+            "connections_created": 0,
+            "connections_closed": 0,
+            "checked_out": 0,
+            "checkout_failed": 0,
+            "pools_cleared": 0,
+        }
+        self.in_use = 0
+
+    def _inc(self, name, delta=1):
+        with self._lock:
+            self.counters[name] += delta
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._inc("pools_cleared")
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._inc("connections_created")
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._inc("connections_closed")
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self._inc("checkout_failed")
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            self.counters["checked_out"] += 1
+            self.in_use += 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.in_use -= 1
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats["in_use"] = self.in_use
+            stats["open"] = stats["connections_created"] - stats["connections_closed"]
+            return stats
+
 
 class MongoDBClient:
     _instance = None
@@ -8,9 +79,17 @@ class MongoDBClient:
         if cls._instance is None:
             cls._instance = super(MongoDBClient, cls).__new__(cls)
             cls._instance._client = None
+            cls._instance._client_pid = None
+            cls._instance._uri = None
+            cls._instance._lock = threading.Lock()
+            cls._instance.pool_metrics = None
+            cls._instance._async_client = None
+            cls._instance._async_client_pid = None
         return cls._instance
 
     def initialize(self, username, password, host):
+        # Only records the connection settings. MongoClient isn't fork-safe, so
+        # each gunicorn worker connects lazily on first use
         username = username or os.getenv('DB_USERNAME')
         password = password or os.getenv('DB_PASSWORD')
         host = host or os.getenv('DB_HOST')
@@ -18,10 +97,62 @@ class MongoDBClient:
         if not all([username, password, host]):
             raise ValueError("Database credentials are not fully set. Please check your environment variables.")
 
-        uri = f"mongodb+srv://{username}:{password}@{host}?retryWrites=true&w=majority"
-        self._client = MongoClient(uri)
-        print("Connected to database")
+        self._uri = f"mongodb+srv://{username}:{password}@{host}?retryWrites=true&w=majority"
+
+    def client_options(self):
+        return {
+            "maxPoolSize": int(os.getenv("DB_MAX_POOL_SIZE", "50")),
+            "minPoolSize": int(os.getenv("DB_MIN_POOL_SIZE", "0")),
+            "maxIdleTimeMS": int(os.getenv("DB_MAX_IDLE_TIME_MS", "60000")),
+            "serverSelectionTimeoutMS": int(os.getenv("DB_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+            "connectTimeoutMS": int(os.getenv("DB_CONNECT_TIMEOUT_MS", "5000")),
+            "socketTimeoutMS": int(os.getenv("DB_SOCKET_TIMEOUT_MS", "10000")),
+        }
 
     def get_client(self):
+        pid = os.getpid()
+        if self._client is None or self._client_pid != pid:
+            with self._lock:
+                if self._client is None or self._client_pid != pid:
+                    if self._uri is None:
+                        self.initialize(None, None, None)
+                    self.pool_metrics = PoolMetricsListener()
+                    self._client = MongoClient(
+                        self._uri,
+                        event_listeners=[self.pool_metrics],
+                        **self.client_options(),
+                    )
+                    self._client_pid = pid
+                    print(f"Connected to database (pid {pid})")
         return self._client
-    
+
+    def get_async_client(self):
+        # Motor client for the ASGI app, created on first use in each worker
+        from motor.motor_asyncio import AsyncIOMotorClient
+
+        pid = os.getpid()
+        if self._async_client is None or self._async_client_pid != pid:
+            if self._uri is None:
+                self.initialize(None, None, None)
+            self._async_client = AsyncIOMotorClient(self._uri, **self.client_options())
+            self._async_client_pid = pid
+        return self._async_client
+
+    def blueprint_read_preference(self):
+        # Primary by default: a reload right after an invalidation must not
+        # read a lagging secondary and cache the old blueprint again.
+        # Secondaries are opt-in where that staleness is acceptable
+        name = os.getenv("DB_BLUEPRINT_READ_PREFERENCE", "primary")
+        return READ_PREFERENCES[name.replace("_", "").lower()]
+
+    def pool_stats(self):
+        if self._client is None or self._client_pid != os.getpid():
+            return {"connected": False}
+        stats = self.pool_metrics.snapshot()
+        stats["connected"] = True
+        stats["max_pool_size"] = self.client_options()["maxPoolSize"]
+        return stats
+
+    def ping(self):
+        self.get_client().admin.command("ping")
+
@@ -0,0 +1,13 @@
+# Loaded automatically by gunicorn from the working directory
+bind = "0.0.0.0:3002"
+workers = 4
+
+
+def worker_exit(server, worker):
+    # Flush buffered log records before the worker goes away
+    from utils.firebase_logger import firebase_logger
+    from utils.cpu_pool import cpu_pool
+
+    firebase_logger.close()
+    # Stop the process pool and release its shared-memory arena
+    cpu_pool.close()
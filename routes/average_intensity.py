@@ -1,7 +1,11 @@
 from flask import request, jsonify
 from flask_restx import Namespace, Resource, fields
-from utils.image_utils import decode_image_from_base64, calculate_average_intensity
+from utils.image_utils import calculate_average_intensity
+from utils.request_utils import read_image_payload
+from utils.decode_strategy import decode_strategy
+from utils.image_limits import check_decoded_size
 from utils.firebase_logger import log_message
+from utils.metrics import metrics
 
 api = Namespace(
     "average_intensity", description="Calculate average intensity operations"
@@ -28,22 +32,41 @@ average_intensity_response_model = api.model(
 )
 
 
+def average_intensity_of(image_bytes):
+    # Only a statistic is returned, so decode at reduced resolution
+    with metrics.stage("decode"):
+        img, decode_scale, decode_report = decode_strategy.decode(
+            image_bytes,
+            "average_intensity",
+            True,
+            lambda frame, frame_scale: [calculate_average_intensity(frame)],
+        )
+    if img is None:
+        return None
+    check_decoded_size(img, "average_intensity", decode_scale)
+
+    # Calculate average intensity
+    with metrics.stage("average_intensity"):
+        response = {"average_intensity": calculate_average_intensity(img)}
+    if decode_report:
+        response["decode"] = decode_report
+    return response
+
+
 @api.route("/", strict_slashes=False)
 class AverageIntensity(Resource):
     @api.expect(average_intensity_model)
     @api.response(200, "Success", average_intensity_response_model)
     def post(self):
-        data = request.get_json()
-        image_base64 = data.get("image")
+        # Accepts base64 JSON, multipart/form-data or a raw image body
+        data, image_bytes = read_image_payload("average_intensity")
 
-        if not image_base64:
+        if not image_bytes:
             return jsonify({"error": "Image data must be provided"}), 400
 
-        # Decode base64 to numpy array
-        img = decode_image_from_base64(image_base64)
-
-        # Calculate average intensity
-        average_intensity = calculate_average_intensity(img)
+        response = average_intensity_of(image_bytes)
+        if response is None:
+            return jsonify({"error": "Image data could not be decoded"}), 400
 
         log_message("Calculated average intensity successfully", "INFO")
-        return jsonify({"average_intensity": average_intensity})
+        return jsonify(response)
@@ -1,8 +1,20 @@
-from flask import request, jsonify
+import json
+import uuid
+from flask import request, jsonify, Response
 from flask_restx import Namespace, Resource, fields
-from utils.image_utils import decode_image_from_base64, encode_image_to_base64
-from utils.variant_utils import create_random_variants
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+from utils.image_utils import encode_image_to_base64, encode_image_to_bytes
+from utils.request_utils import read_image_request
+from utils.response_utils import MULTIPART_FORMAT, NDJSON_FORMAT
+from utils.variant_utils import (
+    create_random_variants,
+    iter_random_variants,
+    RANDOM_TRANSFORMS,
+)
 from utils.firebase_logger import log_message
+from utils.cpu_pool import cpu_pool
+from utils.metrics import metrics
 
 api = Namespace("create_variants", description="Create image variants operations")
 
@@ -19,6 +31,24 @@ create_variants_model = api.model(
             description="Name of the image",
             example="example_image.jpg",
         ),
+        "count": fields.Integer(
+            description="Number of random variants (at most MAX_VARIANTS, 20 by default)", example=5
+        ),
+        "seed": fields.Integer(
+            description="Seed for reproducible variants", example=42
+        ),
+        "transforms": fields.List(
+            fields.String,
+            description="Random transforms to apply",
+            example=list(RANDOM_TRANSFORMS),
+        ),
+        "rotations": fields.Boolean(
+            description="Also return the 90/180/270 degree rotations", example=True
+        ),
+        "stream": fields.String(
+            description="Stream variants as they are produced (ndjson or multipart)",
+            example="ndjson",
+        ),
     },
 )
 
@@ -46,34 +76,122 @@ create_variants_response_model = api.model(
 )
 
 
+def variant_name(image_name, index):
+    # Generate names for variants based on the original image name
+    base_name = image_name.rsplit(".", 1)[0]
+    extension = image_name.rsplit(".", 1)[1]
+    return f"{base_name}_variant_{index + 1}.{extension}"
+
+
+def stream_ndjson(variants, image_name):
+    # Each variant is encoded, sent and dropped before the next is generated
+    for i, variant in enumerate(variants):
+        line = {"name": variant_name(image_name, i), "image": encode_image_to_base64(variant)}
+        del variant
+        yield json.dumps(line) + "\n"
+    log_message("Streamed image variants successfully", "INFO")
+
+
+def stream_multipart(variants, image_name, boundary):
+    for i, variant in enumerate(variants):
+        body = encode_image_to_bytes(variant)
+        del variant
+        yield (
+            f"--{boundary}\r\n"
+            "Content-Type: image/jpeg\r\n"
+            f"Content-Disposition: attachment; filename=\"{variant_name(image_name, i)}\"\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n"
+        ).encode("utf-8") + body + b"\r\n"
+    yield f"--{boundary}--\r\n".encode("utf-8")
+    log_message("Streamed image variants successfully", "INFO")
+
+
+def negotiate_stream_format(data, accept=None):
+    # stream=ndjson|multipart in the body, or an Accept header asking for one
+    stream = str(data.get("stream", "")).lower()
+    if stream in (NDJSON_FORMAT, "ndjson"):
+        return NDJSON_FORMAT
+    if stream in (MULTIPART_FORMAT, "multipart"):
+        return MULTIPART_FORMAT
+    accept_mimetypes = (
+        request.accept_mimetypes if accept is None else parse_accept_header(accept, MIMEAccept)
+    )
+    best = accept_mimetypes.best_match(
+        ["application/json", NDJSON_FORMAT, MULTIPART_FORMAT], default="application/json"
+    )
+    return best if best != "application/json" else None
+
+
+def variant_options(data):
+    transforms = data.get("transforms") or RANDOM_TRANSFORMS
+    if isinstance(transforms, str):
+        transforms = [t.strip() for t in transforms.split(",") if t.strip()]
+    seed = data.get("seed")
+    return {
+        "count": int(data.get("count", 5)),
+        "transforms": transforms,
+        "seed": int(seed) if seed is not None else None,
+        "rotations": str(data.get("rotations", True)).lower() not in ("0", "false"),
+    }
+
+
+def variants_response(variants, image_name, encoded=False):
+    # encoded: the variants are already Base64 strings (from the process pool)
+    return {
+        "variants": [
+            {
+                "name": variant_name(image_name, i),
+                "image": variant if encoded else encode_image_to_base64(variant),
+            }
+            for i, variant in enumerate(variants)
+        ]
+    }
+
+
+def create_variants_response(img, options, image_name):
+    if cpu_pool.enabled:
+        # Generated and encoded in the process pool
+        with metrics.stage("variants_encode"):
+            encoded = cpu_pool.encode_variants(img, options)
+        return variants_response(encoded, image_name, encoded=True)
+
+    with metrics.stage("variants"):
+        variants = create_random_variants(img, **options)
+    with metrics.stage("encode"):
+        return variants_response(variants, image_name)
+
+
 @api.route("/", strict_slashes=False)
 class CreateVariants(Resource):
     @api.expect(create_variants_model)
     @api.response(200, "Success", create_variants_response_model)
     def post(self):
-        data = request.get_json()
+        # Accepts base64 JSON, multipart/form-data or a raw image body
+        data, img = read_image_request("create_variants")
         image_name = data.get("image_name")
-        image_base64 = data.get("image")
 
-        if not image_base64:
+        if img is None:
             return jsonify({"error": "Image data must be provided"}), 400
 
-        # Decode base64 to numpy array
-        img = decode_image_from_base64(image_base64)
-
-        # Create variants
-        variants = create_random_variants(img)
+        stream_format = negotiate_stream_format(data)
+        try:
+            # Create variants; bad count/seed/transforms are client errors
+            options = variant_options(data)
+            if stream_format:
+                variants = iter_random_variants(img, **options)
+            else:
+                response = create_variants_response(img, options, image_name)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
-        # Generate names for variants based on the original image name
-        base_name = image_name.rsplit(".", 1)[0]
-        extension = image_name.rsplit(".", 1)[1]
-        variants_response = [
-            {
-                "name": f"{base_name}_variant_{i+1}.{extension}",
-                "image": encode_image_to_base64(variant),
-            }
-            for i, variant in enumerate(variants)
-        ]
+        if stream_format == NDJSON_FORMAT:
+            return Response(stream_ndjson(variants, image_name), mimetype=NDJSON_FORMAT)
+        if stream_format == MULTIPART_FORMAT:
+            boundary = uuid.uuid4().hex
+            return Response(
+                stream_multipart(variants, image_name, boundary),
+                content_type=f"{MULTIPART_FORMAT}; boundary={boundary}",
+            )
 
         log_message("Created image variants successfully", "INFO")
-        return jsonify({"variants": variants_response})
+        return jsonify(response)
@@ -1,17 +1,21 @@
 from flask import request, jsonify
 from flask_restx import Namespace, Resource, fields
-from utils.image_utils import (
-    decode_image_from_base64,
-    encode_image_to_base64,
-    handle_cropping,
-)
-from utils.blueprint_utils import (
-    generate_filenames,
-    update_response_with_crops,
-    insert_filenames_into_response,
-)
 from utils.firebase_logger import log_message
-from utils.database_utils import fetch_blueprint
+from utils.database_utils import blueprint_version, fetch_crop_plan
+from utils.image_utils import decode_image_from_bytes
+from utils.image_limits import check_decoded_size
+from utils.request_utils import read_image_payload
+from utils.response_cache import response_cache, response_key
+from utils.roi_encoder import EncodeOptions
+from utils.cpu_pool import cpu_pool
+from utils.metrics import metrics
+from utils.response_utils import (
+    JSON_FORMAT,
+    negotiate_crop_format,
+    encode_crops,
+    cached_crop_response,
+    make_cached_crop_response,
+)
 
 
 api = Namespace("crop", description="Crop image operation")
@@ -32,6 +36,15 @@ crop_image_model = api.model(
             description="ID of the camera to fetch blueprint",
             example="64a9c8f4ef1f9f5a8b5d0a6d",
         ),
+        "roi_format": fields.String(
+            description="Encoding of the ROIs (jpeg, png, webp)", example="jpeg"
+        ),
+        "roi_quality": fields.Integer(
+            description="Encoder quality (PNG: compression level)", example=90
+        ),
+        "roi_max_dimension": fields.Integer(
+            description="Downscale ROIs so their longest side fits", example=256
+        ),
     },
 )
 
@@ -84,41 +97,92 @@ crop_image_response_model = api.model(
 )
 
 
+def crop_frame(image, image_name, camera_id, encode_options, response_format):
+    # Step 1: Data Preparation (crop plan is cached per camera and frame size)
+    plan = fetch_crop_plan(camera_id, image.shape)
+
+    # Step 2: Build the response with the generated filenames
+    response = plan.build_response(image_name)
+
+    if cpu_pool.enabled:
+        # Steps 3 and 4 in the process pool, reading the frame from shared memory
+        with metrics.stage("crop_encode"):
+            encoded_cropped_images = cpu_pool.crop_and_encode(
+                image, plan.rects, encode_options, as_base64=response_format == JSON_FORMAT
+            )
+    else:
+        # Step 3: Perform Cropping
+        with metrics.stage("crop"):
+            cropped_images = plan.crop(image)
+
+        # Step 4: Encode cropped images (Base64 for JSON, raw JPEG for binary formats)
+        with metrics.stage("encode"):
+            encoded_cropped_images, _ = encode_crops(
+                cropped_images, response_format, encode_options
+            )
+
+    # Step 5: Update the response with the cropped images
+    response = plan.fill_slots(response, "roi", encoded_cropped_images)
+    if encode_options.format != "jpeg":
+        response["roi_format"] = encode_options.format
+    return response
+
+
+def crop_cache_key(digest, camera_id, image_name, encode_options, response_format):
+    # None until the camera's blueprint is cached
+    return response_key(
+        digest,
+        blueprint_version(camera_id),
+        route="crop",
+        camera_id=camera_id,
+        image_name=image_name,
+        encode_options=vars(encode_options),
+        response_format=response_format,
+    )
+
+
 @api.route("/", strict_slashes=False)
 class CropImage(Resource):
     @api.expect(crop_image_model)
     @api.response(200, "Success", crop_image_response_model)
     def post(self):
-        data = request.json
+        # Accepts base64 JSON, multipart/form-data or a raw image body
+        data, image_bytes = read_image_payload("crop")
         camera_id = data.get("camera_id")
         image_name = data.get("image_name")
-        image = data.get("image")
 
-        if not camera_id or not image_name or not image:
+        if not camera_id or not image_name or not image_bytes:
             return (
                 jsonify({"error": "camera_id, image_name, and image are required"}),
                 400,
             )
 
-        image = decode_image_from_base64(image)
-
-        # Step 1: Data Preparation
-        blueprint = fetch_blueprint(camera_id)
-
-        # Step 2: Generate Filenames for Cropped Images
-        filenames = generate_filenames(image_name, len(blueprint.get("slots", [])))
-
-        # Step 3: Insert Filenames into Blueprint
-        response = insert_filenames_into_response(blueprint, filenames, image_name)
+        response_format = negotiate_crop_format()
+        try:
+            encode_options = EncodeOptions.from_request(data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
-        # Step 4: Perform Cropping
-        cropped_images = handle_cropping(image, response)
+        # Retries and duplicate frames are answered before any decoding
+        digest = response_cache.digest(image_bytes)
+        cached = cached_crop_response(
+            crop_cache_key(digest, camera_id, image_name, encode_options, response_format)
+        )
+        if cached is not None:
+            return cached
 
-        # Step 5: Encode cropped images to Base64
-        encoded_cropped_images = [encode_image_to_base64(img) for img in cropped_images]
+        with metrics.stage("decode"):
+            image = decode_image_from_bytes(image_bytes)
+        if image is None:
+            return jsonify({"error": "Image data could not be decoded"}), 400
+        check_decoded_size(image, "crop")
 
-        # Step 6: Update Blueprint with Cropped Images
-        response = update_response_with_crops(response, encoded_cropped_images)
+        response = crop_frame(image, image_name, camera_id, encode_options, response_format)
 
         log_message("Cropped image successfully", "INFO")
-        return jsonify(response)
+        # The blueprint is cached now, so the key has its version
+        return make_cached_crop_response(
+            response,
+            response_format,
+            crop_cache_key(digest, camera_id, image_name, encode_options, response_format),
+        )
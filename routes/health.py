@@ -0,0 +1,33 @@
+from flask_restx import Namespace, Resource
+from config.database import MongoDBClient
+from utils.database_utils import blueprint_cache
+from utils.firebase_logger import firebase_logger
+from utils.cpu_pool import cpu_pool
+from utils.response_cache import response_cache
+
+api = Namespace("health", description="Service health operations")
+
+
+@api.route("/", strict_slashes=False)
+class Health(Resource):
+    @api.response(200, "Healthy")
+    @api.response(503, "Database unreachable")
+    def get(self):
+        mongo_client = MongoDBClient()
+        response = {
+            "status": "ok",
+            "database": {"reachable": True},
+            "blueprint_cache": blueprint_cache.stats(),
+            "log_queue": firebase_logger.stats(),
+            "cpu_pool": cpu_pool.stats(),
+            "response_cache": response_cache.stats(),
+        }
+
+        try:
+            mongo_client.ping()
+        except Exception as e:
+            response["status"] = "degraded"
+            response["database"] = {"reachable": False, "error": str(e)}
+
+        response["database"]["pool"] = mongo_client.pool_stats()
+        return response, 200 if response["status"] == "ok" else 503
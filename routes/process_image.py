@@ -1,20 +1,57 @@
 from pydoc import describe
-from flask import request
+import base64
+import contextvars
+import json
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from flask import Response, request, stream_with_context
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge
+from werkzeug.formparser import parse_form_data
 from flask_restx import Namespace, Resource, fields
-from utils.image_utils import (
-    decode_image_from_base64,
-    handle_cropping,
-    handle_rotation,
-    encode_image_to_base64,
-    calculate_average_intensity,
+from utils.image_utils import decode_image_from_bytes
+from utils.pipeline import run_actions
+from utils.database_utils import blueprint_version, fetch_blueprint, fetch_blueprints
+from utils.firebase_logger import log_message
+from utils.request_utils import (
+    STREAM_CHUNK_SIZE,
+    limited_input,
+    normalize_metadata,
+    read_image_payload,
+    request_metadata,
 )
-from utils.blueprint_utils import (
-    insert_filenames_into_response,
-    update_response_with_crops,
-    generate_filenames,
+from utils.video_ingest import (
+    process_samples,
+    sample_mjpeg,
+    sample_video,
+    sampler_from_request,
+)
+from utils.decode_strategy import decode_strategy, STATS_ONLY_ACTIONS
+from utils.image_limits import ImageTooLarge, check_decoded_size, check_image_size
+from utils.roi_encoder import EncodeOptions
+from utils.metrics import metrics
+from utils.background_model import background_models
+from utils.slot_features import check_histogram_bins
+from utils.response_cache import response_cache, response_key
+from utils.response_utils import (
+    JSON_FORMAT,
+    NDJSON_FORMAT,
+    negotiate_crop_format,
+    cached_crop_response,
+    make_cached_crop_response,
 )
-from utils.database_utils import fetch_blueprint
-from utils.firebase_logger import log_message
+
+# Shared by batch requests; OpenCV releases the GIL while decoding and cropping
+batch_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("BATCH_WORKERS", str(os.cpu_count() or 4))),
+    thread_name_prefix="process-batch",
+)
+
+# Bodies read as a motion-JPEG stream; any other upload is treated as a
+# video file for cv2.VideoCapture
+MJPEG_MIMETYPES = ("multipart/x-mixed-replace", "video/x-motion-jpeg", "video/mjpeg")
+VIDEO_MAX_CONTENT_LENGTH = int(os.getenv("VIDEO_MAX_CONTENT_LENGTH", str(1024 * 1024 * 1024))) or None
 
 api = Namespace("process", description="Process image operations")
 
@@ -32,10 +69,34 @@ process_image_model = api.model(
         "actions": fields.List(
             fields.String,
             required=False,
-            description="Actions to perform on the image (rotate, crop, etc.)",
+            description="Actions to perform on the image (rotate, resize, crop, average_intensity, features, change_score, variants)",
             example=["rotate", "crop", "average_intensity"],
         ),
         "angle": fields.Integer(description="Angle to rotate the image", example=90),
+        "scale": fields.Float(description="Scale factor for the resize action", example=0.5),
+        "roi_format": fields.String(
+            description="Encoding of the ROIs (jpeg, png, webp)", example="jpeg"
+        ),
+        "roi_quality": fields.Integer(
+            description="Encoder quality (PNG: compression level)", example=90
+        ),
+        "roi_max_dimension": fields.Integer(
+            description="Downscale ROIs so their longest side fits", example=256
+        ),
+        "histogram_bins": fields.Integer(
+            description="Colour histogram bins per channel for the features action (1-16)", example=4
+        ),
+        "capture_reference": fields.Boolean(
+            description="Store this frame's slots as their empty reference (features action)",
+            example=False,
+        ),
+        "include_timings": fields.Boolean(
+            description="Return per-stage timings in the response", example=False
+        ),
+        "dedup": fields.Boolean(
+            description="Reuse the previous frame's results for unchanged slots (off unless FRAME_DEDUP=true)",
+            example=False,
+        ),
         "camera_id": fields.String(
             required=True,
             description="ID of the camera to fetch blueprint",
@@ -85,6 +146,31 @@ process_image_response_model = api.model(
                             description="Base64 encoded cropped image",
                             example="<base64_cropped_image_string>",
                         ),
+                        "change_score": fields.Float(
+                            description="Share of the slot's pixels that differ from its background",
+                            example=0.42,
+                        ),
+                        "features": fields.Nested(
+                            api.model(
+                                "SlotFeatures",
+                                {
+                                    "gray_mean": fields.Float(example=112.4),
+                                    "gray_std": fields.Float(example=31.7),
+                                    "edge_density": fields.Float(
+                                        description="Share of Canny edge pixels", example=0.08
+                                    ),
+                                    "color_histogram": fields.List(
+                                        fields.Float,
+                                        description="Normalized joint BGR histogram",
+                                    ),
+                                    "reference_diff": fields.Float(
+                                        description="Mean grey-level difference from the empty reference",
+                                        example=4.2,
+                                    ),
+                                },
+                            ),
+                            description="Occupancy features of the slot",
+                        ),
                         "variants": fields.List(
                             fields.String(
                                 description="Base64 encoded cropped image",
@@ -101,6 +187,196 @@ process_image_response_model = api.model(
 )
 
 
+process_batch_model = api.model(
+    "ProcessBatchModel",
+    {
+        "items": fields.List(
+            fields.Nested(process_image_model),
+            required=True,
+            description="Frames to process, each with its own camera and actions",
+        )
+    },
+)
+
+process_batch_response_model = api.model(
+    "ProcessBatchResponseModel",
+    {
+        "results": fields.List(
+            fields.Nested(
+                api.model(
+                    "ProcessBatchResult",
+                    {
+                        "index": fields.Integer(
+                            description="Position of the item in the request", example=0
+                        ),
+                        "result": fields.Nested(
+                            process_image_response_model,
+                            description="Processed image, absent on error",
+                        ),
+                        "error": fields.String(
+                            description="Error for this item, absent on success",
+                            example="Camera not found",
+                        ),
+                    },
+                )
+            )
+        )
+    },
+)
+
+process_video_line_model = api.model(
+    "ProcessVideoLineModel",
+    {
+        "frame": fields.Integer(description="Index of the frame in the video", example=25),
+        "timestamp_ms": fields.Float(
+            description="Position in the video (arrival time for motion-JPEG)", example=1000.0
+        ),
+        "result": fields.Nested(
+            process_image_response_model, description="Processed frame, absent on error"
+        ),
+        "error": fields.String(
+            description="Error for this frame, absent on success", example="Camera not found"
+        ),
+    },
+)
+
+
+def action_params(data):
+    # Per-request parameters the pipeline stages read
+    return {
+        "angle": data.get("angle", 0),
+        "scale": float(data.get("scale", 1.0)),
+        "encode_options": EncodeOptions.from_request(data),
+        "histogram_bins": check_histogram_bins(data.get("histogram_bins", 4)),
+        "capture_reference": str(data.get("capture_reference")).lower() in ("1", "true"),
+        "include_timings": str(data.get("include_timings")).lower() in ("1", "true"),
+        # Reuse last frame's outputs for slots that look unchanged
+        "dedup": str(data.get("dedup", os.getenv("FRAME_DEDUP", "false"))).lower()
+        in ("1", "true"),
+    }
+
+
+def process_frame(img, image_name, camera_id, actions, params, response_format):
+    # Actions are compiled once per signature into a fused, ordered stage plan
+    return run_actions(img, image_name, camera_id, actions, params, response_format)
+
+
+def slot_intensities(response):
+    return [
+        float("nan") if slot.get("average_intensity") is None else slot["average_intensity"]
+        for slot in response.get("slots", [])
+    ]
+
+
+def batch_item_error(item):
+    # Checked per item, so one malformed entry doesn't fail the whole batch
+    if not isinstance(item, dict):
+        return "Each item must be an object"
+    if item.get("camera_id") is not None and not isinstance(item["camera_id"], str):
+        return "camera_id must be a string"
+    return None
+
+
+def process_batch_item(item, blueprint_errors):
+    error = batch_item_error(item)
+    if error:
+        raise ValueError(error)
+    # Same angle and actions parsing as a single /process request
+    try:
+        item = normalize_metadata(dict(item))
+    except BadRequest as e:
+        raise ValueError(e.description)
+    camera_id = item.get("camera_id")
+    image_base64 = item.get("image")
+
+    if not image_base64 or not camera_id:
+        raise ValueError("Image data and camera ID must be provided")
+    if camera_id in blueprint_errors:
+        raise ValueError(blueprint_errors[camera_id])
+
+    with metrics.stage("decode"):
+        image_bytes = base64.b64decode(image_base64)
+        check_image_size(image_bytes, "process")
+        img = decode_image_from_bytes(image_bytes)
+    if img is None:
+        raise ValueError("Image data could not be decoded")
+    check_decoded_size(img, "process")
+
+    return process_frame(
+        img,
+        item.get("image_name"),
+        camera_id,
+        item.get("actions", []),
+        action_params(item),
+        JSON_FORMAT,
+    )
+
+
+def process_payload(data, image_bytes, params, response_format):
+    # Decode and run the actions; None when the image can't be decoded
+    image_name = data.get("image_name")
+    actions = data.get("actions", [])  # Default to an empty list
+    camera_id = data.get("camera_id")
+
+    # Without ROI outputs a reduced-resolution decode is good enough
+    stats_only = bool(actions) and set(actions) <= STATS_ONLY_ACTIONS
+    with metrics.stage("decode"):
+        img, decode_scale, decode_report = decode_strategy.decode(
+            image_bytes,
+            camera_id,
+            stats_only,
+            lambda frame, frame_scale: slot_intensities(
+                process_frame(
+                    frame, image_name, camera_id, actions,
+                    dict(params, decode_scale=frame_scale, dedup=False, learn_background=False),
+                    response_format,
+                )
+            ),
+        )
+    if img is None:
+        return None
+    check_decoded_size(img, "process", decode_scale)
+
+    response = process_frame(
+        img, image_name, camera_id, actions,
+        dict(params, decode_scale=decode_scale), response_format,
+    )
+    if decode_report:
+        response["decode"] = decode_report
+    return response
+
+
+# Their results depend on per-camera state (empty-slot references, the
+# background model) that a cached response would neither see nor update
+STATEFUL_ACTIONS = ("features", "change_score")
+
+
+def process_cacheable(data, params):
+    # Frame dedup and the background model also carry state between frames,
+    # and timings are only meaningful for the request that measured them
+    return not (
+        params["dedup"]
+        or params["include_timings"]
+        or params["capture_reference"]
+        or background_models.learn_all
+        or set(data.get("actions") or []) & set(STATEFUL_ACTIONS)
+    )
+
+
+def process_cache_key(digest, data, params, response_format):
+    camera_id = data.get("camera_id")
+    return response_key(
+        digest,
+        blueprint_version(camera_id),
+        route="process",
+        camera_id=camera_id,
+        image_name=data.get("image_name"),
+        actions=data.get("actions", []),
+        params=dict(params, encode_options=vars(params["encode_options"])),
+        response_format=response_format,
+    )
+
+
 @api.route("/", strict_slashes=False)
 class ProcessImage(Resource):
     @api.expect(process_image_model)
@@ -108,61 +384,197 @@ class ProcessImage(Resource):
     def post(self):
         try:
 
-            data = request.get_json()
-            image_base64 = data.get("image")
-            image_name = data.get("image_name")
-            actions = data.get("actions", [])  # Default to an empty list
-            angle = data.get("angle", 0)
+            # Accepts base64 JSON, multipart/form-data or a raw image body
+            data, image_bytes = read_image_payload("process")
             camera_id = data.get("camera_id")
 
-            if not image_base64 or not camera_id:
+            if not image_bytes or not camera_id:
                 return (
                     {"error": "Image data and camera ID must be provided"},
                     400,
                 )
 
-            # Decode base64 to numpy array
-            img = decode_image_from_base64(image_base64)
-
-            # Fetch the blueprint from the database
-            blueprint = fetch_blueprint(camera_id)
-
-            # If actions are empty, perform all available actions
-            if not actions:
-                actions = ["crop"]
-
-            # Process each action in the order provided
-            cropped_images = []
-            for action in actions:
-                if action == "rotate":
-                    img = handle_rotation(img, angle)
-                elif action == "crop":
-                    filenames = generate_filenames(
-                        image_name, len(blueprint.get("slots", []))
-                    )
-                    response = insert_filenames_into_response(
-                        blueprint, filenames, image_name
-                    )
-                    cropped_images = handle_cropping(img, blueprint)
-                    print(cropped_images)
-                    encoded_cropped_images = [
-                        encode_image_to_base64(img) for img in cropped_images
-                    ]
-                    response = update_response_with_crops(
-                        blueprint, encoded_cropped_images
-                    )
-                    if cropped_images:
-                        img = cropped_images[0]
-                elif action == "average_intensity":
-                    if "crop" in actions:
-                        for i, cropped_image in enumerate(cropped_images):
-                            intensity = calculate_average_intensity(cropped_image)
-                            response["slots"][i]["average_intensity"] = intensity
+            response_format = negotiate_crop_format()
+            try:
+                params = action_params(data)
+            except ValueError as e:
+                return {"error": str(e)}, 400
+
+            # Make sure the camera and its blueprint exist before doing any work
+            fetch_blueprint(camera_id)
+
+            # Repeats of a frame are served from the cache unless the result
+            # depends on state carried between frames
+            digest = response_cache.digest(image_bytes) if process_cacheable(data, params) else None
+            cache_key = process_cache_key(digest, data, params, response_format)
+            cached = cached_crop_response(cache_key)
+            if cached is not None:
+                return cached
+
+            response = process_payload(data, image_bytes, params, response_format)
+            if response is None:
+                return {"error": "Image data could not be decoded"}, 400
 
             log_message("Processed image and updated blueprint successfully", "INFO")
-            return response
+            return make_cached_crop_response(response, response_format, cache_key)
+
+        except ValueError as e:
+            return {"error": str(e)}, 404
+        except BadRequest as e:
+            return {"error": e.description}, 400
+        except (ImageTooLarge, RequestEntityTooLarge) as e:
+            return {"error": str(e)}, 413
+        except Exception as e:
+            return {"error": "An error occurred: " + str(e)}, 500
+
+
+@api.route("/batch", strict_slashes=False)
+class ProcessImageBatch(Resource):
+    @api.expect(process_batch_model)
+    @api.response(200, "Success", process_batch_response_model)
+    def post(self):
+        data = request.get_json() or {}
+        items = data.get("items") if isinstance(data, dict) else None
+
+        if not items or not isinstance(items, list):
+            return {"error": "At least one item must be provided"}, 400
+
+        # One $in query for every camera in the batch; results land in the cache
+        camera_ids = {
+            item["camera_id"]
+            for item in items
+            if batch_item_error(item) is None and item.get("camera_id")
+        }
+        try:
+            blueprint_errors = fetch_blueprints(camera_ids)
+        except Exception as e:
+            return {"error": "An error occurred: " + str(e)}, 500
+
+        # Each item runs in the request's context so its stages are timed
+        futures = [
+            batch_executor.submit(
+                contextvars.copy_context().run, process_batch_item, item, blueprint_errors
+            )
+            for item in items
+        ]
+
+        results = []
+        for index, future in enumerate(futures):
+            try:
+                results.append({"index": index, "result": future.result()})
+            except (ValueError, ImageTooLarge) as e:
+                results.append({"index": index, "error": str(e)})
+            except Exception as e:
+                results.append({"index": index, "error": "An error occurred: " + str(e)})
+
+        log_message(f"Processed batch of {len(items)} images", "INFO")
+        return {"results": results}
+
+
+def spool_video(stream):
+    # cv2.VideoCapture reads from a path, so uploaded videos go to disk first
+    fd, path = tempfile.mkstemp(suffix=".video", dir=os.getenv("VIDEO_TMP_DIR"))
+    with os.fdopen(fd, "wb") as out:
+        shutil.copyfileobj(stream, out, STREAM_CHUNK_SIZE)
+    return path
+
+
+def stream_video_results(samples, data, params, cleanup=None):
+    # One JSON line per sampled frame, written as soon as it is processed
+    image_name = data.get("image_name") or "frame.jpg"
+    frames = 0
+    try:
+        for item in process_samples(
+            samples, image_name, data.get("camera_id"), data.get("actions", []), params
+        ):
+            frames += 1
+            yield json.dumps(item, default=str) + "\n"
+    except ValueError as e:
+        yield json.dumps({"error": str(e)}) + "\n"
+    except Exception as e:
+        # The response has started, so the error can only be reported in-band
+        yield json.dumps({"error": "An error occurred: " + str(e)}) + "\n"
+    finally:
+        if cleanup:
+            cleanup()
+    log_message(f"Processed {frames} video frames", "INFO")
+
+
+@api.route("/video", strict_slashes=False)
+class ProcessVideo(Resource):
+    @api.doc(
+        description=(
+            "Send a video file (raw body or multipart field 'video') or a motion-JPEG "
+            "stream; metadata goes in the query string, X-* headers or form fields"
+        ),
+        params={
+            "camera_id": "ID of the camera to fetch blueprint",
+            "actions": "Comma separated actions, as for /process",
+            "sample_fps": "Frames to process per second of video (default 1)",
+            "sample_every": "Process every n-th frame instead of sampling by time",
+            "max_frames": "Stop after this many processed frames",
+        },
+    )
+    @api.response(200, "Newline-delimited JSON, one line per frame", process_video_line_model)
+    def post(self):
+        try:
+            # Videos and live streams are far bigger than single frames, so
+            # the body is read past the app-wide limit with its own
+            body = limited_input(VIDEO_MAX_CONTENT_LENGTH)
+            if request.mimetype == "multipart/form-data":
+                _, form, files = parse_form_data(
+                    dict(request.environ, **{"wsgi.input": body}),
+                    max_content_length=VIDEO_MAX_CONTENT_LENGTH,
+                )
+                data = normalize_metadata({key: form.get(key) for key in form})
+                upload = files.get("video")
+                source = upload.stream if upload else None
+                mjpeg = upload is not None and upload.mimetype in MJPEG_MIMETYPES
+            else:
+                data = request_metadata()
+                source = body
+                mjpeg = request.mimetype in MJPEG_MIMETYPES
+            camera_id = data.get("camera_id")
+            metrics.label(camera_id, data.get("actions"))
+
+            if source is None or not camera_id:
+                return {"error": "Video data and camera ID must be provided"}, 400
+
+            try:
+                params = action_params(data)
+                sampler = sampler_from_request(data)
+            except ValueError as e:
+                return {"error": str(e)}, 400
+
+            # Fetched once here; every frame after this is a cache hit
+            fetch_blueprint(camera_id)
+
+            if mjpeg:
+                chunks = iter(lambda: source.read(STREAM_CHUNK_SIZE), b"")
+                return Response(
+                    stream_with_context(
+                        stream_video_results(sample_mjpeg(chunks, sampler), data, params)
+                    ),
+                    mimetype=NDJSON_FORMAT,
+                )
+
+            with metrics.stage("read"):
+                path = spool_video(source)
+            try:
+                samples = sample_video(path, sampler)
+            except ValueError as e:
+                os.remove(path)
+                return {"error": str(e)}, 400
+            return Response(
+                stream_video_results(samples, data, params, lambda: os.remove(path)),
+                mimetype=NDJSON_FORMAT,
+            )
 
         except ValueError as e:
             return {"error": str(e)}, 404
+        except BadRequest as e:
+            return {"error": e.description}, 400
+        except RequestEntityTooLarge as e:
+            return {"error": str(e)}, 413
         except Exception as e:
             return {"error": "An error occurred: " + str(e)}, 500
@@ -1,11 +1,13 @@
 from flask import request, jsonify
 from flask_restx import Namespace, Resource, fields
 from utils.image_utils import (
-    decode_image_from_base64,
     handle_rotation,
     encode_image_to_base64,
 )
 from utils.firebase_logger import log_message
+from utils.cpu_pool import cpu_pool
+from utils.metrics import metrics
+from utils.request_utils import read_image_request
 
 api = Namespace("rotate", description="Rotate image operations")
 
@@ -50,32 +52,40 @@ rotate_response_model = api.model(
 )
 
 
+def rotate_frame(img, image_name, angle):
+    if cpu_pool.enabled:
+        # Rotate and encode in the process pool
+        with metrics.stage("rotate_encode"):
+            encoded_image = cpu_pool.rotate_and_encode(img, angle)
+    else:
+        # Perform rotation
+        with metrics.stage("rotate"):
+            rotated_image = handle_rotation(img, angle)
+
+        # Encode back to base64
+        with metrics.stage("encode"):
+            encoded_image = encode_image_to_base64(rotated_image)
+
+    # Generate the rotated image name based on the original image name
+    rotated_image_name = f"{image_name.rsplit('.', 1)[0]}_rotated.{image_name.rsplit('.', 1)[1]}"
+
+    return {"rotated_image": {"name": rotated_image_name, "image": encoded_image}}
+
+
 @api.route("/", strict_slashes=False)
 class RotateImage(Resource):
     @api.expect(rotate_model)
     @api.response(200, "Success", rotate_response_model)
     def post(self):
-        data = request.get_json()
+        # Accepts base64 JSON, multipart/form-data or a raw image body
+        data, img = read_image_request("rotate")
         image_name = data.get("image_name")
-        image_base64 = data.get("image")
         angle = data.get("angle")
 
-        if not image_base64:
+        if img is None:
             return jsonify({"error": "Image data must be provided"}), 400
 
-        # Decode base64 to numpy array
-        img = decode_image_from_base64(image_base64)
-
-        # Perform rotation
-        rotated_image = handle_rotation(img, angle)
-
-        # Encode back to base64
-        encoded_image = encode_image_to_base64(rotated_image)
-
-        # Generate the rotated image name based on the original image name
-        rotated_image_name = f"{image_name.rsplit('.', 1)[0]}_rotated.{image_name.rsplit('.', 1)[1]}"
+        response = rotate_frame(img, image_name, angle)
 
         log_message("Rotated image successfully", "INFO")
-        return jsonify(
-            {"rotated_image": {"name": rotated_image_name, "image": encoded_image}}
-        )
+        return jsonify(response)
@@ -0,0 +1,253 @@
+import contextlib
+import fcntl
+import os
+import re
+import threading
+from collections import OrderedDict
+import cv2
+import numpy as np
+
+# Slots are modelled as low-resolution greyscale thumbnails
+MODEL_SIZE = (32, 32)
+MODEL_DTYPE = np.dtype(
+    [
+        ("count", "<i4"),
+        ("mean", "<f2", MODEL_SIZE[::-1]),
+        ("var", "<f2", MODEL_SIZE[::-1]),
+    ]
+)
+# Variance a slot starts with, and the smallest deviation that counts as
+# change (grey levels), so flat or noiseless slots don't flag every pixel
+INITIAL_VARIANCE = 20.0**2
+MIN_SIGMA = 4.0
+
+
+def slot_thumbnails(img, rects=None):
+    # (n, H, W) float32 greyscale thumbnails; rects=None treats img as a list
+    # of ROIs (rotated slots), otherwise one conversion over the slots' region
+    if rects is None:
+        rois = img
+    else:
+        valid = (rects[:, 2] > rects[:, 0]) & (rects[:, 3] > rects[:, 1])
+        if valid.any():
+            bx1, by1 = rects[valid, 0].min(), rects[valid, 1].min()
+            bx2, by2 = rects[valid, 2].max(), rects[valid, 3].max()
+            img = img[by1:by2, bx1:bx2]
+            rects = rects - np.array([bx1, by1, bx1, by1], dtype=rects.dtype)
+        if img.ndim == 3:
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        # Slots outside the frame stay empty (their shifted bounds can be negative)
+        rois = [
+            img[y1:y2, x1:x2] if ok else img[:0, :0]
+            for (x1, y1, x2, y2), ok in zip(rects.tolist(), valid.tolist())
+        ]
+
+    thumbnails = np.full((len(rois),) + MODEL_SIZE[::-1], np.nan, dtype=np.float32)
+    for i, roi in enumerate(rois):
+        if roi.size == 0:
+            continue
+        if roi.ndim == 3:
+            roi = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
+        thumbnails[i] = cv2.resize(roi, MODEL_SIZE, interpolation=cv2.INTER_AREA)
+    return thumbnails
+
+
+def _empty_model(slot_count):
+    return np.zeros(slot_count, dtype=MODEL_DTYPE)
+
+
+class MemoryBackgroundStore:
+    # Models live in this worker only and are lost on restart
+    def __init__(self):
+        self._models = {}
+
+    def load(self, camera_id, slot_count):
+        model = self._models.get(camera_id)
+        if model is None or len(model) != slot_count:
+            model = self._models[camera_id] = _empty_model(slot_count)
+        return model
+
+    def save(self, camera_id, model):
+        pass
+
+    def lock(self, camera_id):
+        return contextlib.nullcontext()
+
+    def is_current(self, camera_id, model):
+        return True
+
+
+class MemmapBackgroundStore:
+    # One .npy file per camera, memory-mapped, so every gunicorn worker on
+    # the host reads and updates the same model and it survives restarts.
+    # Updates hold an flock on the camera, and a resized model is written to
+    # a new file and renamed over the old one, never truncated in place
+    def __init__(self, directory=None):
+        self.directory = directory or os.getenv("BACKGROUND_DIR", "/tmp/background-models")
+        os.makedirs(self.directory, exist_ok=True)
+        self._inodes = {}
+
+    def _path(self, camera_id):
+        return os.path.join(self.directory, re.sub(r"[^\w-]", "_", str(camera_id)) + ".npy")
+
+    @contextlib.contextmanager
+    def lock(self, camera_id):
+        with open(self._path(camera_id) + ".lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def is_current(self, camera_id, model):
+        # Another worker may have replaced the file since it was mapped
+        try:
+            return os.stat(self._path(camera_id)).st_ino == self._inodes.get(camera_id)
+        except FileNotFoundError:
+            return False
+
+    def load(self, camera_id, slot_count):
+        # Called with the camera's lock held
+        path = self._path(camera_id)
+        if os.path.exists(path):
+            model = np.lib.format.open_memmap(path, mode="r+")
+            if model.dtype == MODEL_DTYPE and len(model) == slot_count:
+                self._inodes[camera_id] = os.stat(path).st_ino
+                return model
+            del model
+        # New camera, or the blueprint's slot count changed
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        model = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=MODEL_DTYPE, shape=(slot_count,))
+        model[:] = _empty_model(slot_count)
+        model.flush()
+        os.replace(tmp_path, path)
+        self._inodes[camera_id] = os.stat(path).st_ino
+        return model
+
+    def save(self, camera_id, model):
+        # The mapping is shared, so the kernel writes the pages back; an
+        # msync per frame would only add latency
+        pass
+
+
+class MongoBackgroundStore:
+    # Models in their own collection next to the cameras, keyed by camera
+    # _id. They are kept out of the camera documents so saving one doesn't
+    # invalidate the cached blueprints. Written every sync_interval updates
+    def __init__(self, sync_interval=None):
+        self.sync_interval = int(sync_interval or os.getenv("BACKGROUND_SYNC_INTERVAL", "30"))
+        self._updates = {}
+
+    def _collection(self):
+        from config.database import MongoDBClient
+
+        return MongoDBClient().get_client()["test"]["background_models"]
+
+    # Each worker learns on its own copy; the last one to sync wins
+    def lock(self, camera_id):
+        return contextlib.nullcontext()
+
+    def is_current(self, camera_id, model):
+        return True
+
+    def load(self, camera_id, slot_count):
+        doc = self._collection().find_one({"_id": camera_id})
+        if doc is not None and doc.get("slots") == slot_count:
+            return np.frombuffer(doc["model"], dtype=MODEL_DTYPE).copy()
+        return _empty_model(slot_count)
+
+    def save(self, camera_id, model):
+        updates = self._updates.get(camera_id, 0) + 1
+        self._updates[camera_id] = updates
+        if updates % self.sync_interval:
+            return
+        from bson.binary import Binary
+
+        self._collection().replace_one(
+            {"_id": camera_id},
+            {"_id": camera_id, "slots": len(model), "model": Binary(model.tobytes())},
+            upsert=True,
+        )
+
+
+BACKGROUND_STORES = {
+    "memory": MemoryBackgroundStore,
+    "memmap": MemmapBackgroundStore,
+    "mongo": MongoBackgroundStore,
+}
+
+
+class BackgroundModels:
+    # Exponential moving average and variance of every slot's thumbnail;
+    # each frame is scored against the model and then folded into it
+    def __init__(self, store=None, alpha=None, threshold=None, warmup=None, max_cameras=None):
+        self._store = store
+        self.alpha = float(alpha or os.getenv("BACKGROUND_ALPHA", "0.05"))
+        # A pixel has changed when it's this many standard deviations away
+        self.threshold = float(threshold or os.getenv("BACKGROUND_THRESHOLD", "2.5"))
+        # Frames a slot needs before its score is reported
+        self.warmup = int(warmup or os.getenv("BACKGROUND_WARMUP", "5"))
+        self.max_cameras = int(max_cameras or os.getenv("BACKGROUND_CAMERAS", "512"))
+        # Feed every /process frame that cuts slots, not only change_score ones
+        self.learn_all = os.getenv("BACKGROUND_LEARN_ALL", "false").lower() == "true"
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def store(self):
+        if self._store is None:
+            self._store = BACKGROUND_STORES[os.getenv("BACKGROUND_STORE", "memmap").lower()]()
+        return self._store
+
+    def _model(self, camera_id, slot_count):
+        model = self._models.get(camera_id)
+        if (
+            model is None
+            or len(model) != slot_count
+            or not self.store.is_current(camera_id, model)
+        ):
+            model = self._models[camera_id] = self.store.load(camera_id, slot_count)
+        self._models.move_to_end(camera_id)
+        while len(self._models) > self.max_cameras:
+            self._models.popitem(last=False)
+        return model
+
+    def score_and_update(self, camera_id, slot_count, slot_indices, thumbnails, update=True):
+        # Share of each slot's pixels that deviate from the background; None
+        # for slots still warming up or outside the frame
+        with self._lock, self.store.lock(camera_id):
+            model = self._model(camera_id, slot_count)
+            entries = model[slot_indices]
+            mean = entries["mean"].astype(np.float32)
+            var = entries["var"].astype(np.float32)
+            counts = entries["count"]
+
+            present = ~np.isnan(thumbnails[:, 0, 0])
+            deviation = np.abs(thumbnails - mean)
+            sigma = np.maximum(np.sqrt(var), MIN_SIGMA)
+            changed = (deviation > self.threshold * sigma).mean(axis=(1, 2))
+            scores = [
+                float(score) if ok and count >= self.warmup else None
+                for score, ok, count in zip(changed.tolist(), present.tolist(), counts.tolist())
+            ]
+
+            if update and present.any():
+                fresh = present & (counts == 0)
+                seen = present & (counts > 0)
+                # First frame initialises the slot, later ones are blended in
+                mean[fresh] = thumbnails[fresh]
+                var[fresh] = INITIAL_VARIANCE
+                delta = thumbnails[seen] - mean[seen]
+                mean[seen] += self.alpha * delta
+                var[seen] = (1 - self.alpha) * (var[seen] + self.alpha * delta**2)
+
+                indices = np.asarray(slot_indices)[present]
+                model["mean"][indices] = mean[present]
+                model["var"][indices] = var[present]
+                model["count"][indices] = np.minimum(counts[present].astype(np.int64) + 1, 2**31 - 1)
+                self.store.save(camera_id, model)
+
+            return scores
+
+
+background_models = BackgroundModels()
@@ -0,0 +1,198 @@
+import copy
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from pymongo.errors import PyMongoError
+
+
+def blueprint_fingerprint(blueprint):
+    # Stable digest of a blueprint, used to detect changes when polling
+    payload = json.dumps(blueprint, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha1(payload).hexdigest()
+
+
+class BlueprintCache:
+    def __init__(self, ttl=None, max_size=None, poll_interval=None):
+        self.ttl = float(ttl if ttl is not None else os.getenv("BLUEPRINT_CACHE_TTL", "300"))
+        self.max_size = int(
+            max_size if max_size is not None else os.getenv("BLUEPRINT_CACHE_SIZE", "256")
+        )
+        self.poll_interval = float(
+            poll_interval
+            if poll_interval is not None
+            else os.getenv("BLUEPRINT_CACHE_POLL_INTERVAL", "30")
+        )
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._watcher = None
+        self._watcher_pid = None
+        self._stop = threading.Event()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, camera_id, loader):
+        key = str(camera_id)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry["expires_at"] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(entry["blueprint"])
+            self.misses += 1
+
+        # Load outside the lock so a slow lookup doesn't block other cameras
+        blueprint = loader(camera_id)
+        self.put(key, blueprint)
+        return copy.deepcopy(blueprint)
+
+    def put(self, camera_id, blueprint):
+        key = str(camera_id)
+        entry = {
+            "blueprint": copy.deepcopy(blueprint),
+            "fingerprint": blueprint_fingerprint(blueprint),
+            "expires_at": time.monotonic() + self.ttl,
+            # Derived objects (crop plans) live and die with the blueprint
+            "plans": {},
+        }
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_plan(self, camera_id, plan_key, loader, builder):
+        key = str(camera_id)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry["expires_at"] > now:
+                plan = entry["plans"].get(plan_key)
+                if plan is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return plan
+
+        blueprint = self.get(camera_id, loader)
+        plan = builder(blueprint)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry["fingerprint"] == blueprint_fingerprint(blueprint):
+                entry["plans"][plan_key] = plan
+        return plan
+
+    def lookup(self, camera_id):
+        # Copy of the cached blueprint, or None on a miss; for callers that
+        # load blueprints themselves (e.g. with an async driver)
+        with self._lock:
+            entry = self._entries.get(str(camera_id))
+            if entry is not None and entry["expires_at"] > time.monotonic():
+                self._entries.move_to_end(str(camera_id))
+                self.hits += 1
+                return copy.deepcopy(entry["blueprint"])
+            self.misses += 1
+            return None
+
+    def contains(self, camera_id):
+        with self._lock:
+            entry = self._entries.get(str(camera_id))
+            return entry is not None and entry["expires_at"] > time.monotonic()
+
+    def fingerprint(self, camera_id):
+        with self._lock:
+            entry = self._entries.get(str(camera_id))
+            return entry["fingerprint"] if entry else None
+
+    def invalidate(self, camera_id):
+        with self._lock:
+            if self._entries.pop(str(camera_id), None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def cached_ids(self):
+        with self._lock:
+            return list(self._entries.keys())
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "watcher": self._watcher.name if self._watcher else None,
+            }
+
+    # Invalidation
+    def start_watcher(self, collection):
+        # Threads don't survive a fork, so every worker starts its own watcher
+        pid = os.getpid()
+        if self._watcher is not None and self._watcher_pid == pid and self._watcher.is_alive():
+            return
+        self._stop.clear()
+        self._watcher_pid = pid
+        self._watcher = threading.Thread(
+            target=self._watch, args=(collection,), name="blueprint-change-stream", daemon=True
+        )
+        self._watcher.start()
+
+    def stop_watcher(self):
+        self._stop.set()
+
+    def _watch(self, collection):
+        pipeline = [
+            {"$match": {"operationType": {"$in": ["update", "replace", "delete"]}}}
+        ]
+        try:
+            with collection.watch(pipeline) as stream:
+                while not self._stop.is_set():
+                    change = stream.try_next()
+                    if change is None:
+                        self._stop.wait(1)
+                        continue
+                    self.invalidate(change["documentKey"]["_id"])
+        except PyMongoError as e:
+            # Change streams need a replica set; standalone servers fall back to polling
+            print(f"Blueprint change stream unavailable, polling instead: {e}")
+            threading.current_thread().name = "blueprint-poller"
+            self._poll(collection)
+
+    def _poll(self, collection):
+        from bson.objectid import ObjectId
+
+        while not self._stop.wait(self.poll_interval):
+            camera_ids = self.cached_ids()
+            if not camera_ids:
+                continue
+            try:
+                docs = collection.find(
+                    {"_id": {"$in": [ObjectId(i) for i in camera_ids]}},
+                    {"blueprint": 1},
+                )
+                current = {str(doc["_id"]): doc.get("blueprint") for doc in docs}
+            except PyMongoError as e:
+                print(f"Error polling blueprints: {e}")
+                continue
+
+            for camera_id in camera_ids:
+                blueprint = current.get(camera_id)
+                if blueprint is None or blueprint_fingerprint(blueprint) != self.fingerprint(camera_id):
+                    self.invalidate(camera_id)
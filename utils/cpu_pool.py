@@ -0,0 +1,221 @@
+import atexit
+import base64
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import cv2
+import numpy as np
+from utils.crop_engine import crop_rois
+from utils.image_utils import handle_rotation, encode_image_to_bytes
+from utils.roi_encoder import roi_encoder
+from utils.variant_utils import create_random_variants
+
+# Encoded outputs start on a cache-line boundary after the frame
+ALIGNMENT = 64
+
+
+class ArenaFull(Exception):
+    pass
+
+
+def _aligned(nbytes):
+    return -(-nbytes // ALIGNMENT) * ALIGNMENT
+
+
+# Pool process side: the arena blocks are attached once per process
+_attached = {}
+
+
+def _attach_arena(names):
+    # One OpenCV thread per process; the parallelism comes from the pool
+    cv2.setNumThreads(1)
+    roi_encoder.max_workers = 1
+    for name in names:
+        _attached[name] = shared_memory.SharedMemory(name=name)
+
+
+class _SharedWriter:
+    # Copies encoded outputs into the block behind the frame and hands back
+    # (offset, length) references instead of pickled bytes
+    def __init__(self, buf, offset):
+        self.buf = np.frombuffer(buf, dtype=np.uint8)
+        self.offset = offset
+
+    def add(self, encoded):
+        if encoded is None:
+            return None
+        encoded = np.frombuffer(encoded, dtype=np.uint8)
+        end = self.offset + len(encoded)
+        if end > len(self.buf):
+            raise ArenaFull("Encoded output does not fit in the arena block")
+        self.buf[self.offset:end] = encoded
+        ref = (self.offset, len(encoded))
+        self.offset = _aligned(end)
+        return ref
+
+
+class _InlineWriter:
+    def add(self, encoded):
+        return None if encoded is None else bytes(encoded)
+
+
+def _crop_job(frame, writer, rects, options):
+    encoded, _ = roi_encoder.encode(crop_rois(frame, rects), options, as_base64=False)
+    return [writer.add(roi) for roi in encoded]
+
+
+def _rotate_job(frame, writer, angle):
+    return [writer.add(encode_image_to_bytes(handle_rotation(frame, angle)))]
+
+
+def _variants_job(frame, writer, options):
+    # Same generator as the in-process path, so CPU_POOL_WORKERS doesn't
+    # change the variants a seed produces; each is encoded into the block
+    return [writer.add(encode_image_to_bytes(v)) for v in create_random_variants(frame, **options)]
+
+
+JOBS = {
+    "crop": _crop_job,
+    "rotate": _rotate_job,
+    "variants": _variants_job,
+}
+
+
+def _run_job(job, name, shape, dtype, args):
+    block = _attached[name]
+    frame = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+    writer = _SharedWriter(block.buf, _aligned(frame.nbytes))
+    return JOBS[job](frame, writer, *args)
+
+
+class CPUPool:
+    # Runs crop, rotate and variant jobs in a process pool. Frames are copied
+    # once into a preallocated shared-memory block, the pool works on a
+    # zero-copy view of it and writes the encoded results back into the same
+    # block. Disabled (everything runs in-process) when CPU_POOL_WORKERS is 0
+    def __init__(self, workers=None, slots=None, slot_bytes=None):
+        self.workers = int(workers if workers is not None else os.getenv("CPU_POOL_WORKERS", "0"))
+        # Frames in flight at once; a request waits for a free block
+        self.slots = int(slots or os.getenv("CPU_POOL_ARENA_SLOTS", str(max(self.workers * 2, 1))))
+        self.slot_bytes = int(
+            slot_bytes or float(os.getenv("CPU_POOL_SLOT_MB", "64")) * 1024 * 1024
+        )
+        self.acquire_timeout = float(os.getenv("CPU_POOL_ACQUIRE_TIMEOUT", "1.0"))
+        self.start_method = os.getenv("CPU_POOL_START_METHOD", "spawn")
+        self._executor = None
+        self._blocks = []
+        self._free = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._closed_hook = False
+        self.pooled = 0
+        self.inline = 0
+
+    @property
+    def enabled(self):
+        return self.workers > 0
+
+    def _ensure_started(self):
+        # Shared memory and the pool belong to the process that created them,
+        # so each gunicorn worker sets up its own
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._blocks = [
+                shared_memory.SharedMemory(create=True, size=self.slot_bytes)
+                for _ in range(self.slots)
+            ]
+            self._free = queue.Queue()
+            for block in self._blocks:
+                self._free.put(block)
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context(self.start_method),
+                initializer=_attach_arena,
+                initargs=([block.name for block in self._blocks],),
+            )
+            self._pid = pid
+            if not self._closed_hook:
+                atexit.register(self.close)
+                self._closed_hook = True
+
+    def _run_inline(self, job, frame, args):
+        with self._lock:
+            self.inline += 1
+        return JOBS[job](frame, _InlineWriter(), *args)
+
+    def run(self, job, frame, *args):
+        # Returns the job's encoded outputs as bytes, None for empty ones
+        if not self.enabled or _aligned(frame.nbytes) >= self.slot_bytes:
+            return self._run_inline(job, frame, args)
+
+        self._ensure_started()
+        try:
+            block = self._free.get(timeout=self.acquire_timeout)
+        except queue.Empty:
+            return self._run_inline(job, frame, args)
+
+        try:
+            np.ndarray(frame.shape, dtype=frame.dtype, buffer=block.buf)[...] = frame
+            refs = self._executor.submit(
+                _run_job, job, block.name, frame.shape, frame.dtype.str, args
+            ).result()
+            results = [
+                None if ref is None else bytes(block.buf[ref[0]:ref[0] + ref[1]])
+                for ref in refs
+            ]
+        except ArenaFull:
+            return self._run_inline(job, frame, args)
+        finally:
+            self._free.put(block)
+
+        with self._lock:
+            self.pooled += 1
+        return results
+
+    def crop_and_encode(self, frame, rects, options, as_base64=True):
+        encoded = self.run("crop", frame, rects, options)
+        if not as_base64:
+            return encoded
+        return [None if roi is None else base64.b64encode(roi).decode("utf-8") for roi in encoded]
+
+    def rotate_and_encode(self, frame, angle):
+        encoded = self.run("rotate", frame, angle)[0]
+        return None if encoded is None else base64.b64encode(encoded).decode("utf-8")
+
+    def encode_variants(self, frame, options):
+        return [
+            None if variant is None else base64.b64encode(variant).decode("utf-8")
+            for variant in self.run("variants", frame, options)
+        ]
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "workers": self.workers,
+            "arena_slots": self.slots,
+            "arena_slot_mb": self.slot_bytes / (1024 * 1024),
+            "pooled_jobs": self.pooled,
+            "inline_jobs": self.inline,
+        }
+
+    def close(self):
+        if self._pid != os.getpid():
+            return
+        with self._lock:
+            self._executor.shutdown(wait=True)
+            for block in self._blocks:
+                block.close()
+                block.unlink()
+            self._executor = None
+            self._blocks = []
+            self._pid = None
+
+
+cpu_pool = CPUPool()
@@ -0,0 +1,93 @@
+import cv2
+import numpy as np
+
+COORDINATE_KEYS = ("x1", "y1", "w", "h")
+
+
+def compile_slot_rects(blueprint, image_shape, scale=1.0):
+    # Turn the blueprint's coordinate dicts into an (n, 4) int32 array of
+    # clamped x1, y1, x2, y2 bounds plus a mask of slots that have a coordinate.
+    # scale maps blueprint coordinates onto a resized frame
+    slots = blueprint.get("slots", [])
+    coords = np.zeros((len(slots), 4), dtype=np.float64)
+    has_coordinate = np.zeros(len(slots), dtype=bool)
+
+    for i, slot in enumerate(slots):
+        coordinate = slot.get("coordinate")
+        if coordinate:
+            coords[i] = [float(coordinate[k]) for k in COORDINATE_KEYS]
+            has_coordinate[i] = True
+
+    if scale != 1.0:
+        coords *= scale
+
+    height, width = image_shape[:2]
+    rects = np.empty((len(slots), 4), dtype=np.int32)
+    # Truncate toward zero like int() did, then clamp to the frame
+    rects[:, 0] = np.clip(np.trunc(coords[:, 0]), 0, width)
+    rects[:, 1] = np.clip(np.trunc(coords[:, 1]), 0, height)
+    rects[:, 2] = np.clip(np.trunc(coords[:, 0] + coords[:, 2]), 0, width)
+    rects[:, 3] = np.clip(np.trunc(coords[:, 1] + coords[:, 3]), 0, height)
+    rects[:, 2] = np.maximum(rects[:, 2], rects[:, 0])
+    rects[:, 3] = np.maximum(rects[:, 3], rects[:, 1])
+
+    return rects, has_coordinate
+
+
+def crop_rois(img, rects):
+    # Views into img, no pixel data is copied
+    return [img[y1:y2, x1:x2] for x1, y1, x2, y2 in rects.tolist()]
+
+
+def rect_sums(integral, rects):
+    x1, y1, x2, y2 = rects[:, 0], rects[:, 1], rects[:, 2], rects[:, 3]
+    sums = integral[y2, x2] - integral[y1, x2] - integral[y2, x1] + integral[y1, x1]
+    if sums.ndim > 1:
+        sums = sums.sum(axis=1)
+    return sums
+
+
+def slot_statistics(img, rects, histogram_bins=None, std=False):
+    # Per-slot mean (and std on request) over all channels from integral
+    # images in O(1) per rectangle. The tables only cover the slots' bounding
+    # box and hold channel sums, not one float64 plane per channel
+    channels = 1 if img.ndim == 2 else img.shape[2]
+    counts = (
+        (rects[:, 2] - rects[:, 0]).astype(np.float64)
+        * (rects[:, 3] - rects[:, 1])
+        * channels
+    )
+    mean = np.full(len(rects), np.nan)
+    stats = {"mean": mean, "count": counts}
+    if std:
+        stats["std"] = np.full(len(rects), np.nan)
+    if histogram_bins:
+        stats["histogram"] = np.zeros((len(rects), histogram_bins), dtype=np.float32)
+
+    valid = counts > 0
+    if not valid.any():
+        return stats
+    bx1, by1 = rects[valid, 0].min(), rects[valid, 1].min()
+    bx2, by2 = rects[valid, 2].max(), rects[valid, 3].max()
+    region = img[by1:by2, bx1:bx2]
+    local = rects[valid] - np.array([bx1, by1, bx1, by1], dtype=rects.dtype)
+
+    # float32 holds channel sums and squares exactly and is accepted by integral
+    plane = region if channels == 1 else region.sum(axis=2, dtype=np.float32)
+    sums = rect_sums(cv2.integral(plane, sdepth=cv2.CV_64F), local)
+    mean[valid] = sums / counts[valid]
+
+    if std:
+        squares = region.astype(np.float32) ** 2
+        if channels > 1:
+            squares = squares.sum(axis=2)
+        squared_sums = rect_sums(cv2.integral(squares, sdepth=cv2.CV_64F), local)
+        stats["std"][valid] = np.sqrt(np.maximum(squared_sums / counts[valid] - mean[valid] ** 2, 0))
+
+    if histogram_bins:
+        gray = region if channels == 1 else cv2.cvtColor(region, cv2.COLOR_BGR2GRAY)
+        for i, roi in zip(np.flatnonzero(valid), crop_rois(gray, local)):
+            hist = cv2.calcHist([roi], [0], None, [histogram_bins], [0, 256])
+            stats["histogram"][i] = hist[:, 0] / roi.size
+
+    return stats
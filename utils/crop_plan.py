@@ -0,0 +1,51 @@
+import copy
+import numpy as np
+from utils.crop_engine import compile_slot_rects, crop_rois, slot_statistics
+
+
+class CropPlan:
+    # Everything about cropping a camera's frames that doesn't depend on the
+    # pixels, built once per (camera_id, image shape, rotation angle, scale)
+    def __init__(self, blueprint, image_shape, angle=0, scale=1.0):
+        self.image_shape = tuple(image_shape[:2])
+        self.angle = angle
+        self.scale = scale
+
+        rects, has_coordinate = compile_slot_rects(blueprint, image_shape, scale)
+        self.slot_indices = np.flatnonzero(has_coordinate)
+        self.rects = rects[has_coordinate]
+
+        slots = blueprint.get("slots", [])
+        self.filename_suffixes = [f"_crop_{i + 1}" for i in range(len(slots))]
+        self.template = copy.deepcopy(blueprint)
+        self.template["slots"] = [dict(slot) for slot in slots]
+
+    def filenames(self, image_name):
+        # Same naming scheme as generate_filenames
+        base_name = image_name.rsplit(".", 1)[0]
+        extension = image_name.rsplit(".", 1)[-1]
+        return [f"{base_name}{suffix}.{extension}" for suffix in self.filename_suffixes]
+
+    def build_response(self, image_name):
+        # Fresh top-level and slot dicts; the nested coordinate dicts are
+        # shared with the template and must be treated as read-only
+        response = dict(self.template)
+        response["file_name"] = image_name
+        response["slots"] = [
+            dict(slot, file_name=file_name)
+            for slot, file_name in zip(self.template["slots"], self.filenames(image_name))
+        ]
+        return response
+
+    def crop(self, img):
+        return crop_rois(img, self.rects)
+
+    def statistics(self, img, histogram_bins=None, std=False):
+        return slot_statistics(img, self.rects, histogram_bins, std)
+
+    def fill_slots(self, response, field, values):
+        # values are ordered like self.rects, i.e. only slots with a coordinate
+        slots = response["slots"]
+        for slot_index, value in zip(self.slot_indices.tolist(), values):
+            slots[slot_index][field] = value
+        return response
@@ -1,28 +1,151 @@
 from pymongo import MongoClient
+import copy
 from bson.objectid import ObjectId
+from bson.errors import InvalidId
+import os
 from config.database import (
     MongoDBClient,
 )  # Ensure this file contains the MongoDBClient setup
+from utils.blueprint_cache import BlueprintCache
+from utils.crop_plan import CropPlan
+from utils.metrics import metrics
 
+# Camera documents are large; lookups only need the blueprint
+BLUEPRINT_PROJECTION = {"blueprint": 1}
 
-def fetch_blueprint(camera_id):
+# Per-worker cache of camera blueprints, keyed by camera_id
+blueprint_cache = BlueprintCache()
+
+
+class CameraNotFound(ValueError):
+    # The camera or its blueprint doesn't exist (404); other ValueErrors are
+    # bad input
+    pass
+
+
+def get_camera_collection():
     # Initialize MongoDB connection
     mongo_client = MongoDBClient()
     db = mongo_client.get_client()
 
+    # Update with the correct database name if different
+    return db["test"].get_collection(
+        "cameras", read_preference=mongo_client.blueprint_read_preference()
+    )
+
+
+def load_blueprint(camera_id):
     # Access the Camera collection and fetch the blueprint
-    camera_collection = db["test"][
-        "cameras"
-    ]  # Update with the correct database name if different
-    camera_doc = camera_collection.find_one({"_id": ObjectId(camera_id)})
+    camera_collection = get_camera_collection()
+    camera_doc = camera_collection.find_one(
+        {"_id": ObjectId(camera_id)}, BLUEPRINT_PROJECTION
+    )
 
     if not camera_doc:
-        raise ValueError("Camera not found")
+        raise CameraNotFound("Camera not found")
 
     blueprint = camera_doc.get("blueprint")
 
     if not blueprint:
-        raise ValueError("Blueprint not found for the given Camera")
+        raise CameraNotFound("Blueprint not found for the given Camera")
 
     # Return the prepared data
     return blueprint
+
+
+def ensure_blueprint_watcher():
+    if os.getenv("BLUEPRINT_CACHE_WATCH", "true").lower() == "true":
+        blueprint_cache.start_watcher(get_camera_collection())
+
+
+async def fetch_blueprint_async(camera_id):
+    # Same contract as fetch_blueprint, with the lookup done through motor.
+    # The watcher thread uses the synchronous client and only starts once
+    ensure_blueprint_watcher()
+    blueprint = blueprint_cache.lookup(camera_id)
+    if blueprint is not None:
+        return blueprint
+
+    mongo_client = MongoDBClient()
+    camera_collection = mongo_client.get_async_client()["test"].get_collection(
+        "cameras", read_preference=mongo_client.blueprint_read_preference()
+    )
+    camera_doc = await camera_collection.find_one(
+        {"_id": ObjectId(camera_id)}, BLUEPRINT_PROJECTION
+    )
+
+    if not camera_doc:
+        raise CameraNotFound("Camera not found")
+
+    blueprint = camera_doc.get("blueprint")
+
+    if not blueprint:
+        raise CameraNotFound("Blueprint not found for the given Camera")
+
+    blueprint_cache.put(camera_id, blueprint)
+    return copy.deepcopy(blueprint)
+
+
+def fetch_blueprint(camera_id):
+    ensure_blueprint_watcher()
+
+    # Callers get their own copy, so writing into it never touches the cache
+    with metrics.stage("fetch_blueprint"):
+        return blueprint_cache.get(camera_id, load_blueprint)
+
+
+def blueprint_version(camera_id):
+    # Fingerprint of the cached blueprint, None until it has been fetched
+    if not blueprint_cache.contains(camera_id):
+        return None
+    return blueprint_cache.fingerprint(camera_id)
+
+
+def fetch_blueprints(camera_ids):
+    # Warm the cache for many cameras with a single $in query. Returns a
+    # dict of camera_id -> error message for the ones that couldn't be loaded
+    ensure_blueprint_watcher()
+
+    errors = {}
+    object_ids = {}
+    for camera_id in camera_ids:
+        if blueprint_cache.contains(camera_id):
+            continue
+        try:
+            object_ids[ObjectId(camera_id)] = camera_id
+        except (InvalidId, TypeError):
+            errors[camera_id] = "Invalid camera ID"
+
+    if object_ids:
+        camera_collection = get_camera_collection()
+        found = set()
+        for camera_doc in camera_collection.find(
+            {"_id": {"$in": list(object_ids)}}, BLUEPRINT_PROJECTION
+        ):
+            camera_id = object_ids[camera_doc["_id"]]
+            found.add(camera_id)
+            blueprint = camera_doc.get("blueprint")
+            if blueprint:
+                blueprint_cache.put(camera_id, blueprint)
+            else:
+                errors[camera_id] = "Blueprint not found for the given Camera"
+
+        for camera_id in object_ids.values():
+            if camera_id not in found:
+                errors[camera_id] = "Camera not found"
+
+    return errors
+
+
+def fetch_crop_plan(camera_id, image_shape, angle=0, scale=1.0):
+    ensure_blueprint_watcher()
+
+    # Plans are shared between requests and invalidated with the blueprint
+    plan_key = (tuple(image_shape[:2]), angle, scale)
+    with metrics.stage("crop_plan"):
+        return blueprint_cache.get_plan(
+            camera_id,
+            plan_key,
+            load_blueprint,
+            lambda blueprint: CropPlan(blueprint, image_shape, angle, scale),
+        )
@@ -0,0 +1,83 @@
+import os
+import threading
+import cv2
+import numpy as np
+from utils.image_utils import decode_image_from_bytes
+
+# JPEG decoders can skip DCT coefficients and hand back 1/2, 1/4 or 1/8 size
+REDUCED_COLOR_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+# Actions that only need statistics, never the pixels of an ROI
+STATS_ONLY_ACTIONS = {"rotate", "average_intensity"}
+
+
+class DecodeStrategy:
+    # Picks the cheapest decode the requested outputs allow. Every
+    # calibration_interval-th reduced decode is repeated at full resolution to
+    # measure the error; a key whose error exceeds the tolerance is stepped
+    # down to the next finer reduction. Off by default: reduced decodes give
+    # approximate statistics, so DECODE_MAX_REDUCTION (2, 4 or 8) opts in
+    def __init__(self, max_reduction=None, tolerance=None, calibration_interval=None):
+        self.max_reduction = int(max_reduction or os.getenv("DECODE_MAX_REDUCTION", "1"))
+        self.tolerance = float(tolerance or os.getenv("DECODE_TOLERANCE", "1.0"))
+        self.calibration_interval = int(
+            calibration_interval or os.getenv("DECODE_CALIBRATION_INTERVAL", "100")
+        )
+        self._lock = threading.Lock()
+        self._reduction = {}
+        self._decodes = {}
+        self._errors = {}
+
+    def reduction_for(self, key):
+        with self._lock:
+            return self._reduction.get(key, self.max_reduction)
+
+    def _should_calibrate(self, key):
+        with self._lock:
+            count = self._decodes.get(key, 0)
+            self._decodes[key] = count + 1
+            return count % self.calibration_interval == 0
+
+    def _record_error(self, key, reduction, error):
+        with self._lock:
+            self._errors[key] = error
+            if error > self.tolerance and self._reduction.get(key, self.max_reduction) == reduction:
+                self._reduction[key] = max(reduction // 2, 1)
+
+    def decode(self, image_bytes, key, stats_only, measure=None):
+        # Returns (img, scale, report); scale maps full-resolution coordinates
+        # onto the decoded image
+        reduction = self.reduction_for(key) if stats_only else 1
+        img = decode_image_from_bytes(image_bytes, REDUCED_COLOR_FLAGS[reduction])
+        if img is None:
+            return None, 1.0, None
+        if reduction == 1:
+            return img, 1.0, None
+
+        report = {"reduction": reduction, "estimated_error": self._errors.get(key)}
+        if measure is not None and self._should_calibrate(key):
+            full = decode_image_from_bytes(image_bytes)
+            reduced_values = np.asarray(measure(img, 1.0 / reduction), dtype=np.float64)
+            full_values = np.asarray(measure(full, 1.0), dtype=np.float64)
+            error = float(np.nanmax(np.abs(reduced_values - full_values), initial=0.0))
+            self._record_error(key, reduction, error)
+            report["estimated_error"] = error
+
+        return img, 1.0 / reduction, report
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_reduction": self.max_reduction,
+                "tolerance": self.tolerance,
+                "reduction": dict(self._reduction),
+                "errors": dict(self._errors),
+            }
+
+
+decode_strategy = DecodeStrategy()
@@ -1,36 +1,158 @@
-import firebase_admin
-from firebase_admin import credentials, firestore
+import atexit
+import json
 import os
+import queue
+import threading
 import datetime
 from dotenv import load_dotenv
+from utils.metrics import metrics
 
 
-class FirebaseLogger:
+class FirestoreSink:
     def __init__(self):
-        load_dotenv(dotenv_path='/app/.env')
+        import firebase_admin
+        from firebase_admin import credentials, firestore
+
         self.cred_path = os.getenv('GOOGLE_APPLICATION_CREDENTIALS')
         self.cred = credentials.Certificate(self.cred_path)
-        self.app = firebase_admin.initialize_app(self.cred)
-        self.db = firestore.client()
+        try:
+            self.app = firebase_admin.get_app()
+        except ValueError:
+            self.app = firebase_admin.initialize_app(self.cred)
+        self.db = firestore.client(self.app)
+
+    def write(self, records):
+        # Firestore batches are limited to 500 writes
+        for start in range(0, len(records), 500):
+            batch = self.db.batch()
+            for collection, document, data in records[start:start + 500]:
+                batch.set(self.db.collection(collection).document(document), data)
+            batch.commit()
+
+
+class FileSink:
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, records):
+        with open(self.path, 'a') as f:
+            for collection, document, data in records:
+                f.write(json.dumps(dict(data, collection=collection, id=document)) + '\n')
+
+
+class NullSink:
+    def write(self, records):
+        pass
+
+
+def create_sink():
+    sink = os.getenv('LOG_SINK', 'firestore').lower()
+    if sink == 'null':
+        return NullSink()
+    if sink == 'file':
+        return FileSink(os.getenv('LOG_FILE', 'logs.jsonl'))
+    try:
+        return FirestoreSink()
+    except Exception as e:
+        # A missing credential shouldn't take the whole service down
+        print(f"Firebase logging disabled: {e}")
+        return NullSink()
+
+
+class FirebaseLogger:
+    def __init__(self, sink=None, flush_interval=None, batch_size=None,
+                 max_queue_size=None, overflow=None):
+        load_dotenv(dotenv_path='/app/.env')
+        self._sink = sink
+        self.flush_interval = float(flush_interval or os.getenv('LOG_FLUSH_INTERVAL', '2'))
+        self.batch_size = int(batch_size or os.getenv('LOG_BATCH_SIZE', '100'))
+        self.max_queue_size = int(max_queue_size or os.getenv('LOG_QUEUE_SIZE', '10000'))
+        # 'drop' discards new messages when the queue is full, 'block' waits
+        self.overflow = (overflow or os.getenv('LOG_OVERFLOW', 'drop')).lower()
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=self.max_queue_size)
+        self._lock = threading.Lock()
+        self._flusher = None
+        self._flusher_pid = None
+        self._stop = threading.Event()
+
+    @property
+    def sink(self):
+        # Created lazily, so importing this module never touches Firebase
+        if self._sink is None:
+            with self._lock:
+                if self._sink is None:
+                    self._sink = create_sink()
+        return self._sink
+
+    def _ensure_flusher(self):
+        # Threads don't survive a fork, so every gunicorn worker starts its own
+        pid = os.getpid()
+        if self._flusher_pid == pid and self._flusher.is_alive():
+            return
+        with self._lock:
+            if self._flusher_pid == pid and self._flusher.is_alive():
+                return
+            if self._flusher_pid != pid:
+                self._queue = queue.Queue(maxsize=self.max_queue_size)
+            self._stop.clear()
+            self._flusher_pid = pid
+            self._flusher = threading.Thread(target=self._run, name='firebase-log-flusher', daemon=True)
+            self._flusher.start()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def _drain(self):
+        records = []
+        while len(records) < self.batch_size:
+            try:
+                records.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return records
+
+    def flush(self):
+        records = self._drain()
+        while records:
+            try:
+                self.sink.write(records)
+            except Exception as e:
+                print(f"Error logging to Firebase: {e}")
+            records = self._drain()
+
+    def stats(self):
+        return {'pending': self._queue.qsize(), 'dropped': self.dropped}
+
+    def close(self):
+        self._stop.set()
+        self.flush()
 
     def log_to_firebase(self, collection, document, data):
+        self._ensure_flusher()
+        record = (collection, document, data)
+        if self.overflow == 'block':
+            self._queue.put(record)
+            return
         try:
-            self.db.collection(collection).document(document).set(data)
-            print(f"Logged to Firebase: {data}")
-        except Exception as e:
-            print(f"Error logging to Firebase: {e}")
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
 
     def log_message(self, message, level='INFO'):
+        timestamp = datetime.datetime.utcnow().isoformat()
         log_data = {
             'message': message,
             'level': level,
-            'timestamp': datetime.datetime.utcnow().isoformat()
+            'timestamp': timestamp
         }
-        self.log_to_firebase('logs', f"log-{datetime.datetime.utcnow().isoformat()}", log_data)
+        self.log_to_firebase('logs', f"log-{timestamp}", log_data)
 
-# Initialize FirebaseLogger instance
+# Initialize FirebaseLogger instance (no network access until the first flush)
 firebase_logger = FirebaseLogger()
+atexit.register(firebase_logger.close)
 
 def log_message(message, level='INFO'):
-    firebase_logger.log_message(message, level)
-
+    with metrics.stage('log'):
+        firebase_logger.log_message(message, level)
@@ -0,0 +1,110 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+import cv2
+import numpy as np
+
+
+def slot_signatures(rois):
+    # 64-bit difference hash per ROI: grayscale, shrink to 9x8 and compare
+    # neighbouring pixels. Robust to JPEG noise and small lighting changes
+    bits = np.zeros((len(rois), 8, 8), dtype=bool)
+    for i, roi in enumerate(rois):
+        if roi.size == 0:
+            continue
+        gray = roi if roi.ndim == 2 else cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
+        small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+        bits[i] = small[:, 1:] > small[:, :-1]
+    return np.packbits(bits.reshape(len(rois), 64), axis=1).view(np.uint64).ravel()
+
+
+def hamming_distances(a, b):
+    xor = np.bitwise_xor(a, b).view(np.uint8).reshape(len(a), 8)
+    return np.unpackbits(xor, axis=1).sum(axis=1)
+
+
+class FrameMatch:
+    # Result of comparing a frame's ROIs with the camera's previous frame
+    def __init__(self, key, signatures, unchanged, outputs):
+        self.key = key
+        self.signatures = signatures
+        self.unchanged = unchanged
+        self.outputs = outputs
+
+    @property
+    def changed_indices(self):
+        return np.flatnonzero(~self.unchanged).tolist()
+
+    @property
+    def skipped(self):
+        return int(self.unchanged.sum())
+
+    def merge(self, field, fresh):
+        # fresh holds values for changed_indices only; the rest come from cache
+        cached = self.outputs.get(field)
+        values = list(cached) if cached is not None else [None] * len(self.unchanged)
+        for index, value in zip(self.changed_indices, fresh):
+            values[index] = value
+        return values
+
+
+class FrameDedupCache:
+    def __init__(self, max_cameras=None, threshold=None, max_age=None):
+        self.max_cameras = int(max_cameras or os.getenv("FRAME_DEDUP_CAMERAS", "512"))
+        self.threshold = int(threshold if threshold is not None else os.getenv("FRAME_DEDUP_THRESHOLD", "4"))
+        # Slots are re-encoded at least this often even if they look the same
+        self.max_age = float(max_age or os.getenv("FRAME_DEDUP_MAX_AGE", "300"))
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.skipped = 0
+        self.processed = 0
+
+    def match(self, key, rois):
+        signatures = slot_signatures(rois)
+        unchanged = np.zeros(len(rois), dtype=bool)
+        outputs = {}
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and len(entry["signatures"]) == len(signatures):
+                self._entries.move_to_end(key)
+                fresh = time.monotonic() - entry["stored_at"] < self.max_age
+                if fresh:
+                    unchanged = hamming_distances(signatures, entry["signatures"]) <= self.threshold
+                    outputs = entry["outputs"]
+
+        return FrameMatch(key, signatures, unchanged, outputs)
+
+    def store(self, match, outputs):
+        # Unchanged slots keep their old signature, so slow drift still
+        # accumulates until it crosses the threshold
+        signatures = match.signatures.copy()
+        with self._lock:
+            previous = self._entries.get(match.key)
+            stored_at = time.monotonic()
+            if previous is not None and match.unchanged.any():
+                signatures[match.unchanged] = previous["signatures"][match.unchanged]
+                stored_at = previous["stored_at"]
+            self._entries[match.key] = {
+                "signatures": signatures,
+                "outputs": outputs,
+                "stored_at": stored_at,
+            }
+            self._entries.move_to_end(match.key)
+            while len(self._entries) > self.max_cameras:
+                self._entries.popitem(last=False)
+            self.skipped += match.skipped
+            self.processed += len(match.unchanged)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "cameras": len(self._entries),
+                "threshold": self.threshold,
+                "skipped_slots": self.skipped,
+                "processed_slots": self.processed,
+            }
+
+
+frame_cache = FrameDedupCache()
@@ -0,0 +1,106 @@
+import os
+import struct
+
+# Most pixels a route will decode. MAX_IMAGE_PIXELS_<ROUTE> overrides
+# MAX_IMAGE_PIXELS, which overrides the built-in per-route default
+DEFAULT_MAX_PIXELS = "50000000"
+ROUTE_DEFAULT_MAX_PIXELS = {
+    # Every variant is a full copy of the image
+    "create_variants": "16000000",
+}
+
+# JPEG start-of-frame markers; C4 (DHT), C8 (JPG) and CC (DAC) aren't frames
+SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+class ImageTooLarge(Exception):
+    pass
+
+
+def _jpeg_dimensions(data):
+    offset = 2
+    while offset + 9 <= len(data):
+        if data[offset] != 0xFF:
+            return None
+        marker = data[offset + 1]
+        # Fill bytes and standalone markers carry no length
+        if marker == 0xFF:
+            offset += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            offset += 2
+            continue
+        if marker in SOF_MARKERS:
+            height, width = struct.unpack(">HH", bytes(data[offset + 5:offset + 9]))
+            return width, height
+        (length,) = struct.unpack(">H", bytes(data[offset + 2:offset + 4]))
+        offset += 2 + length
+    return None
+
+
+def _webp_dimensions(data):
+    chunk = bytes(data[12:16])
+    if chunk == b"VP8 " and len(data) >= 30:
+        width, height = struct.unpack("<HH", bytes(data[26:30]))
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b"VP8L" and len(data) >= 25:
+        (bits,) = struct.unpack("<I", bytes(data[21:25]))
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8X" and len(data) >= 30:
+        width = int.from_bytes(bytes(data[24:27]), "little") + 1
+        height = int.from_bytes(bytes(data[27:30]), "little") + 1
+        return width, height
+    return None
+
+
+def _bmp_dimensions(data):
+    (header_size,) = struct.unpack("<I", bytes(data[14:18]))
+    if header_size == 12:
+        return struct.unpack("<HH", bytes(data[18:22]))
+    width, height = struct.unpack("<ii", bytes(data[18:26]))
+    # A negative height marks a top-down bitmap
+    return abs(width), abs(height)
+
+
+def image_dimensions(data):
+    # (width, height) from the JPEG, PNG, WebP or BMP header, None if it
+    # isn't there (yet, for a partial buffer) or the format is something else
+    if len(data) >= 4 and data[0] == 0xFF and data[1] == 0xD8:
+        return _jpeg_dimensions(data)
+    if len(data) >= 24 and bytes(data[:8]) == PNG_SIGNATURE:
+        return struct.unpack(">II", bytes(data[16:24]))
+    if len(data) >= 16 and bytes(data[:4]) == b"RIFF" and bytes(data[8:12]) == b"WEBP":
+        return _webp_dimensions(data)
+    if len(data) >= 26 and bytes(data[:2]) == b"BM":
+        return _bmp_dimensions(data)
+    return None
+
+
+def pixel_limit(route):
+    limit = os.getenv(f"MAX_IMAGE_PIXELS_{route.upper()}") or os.getenv("MAX_IMAGE_PIXELS")
+    return int(limit or ROUTE_DEFAULT_MAX_PIXELS.get(route, DEFAULT_MAX_PIXELS))
+
+
+def check_dimensions(dimensions, route):
+    if dimensions is None or route is None:
+        return
+    width, height = dimensions
+    limit = pixel_limit(route)
+    if width * height > limit:
+        raise ImageTooLarge(
+            f"Image is {width}x{height} ({width * height} pixels), the limit is {limit}"
+        )
+
+
+def check_image_size(data, route):
+    # Rejects oversized images from their header, before any pixels are decoded
+    check_dimensions(image_dimensions(data), route)
+
+
+def check_decoded_size(img, route, scale=1.0):
+    # Formats image_dimensions can't read (TIFF and others) are only checked
+    # once decoded; scale undoes a reduced-resolution decode
+    if img is not None:
+        height, width = img.shape[:2]
+        check_dimensions((round(width / scale), round(height / scale)), route)
@@ -1,53 +1,150 @@
+import os
 import cv2
 import numpy as np
 import base64
+from utils.crop_engine import compile_slot_rects, crop_rois
+
+# Warping only the slot regions at arbitrary angles can round a few pixels
+# differently from the full-frame warp, so it is opt-in
+APPROXIMATE_ROTATED_CROPS = os.getenv("APPROXIMATE_ROTATED_CROPS", "false").lower() == "true"
 
 
 # Image encoding and decoding functions
 def encode_image_to_base64(image):
+    buffer = encode_image_to_bytes(image)
+    if buffer is None:
+        return
+    jpg_as_text = base64.b64encode(buffer).decode("utf-8")
+    return jpg_as_text
+
+
+def encode_image_to_bytes(image):
     if not isinstance(image, np.ndarray):
         raise ValueError("The image to encode must be a numpy array.")
     if image.size == 0:
         return
     _, buffer = cv2.imencode(".jpg", image)
-    jpg_as_text = base64.b64encode(buffer).decode("utf-8")
-    return jpg_as_text
+    return buffer.tobytes()
 
 
 def decode_image_from_base64(image_base64):
     image = base64.b64decode(image_base64)
-    np_arr = np.frombuffer(image, np.uint8)
-    img = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
+    return decode_image_from_bytes(image)
+
+
+def decode_image_from_bytes(image_bytes, flags=cv2.IMREAD_COLOR):
+    np_arr = np.frombuffer(image_bytes, np.uint8)
+    img = cv2.imdecode(np_arr, flags)
     return img
 
 
 def handle_cropping(img, blueprint):
-    slots = blueprint.get("slots", [])
-    cropped_images = []
+    # Slots without a coordinate are skipped, as before
+    rects, has_coordinate = compile_slot_rects(blueprint, img.shape)
+    return crop_rois(img, rects[has_coordinate])
+
+
+def rotation_matrix(shape, angle):
+    (h, w) = shape[:2]
+    center = (w // 2, h // 2)
+    return cv2.getRotationMatrix2D(center, angle, 1.0)
+
 
-    for slot in slots:
-        coordinates = slot.get("coordinate")
-        print(coordinates)
-        if coordinates:
-            x1 = float(coordinates["x1"])
-            y1 = float(coordinates["y1"])
-            w = float(coordinates["w"])
-            h = float(coordinates["h"])
+def _quarter_turns(angle):
+    # Number of 90 degree turns for exact right angles, otherwise None
+    angle = angle % 360
+    if angle % 90 == 0:
+        return int(angle // 90)
+    return None
 
-            # Perform cropping
-            cropped_img = img[int(y1) : int(y1 + h), int(x1) : int(x1 + w)]
-            print("cropped image", img)
-            cropped_images.append(cropped_img)
-    return cropped_images
+
+def _right_angle_offsets(shape, quarter_turns):
+    # warpAffine with an exact right-angle matrix is a pure pixel permutation:
+    # rotated[y, x] == np.rot90(img, k)[y + oy, x + ox], zero outside
+    (h, w) = shape[:2]
+    cx, cy = w // 2, h // 2
+    if quarter_turns == 1:
+        return w - 1 - cx - cy, cy - cx
+    if quarter_turns == 2:
+        return h - 1 - 2 * cy, w - 1 - 2 * cx
+    if quarter_turns == 3:
+        return cx - cy, h - 1 - cx - cy
+    return 0, 0
+
+
+def _paste_region(source, oy, ox, y1, x1, y2, x2):
+    # source[y1 + oy:y2 + oy, x1 + ox:x2 + ox] with zeros where it runs off the edge
+    height, width = y2 - y1, x2 - x1
+    sy1, sx1 = y1 + oy, x1 + ox
+    sy2, sx2 = sy1 + height, sx1 + width
+    if sy1 >= 0 and sx1 >= 0 and sy2 <= source.shape[0] and sx2 <= source.shape[1]:
+        return np.ascontiguousarray(source[sy1:sy2, sx1:sx2])
+
+    out = np.zeros((height, width) + source.shape[2:], dtype=source.dtype)
+    cy1, cx1 = max(sy1, 0), max(sx1, 0)
+    cy2, cx2 = min(sy2, source.shape[0]), min(sx2, source.shape[1])
+    if cy2 > cy1 and cx2 > cx1:
+        out[cy1 - sy1 : cy2 - sy1, cx1 - sx1 : cx2 - sx1] = source[cy1:cy2, cx1:cx2]
+    return out
 
 
 def handle_rotation(img, angle):
     (h, w) = img.shape[:2]
-    center = (w // 2, h // 2)
-    M = cv2.getRotationMatrix2D(center, angle, 1.0)
+    quarter_turns = _quarter_turns(angle)
+    if quarter_turns == 0:
+        return img.copy()
+    if quarter_turns is not None:
+        # Lossless, same output as the affine path below
+        oy, ox = _right_angle_offsets(img.shape, quarter_turns)
+        return _paste_region(np.rot90(img, quarter_turns), oy, ox, 0, 0, h, w)
+
+    M = rotation_matrix(img.shape, angle)
     rotated = cv2.warpAffine(img, M, (w, h))
     return rotated
 
 
+def rotate_and_crop(img, angle, rects, approximate=None):
+    # Same as cropping rects (x1, y1, x2, y2) out of handle_rotation(img, angle).
+    # Right angles never rotate the whole frame; other angles do unless
+    # approximate is on
+    quarter_turns = _quarter_turns(angle)
+    if quarter_turns is not None:
+        rotated = np.rot90(img, quarter_turns)
+        oy, ox = _right_angle_offsets(img.shape, quarter_turns)
+        return [
+            _paste_region(rotated, oy, ox, y1, x1, y2, x2)
+            for x1, y1, x2, y2 in rects.tolist()
+        ]
+
+    if not (APPROXIMATE_ROTATED_CROPS if approximate is None else approximate):
+        return crop_rois(handle_rotation(img, angle), rects)
+
+    M = rotation_matrix(img.shape, angle)
+    inverse = cv2.invertAffineTransform(M)
+    (h, w) = img.shape[:2]
+    rois = []
+    for x1, y1, x2, y2 in rects.tolist():
+        if x2 <= x1 or y2 <= y1:
+            rois.append(img[0:0, 0:0])
+            continue
+
+        # Map the slot's corners back into the source frame and only read the
+        # bounding region (with a margin for the interpolation kernel)
+        corners = np.array([[x1, y1, 1], [x2, y1, 1], [x1, y2, 1], [x2, y2, 1]], dtype=np.float64)
+        source = corners @ inverse.T
+        sx1 = int(min(max(np.floor(source[:, 0].min()) - 2, 0), w))
+        sy1 = int(min(max(np.floor(source[:, 1].min()) - 2, 0), h))
+        sx2 = int(min(max(np.ceil(source[:, 0].max()) + 3, 0), w))
+        sy2 = int(min(max(np.ceil(source[:, 1].max()) + 3, 0), h))
+        if sx2 <= sx1 or sy2 <= sy1:
+            rois.append(np.zeros((y2 - y1, x2 - x1) + img.shape[2:], dtype=img.dtype))
+            continue
+
+        local = M.copy()
+        local[:, 2] += M[:, :2] @ np.array([sx1, sy1], dtype=np.float64) - np.array([x1, y1])
+        rois.append(cv2.warpAffine(img[sy1:sy2, sx1:sx2], local, (x2 - x1, y2 - y1)))
+    return rois
+
+
 def calculate_average_intensity(img):
     return np.mean(img)
@@ -0,0 +1,241 @@
+import contextvars
+import os
+import resource
+import sys
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Timings of the request being handled; None when instrumentation is off, so
+# a stage outside an instrumented request costs one ContextVar lookup
+_current = contextvars.ContextVar("request_timings", default=None)
+
+
+def peak_rss_bytes():
+    # Lifetime high-water mark of this process; ru_maxrss is in KB on Linux,
+    # bytes on macOS. Only useful per worker, not per request
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def current_rss_bytes():
+    # Resident set size right now, None where /proc isn't available
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=""):
+    labels = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    if extra:
+        labels = f"{labels},{extra}" if labels else extra
+    return "{" + labels + "}"
+
+
+class Histogram:
+    def __init__(self, name, help, label_names, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self._series = {}
+
+    def observe(self, labels, seconds):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                series[i] += 1
+        series[-2] += 1
+        series[-1] += seconds
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self._series.items()):
+            for bound, count in zip(self.buckets, series):
+                le = _format_labels(self.label_names, labels, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{le} {count}")
+            le = _format_labels(self.label_names, labels, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{le} {series[-2]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, labels)} {series[-1]}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, labels)} {series[-2]}")
+        return lines
+
+
+class RequestTimings:
+    def __init__(self, route):
+        self.route = route
+        self.action = ""
+        self.camera_id = ""
+        self.started = time.perf_counter()
+        self.rss = current_rss_bytes()
+        # (stage, seconds) in the order they finished
+        self.stages = []
+
+
+class _StageTimer:
+    __slots__ = ("timings", "name", "start")
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.timings.stages.append((self.name, time.perf_counter() - self.start))
+        return False
+
+
+class _NoopTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopTimer()
+
+
+class Metrics:
+    # Per-stage timers collected per request, folded into Prometheus
+    # histograms when the request finishes. Series are per worker process
+    def __init__(self, enabled=None, server_timing=None, camera_label=None, buckets=None):
+        self.enabled = str(
+            enabled if enabled is not None else os.getenv("METRICS_ENABLED", "false")
+        ).lower() in ("1", "true")
+        self.server_timing = str(
+            server_timing if server_timing is not None else os.getenv("SERVER_TIMING", "false")
+        ).lower() in ("1", "true")
+        # camera_id labels multiply the series count by the number of cameras
+        self.camera_label = str(
+            camera_label if camera_label is not None else os.getenv("METRICS_CAMERA_LABEL", "true")
+        ).lower() in ("1", "true")
+        # Distinct camera_id label values; later cameras share "other"
+        self.max_cameras = int(os.getenv("METRICS_CAMERA_LABELS", "100"))
+        self._cameras = set()
+        # Action names the pipeline registers; anything else isn't a label
+        self.known_actions = set()
+        if buckets is None and os.getenv("METRICS_BUCKETS"):
+            buckets = [float(b) for b in os.getenv("METRICS_BUCKETS").split(",")]
+        buckets = buckets or DEFAULT_BUCKETS
+
+        self._lock = threading.Lock()
+        self.requests = Histogram(
+            "image_processing_request_seconds",
+            "Request latency by route and status",
+            ("route", "status"),
+            buckets,
+        )
+        self.stages = Histogram(
+            "image_processing_stage_seconds",
+            "Time spent in each processing stage",
+            ("route", "action", "camera_id", "stage"),
+            buckets,
+        )
+        # Current RSS growth between the start and end of each request, by
+        # route. Requests running concurrently in the worker share the process,
+        # so their growth overlaps
+        self.rss_growth = {}
+
+    @property
+    def active(self):
+        return self.enabled or self.server_timing
+
+    def begin(self, route):
+        # Returns the request's timings for finish(), or None when
+        # instrumentation is off
+        if not self.active:
+            return None
+        timings = RequestTimings(route)
+        _current.set(timings)
+        return timings
+
+    def label(self, camera_id=None, actions=None):
+        timings = _current.get()
+        if timings is None:
+            return
+        # Both come from the client, so label values are kept to a bounded set
+        if camera_id and self.camera_label:
+            timings.camera_id = self._camera_label(str(camera_id))
+        if actions:
+            if isinstance(actions, str):
+                actions = actions.split(",")
+            timings.action = ",".join(
+                sorted({a.strip() for a in actions if isinstance(a, str)} & self.known_actions)
+            )
+
+    def _camera_label(self, camera_id):
+        with self._lock:
+            if camera_id in self._cameras:
+                return camera_id
+            if len(self._cameras) < self.max_cameras:
+                self._cameras.add(camera_id)
+                return camera_id
+        return "other"
+
+    def stage(self, name):
+        timings = _current.get()
+        if timings is None:
+            return _NOOP
+        return _StageTimer(timings, name)
+
+    def finish(self, timings, status, headers=None):
+        _current.set(None)
+        elapsed = time.perf_counter() - timings.started
+        rss = current_rss_bytes()
+        rss_growth = rss - timings.rss if rss is not None and timings.rss is not None else None
+
+        if self.enabled:
+            with self._lock:
+                self.requests.observe((timings.route, str(status)), elapsed)
+                if rss_growth is not None:
+                    self.rss_growth[timings.route] = self.rss_growth.get(timings.route, 0) + max(
+                        rss_growth, 0
+                    )
+                for name, seconds in timings.stages:
+                    self.stages.observe(
+                        (timings.route, timings.action, timings.camera_id, name), seconds
+                    )
+
+        if self.server_timing and headers is not None:
+            totals = {}
+            for name, seconds in timings.stages:
+                totals[name] = totals.get(name, 0.0) + seconds
+            entries = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in totals.items()]
+            entries.append(f"total;dur={elapsed * 1000:.2f}")
+            if rss_growth is not None:
+                entries.append(
+                    f'rss;desc="current={rss / 2**20:.1f}MB growth={rss_growth / 2**20:.1f}MB"'
+                )
+            headers["Server-Timing"] = ", ".join(entries)
+
+    def render(self):
+        with self._lock:
+            lines = self.requests.render() + self.stages.render()
+            lines += [
+                "# HELP image_processing_peak_rss_bytes Lifetime peak resident set size of this worker",
+                "# TYPE image_processing_peak_rss_bytes gauge",
+                f"image_processing_peak_rss_bytes {peak_rss_bytes()}",
+                "# HELP image_processing_rss_growth_bytes_total RSS growth from start to end of requests, by route",
+                "# TYPE image_processing_rss_growth_bytes_total counter",
+            ]
+            for route, growth in sorted(self.rss_growth.items()):
+                labels = _format_labels(("route",), (route,))
+                lines.append(f"image_processing_rss_growth_bytes_total{labels} {growth}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
@@ -0,0 +1,353 @@
+import math
+from functools import lru_cache
+import cv2
+import numpy as np
+from utils.image_utils import handle_rotation, rotate_and_crop, encode_image_to_base64
+from utils.variant_utils import create_random_variants
+from utils.database_utils import fetch_crop_plan
+from utils.response_utils import JSON_FORMAT, encode_crops
+from utils.roi_encoder import DEFAULT_OPTIONS
+from utils.frame_cache import frame_cache
+from utils.metrics import metrics
+from utils.background_model import background_models, slot_thumbnails
+from utils.slot_features import (
+    slot_features,
+    roi_features,
+    reference_differences,
+    slot_references,
+)
+
+# Registered stages by action name. Frame stages transform the whole image and
+# run in the order given; slot stages work on the ROI batch of the crop plan
+STAGES = {}
+
+
+class Stage:
+    def __init__(self, name, fn, inputs, outputs, per_slot, dedup):
+        self.name = name
+        self.fn = fn
+        self.inputs = inputs
+        self.outputs = outputs
+        self.per_slot = per_slot
+        # Reuses the previous frame's outputs for unchanged slots
+        self.dedup = dedup
+
+
+def register_stage(name, inputs=(), outputs=(), per_slot=False, dedup=False):
+    def decorator(fn):
+        STAGES[name] = Stage(name, fn, tuple(inputs), tuple(outputs), per_slot, dedup)
+        metrics.known_actions.add(name)
+        return fn
+
+    return decorator
+
+
+class PipelineContext:
+    def __init__(self, frame, image_name, camera_id, params, response_format):
+        self.frame = frame
+        self.image_name = image_name
+        self.camera_id = camera_id
+        self.params = params
+        self.response_format = response_format
+        self.rotation = 0
+        # Frames decoded at reduced resolution start out scaled down
+        self.scale = params.get("decode_scale", 1.0)
+        self.plan = None
+        self.rois = None
+        self.slot_frame = None
+        self.response = {"file_name": image_name}
+        self.timings = {}
+        self.dedup = None
+        self.dedup_stages = False
+        self.slot_outputs = {}
+        self.background_scores = None
+
+
+@register_stage("rotate", inputs=("frame",), outputs=("frame",))
+def rotate_stage(ctx, repeat=1):
+    # Adjacent rotations are fused into one warp with the summed angle
+    angle = ctx.params.get("angle", 0) * repeat
+    ctx.frame = handle_rotation(ctx.frame, angle)
+    ctx.rotation += angle
+
+
+@register_stage("resize", inputs=("frame",), outputs=("frame",))
+def resize_stage(ctx, repeat=1):
+    scale = float(ctx.params.get("scale", 1.0)) ** repeat
+    if scale != 1.0:
+        ctx.frame = cv2.resize(
+            ctx.frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA
+        )
+        ctx.scale *= scale
+
+
+def _match_previous_frame(ctx):
+    # Compare each slot with the camera's previous frame so unchanged slots
+    # can reuse the outputs computed last time. Skipped when no stage would
+    # reuse them, so hashing the ROIs isn't wasted work
+    if not ctx.params.get("dedup") or not ctx.dedup_stages:
+        return
+    options = ctx.params.get("encode_options", DEFAULT_OPTIONS)
+    key = (
+        ctx.camera_id,
+        ctx.plan.image_shape,
+        ctx.rotation,
+        ctx.scale,
+        ctx.response_format,
+        options.format,
+        options.quality,
+        options.max_dimension,
+        ctx.params.get("histogram_bins"),
+    )
+    ctx.dedup = frame_cache.match(key, ctx.rois)
+
+
+def _per_changed_slot(ctx, field, compute):
+    # compute(rois) only sees the slots that changed since the previous frame
+    if ctx.dedup is None or field not in ctx.dedup.outputs:
+        values = compute(ctx.rois)
+    else:
+        changed = [ctx.rois[i] for i in ctx.dedup.changed_indices]
+        values = ctx.dedup.merge(field, compute(changed))
+    ctx.slot_outputs[field] = values
+    return values
+
+
+@register_stage("slots", inputs=("frame",), outputs=("plan", "rois", "response"))
+def slots_stage(ctx):
+    # Precomputed bounds, filenames and response skeleton
+    ctx.plan = fetch_crop_plan(ctx.camera_id, ctx.frame.shape, ctx.rotation, ctx.scale)
+    ctx.response = ctx.plan.build_response(ctx.image_name)
+    ctx.slot_frame = ctx.frame
+    ctx.rois = ctx.plan.crop(ctx.frame)
+    _match_previous_frame(ctx)
+
+
+@register_stage("rotate_slots", inputs=("frame",), outputs=("plan", "rois", "response"))
+def rotate_slots_stage(ctx, repeat=1):
+    # A rotation directly followed by cutting the slots: right angles only
+    # copy the slot rectangles, other angles warp the whole frame unless
+    # APPROXIMATE_ROTATED_CROPS is on
+    angle = ctx.params.get("angle", 0) * repeat
+    ctx.rotation += angle
+    ctx.plan = fetch_crop_plan(ctx.camera_id, ctx.frame.shape, ctx.rotation, ctx.scale)
+    ctx.response = ctx.plan.build_response(ctx.image_name)
+    ctx.slot_frame = None
+    ctx.rois = rotate_and_crop(ctx.frame, angle, ctx.plan.rects)
+    _match_previous_frame(ctx)
+
+
+@register_stage("crop", inputs=("rois", "response"), outputs=("roi",), per_slot=True, dedup=True)
+def crop_stage(ctx):
+    options = ctx.params.get("encode_options", DEFAULT_OPTIONS)
+
+    def encode(rois):
+        encoded, ctx.timings["encode"] = encode_crops(rois, ctx.response_format, options)
+        return encoded
+
+    encoded = _per_changed_slot(ctx, "roi", encode)
+    ctx.plan.fill_slots(ctx.response, "roi", encoded)
+    if options.format != DEFAULT_OPTIONS.format:
+        ctx.response["roi_format"] = options.format
+
+
+@register_stage(
+    "average_intensity",
+    inputs=("plan", "response"),
+    outputs=("average_intensity",),
+    per_slot=True,
+)
+def average_intensity_stage(ctx):
+    if ctx.slot_frame is not None:
+        # One integral image gives every slot's mean in O(1)
+        means = ctx.plan.statistics(ctx.slot_frame)["mean"]
+    else:
+        means = np.array([roi.mean() if roi.size else np.nan for roi in ctx.rois])
+    intensities = [None if math.isnan(m) else m for m in means.tolist()]
+    ctx.plan.fill_slots(ctx.response, "average_intensity", intensities)
+
+
+@register_stage(
+    "variants", inputs=("rois", "response"), outputs=("variants",), per_slot=True, dedup=True
+)
+def variants_stage(ctx):
+    variants = _per_changed_slot(
+        ctx,
+        "variants",
+        lambda rois: [
+            [encode_image_to_base64(v) for v in create_random_variants(roi)] if roi.size else []
+            for roi in rois
+        ],
+    )
+    ctx.plan.fill_slots(ctx.response, "variants", variants)
+
+
+def _feature_dicts(features, reference_diff):
+    keys = ("gray_mean", "gray_std", "edge_density")
+    columns = [features[key].tolist() for key in keys]
+    histograms = features["histogram"].tolist()
+    results = []
+    for i, values in enumerate(zip(*columns, reference_diff.tolist())):
+        if math.isnan(values[0]):
+            # Slot outside the frame
+            results.append(None)
+            continue
+        result = dict(zip(keys, values[:3]))
+        result["color_histogram"] = histograms[i]
+        result["reference_diff"] = None if math.isnan(values[3]) else values[3]
+        results.append(result)
+    return results
+
+
+@register_stage(
+    "features", inputs=("plan", "rois", "response"), outputs=("features",), per_slot=True, dedup=True
+)
+def features_stage(ctx):
+    # Occupancy signals per slot so clients don't need the ROIs at all
+    bins = int(ctx.params.get("histogram_bins", 4))
+    slot_count = len(ctx.response["slots"])
+    references = slot_references.get(ctx.camera_id, slot_count)
+    capture = ctx.params.get("capture_reference")
+
+    def compute(indices):
+        if ctx.slot_frame is not None:
+            features = slot_features(ctx.slot_frame, ctx.plan.rects[indices], bins)
+        else:
+            features = roi_features([ctx.rois[i] for i in indices], bins)
+        slot_indices = ctx.plan.slot_indices[indices]
+        if capture:
+            # The slots are empty right now: keep them as the reference
+            slot_references.capture(ctx.camera_id, slot_count, slot_indices, features["thumbnail"])
+            return _feature_dicts(features, np.zeros(len(indices)))
+        ref = None if references is None else references[slot_indices]
+        return _feature_dicts(features, reference_differences(features["thumbnail"], ref))
+
+    if capture or ctx.dedup is None or "features" not in ctx.dedup.outputs:
+        values = compute(np.arange(len(ctx.rois)))
+    else:
+        values = ctx.dedup.merge("features", compute(np.array(ctx.dedup.changed_indices, dtype=int)))
+    ctx.slot_outputs["features"] = values
+    ctx.plan.fill_slots(ctx.response, "features", values)
+
+
+def _update_background(ctx):
+    # Scores every slot against the camera's background model and folds this
+    # frame into it; returns the scores in plan order
+    if ctx.slot_frame is not None:
+        thumbnails = slot_thumbnails(ctx.slot_frame, ctx.plan.rects)
+    else:
+        thumbnails = slot_thumbnails(ctx.rois)
+    ctx.background_scores = background_models.score_and_update(
+        ctx.camera_id, len(ctx.response["slots"]), ctx.plan.slot_indices, thumbnails
+    )
+    return ctx.background_scores
+
+
+@register_stage(
+    "change_score", inputs=("plan", "rois", "response"), outputs=("change_score",), per_slot=True
+)
+def change_score_stage(ctx):
+    # Share of each slot's pixels that differ from its learned background:
+    # one number per slot instead of a JPEG
+    ctx.plan.fill_slots(ctx.response, "change_score", _update_background(ctx))
+
+
+# Stages the compiler inserts on its own; never valid in an action list
+INTERNAL_STAGES = ("slots", "rotate_slots")
+
+
+def _producers():
+    producers = {}
+    for stage in STAGES.values():
+        for output in stage.outputs:
+            producers.setdefault(output, stage.name)
+    return producers
+
+
+class CompiledPipeline:
+    def __init__(self, steps):
+        # steps: tuple of (stage name, repeat count)
+        self.steps = steps
+        self.dedup_stages = any(STAGES[name].dedup for name, _ in steps)
+
+    def run(self, frame, image_name, camera_id, params=None, response_format=JSON_FORMAT):
+        ctx = PipelineContext(frame, image_name, camera_id, params or {}, response_format)
+        ctx.dedup_stages = self.dedup_stages
+        for name, repeat in self.steps:
+            stage = STAGES[name]
+            with metrics.stage(name):
+                if repeat > 1:
+                    stage.fn(ctx, repeat=repeat)
+                else:
+                    stage.fn(ctx)
+        if (
+            ctx.plan is not None
+            and ctx.background_scores is None
+            and background_models.learn_all
+            and ctx.params.get("learn_background", True)
+        ):
+            with metrics.stage("background"):
+                _update_background(ctx)
+        if ctx.dedup is not None:
+            frame_cache.store(ctx.dedup, ctx.slot_outputs)
+            ctx.response["dedup"] = {
+                "skipped_slots": ctx.dedup.skipped,
+                "total_slots": len(ctx.rois),
+            }
+        if ctx.params.get("include_timings"):
+            ctx.response["timings"] = ctx.timings
+        return ctx.response
+
+
+@lru_cache(maxsize=256)
+def compile_pipeline(actions):
+    # actions is a tuple so compiled plans are memoized by action signature
+    producers = _producers()
+    steps = []
+    available = {"frame"}
+    slots_done = False
+    seen_slot_stages = set()
+
+    for action in actions:
+        stage = STAGES.get(action)
+        # Unknown actions are ignored, as they always have been
+        if stage is None or action in INTERNAL_STAGES:
+            continue
+
+        if not stage.per_slot:
+            # Once the ROIs are cut nothing reads the frame again, so later
+            # frame stages are dead work
+            if slots_done:
+                continue
+            if steps and steps[-1][0] == action:
+                steps[-1] = (action, steps[-1][1] + 1)
+            else:
+                steps.append((action, 1))
+            continue
+
+        # Repeating a slot stage would only redo the same work
+        if action in seen_slot_stages:
+            continue
+        seen_slot_stages.add(action)
+
+        for needed in stage.inputs:
+            if needed not in available:
+                producer = STAGES[producers[needed]]
+                if producer.name == "slots" and steps and steps[-1][0] == "rotate":
+                    # Fuse the trailing rotation into the crop
+                    producer = STAGES["rotate_slots"]
+                    steps[-1] = (producer.name, steps[-1][1])
+                else:
+                    steps.append((producer.name, 1))
+                available.update(producer.outputs)
+                slots_done = True
+        steps.append((action, 1))
+        available.update(stage.outputs)
+
+    return CompiledPipeline(tuple(steps))
+
+
+def run_actions(frame, image_name, camera_id, actions, params=None, response_format=JSON_FORMAT):
+    # If actions are empty, perform all available actions
+    pipeline = compile_pipeline(tuple(actions or ["crop"]))
+    return pipeline.run(frame, image_name, camera_id, params, response_format)
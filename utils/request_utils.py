@@ -0,0 +1,242 @@
+import base64
+import binascii
+import json
+import re
+from flask import request
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge
+from utils.image_utils import decode_image_from_bytes
+from utils.image_limits import (
+    check_image_size,
+    check_decoded_size,
+    image_dimensions,
+    check_dimensions,
+)
+from utils.metrics import metrics
+
+# Metadata headers accepted alongside raw application/octet-stream bodies
+METADATA_HEADERS = {
+    "image_name": "X-Image-Name",
+    "camera_id": "X-Camera-Id",
+    "angle": "X-Angle",
+    "actions": "X-Actions",
+    "scale": "X-Scale",
+}
+
+RAW_MIMETYPES = ("application/octet-stream", "image/jpeg", "image/png", "image/webp")
+
+IMAGE_KEY = re.compile(rb'"image"\s*:\s*"')
+STREAM_CHUNK_SIZE = 64 * 1024
+# Stop looking for the image dimensions after this many decoded bytes
+HEADER_SNIFF_LIMIT = 1024 * 1024
+
+
+class JSONImageReader:
+    # Incremental reader for a JSON body carrying a base64 "image" string.
+    # The string is decoded chunk by chunk into one buffer preallocated from
+    # Content-Length, so neither the body nor the base64 text is held in
+    # full, and an oversized image is rejected from its header before the
+    # rest of the upload is read
+    def __init__(self, content_length=None, route=None):
+        self.route = route
+        self.buffer = bytearray((content_length or 0) * 3 // 4 + 3)
+        self.size = 0
+        self.head = bytearray()  # JSON up to and including the opening quote
+        self.tail = bytearray()  # JSON from the closing quote on
+        self.carry = b""
+        self.state = "head"
+        self.sniffed = route is None
+
+    def feed(self, chunk):
+        while chunk:
+            if self.state == "head":
+                start = max(len(self.head) - 16, 0)
+                self.head += chunk
+                match = IMAGE_KEY.search(self.head, start)
+                if match is None:
+                    return
+                chunk = bytes(self.head[match.end():])
+                del self.head[match.end():]
+                self.state = "image"
+            elif self.state == "image":
+                # Base64 never contains a quote, so the first one ends the string
+                end = chunk.find(b'"')
+                if end == -1:
+                    self._decode(chunk, final=False)
+                    return
+                self._decode(chunk[:end], final=True)
+                chunk = chunk[end:]
+                self.state = "tail"
+            else:
+                self.tail += chunk
+                return
+
+    def _decode(self, text, final):
+        text = self.carry + text
+        if b"\\" in text:
+            # JSON escapes: \/ and line breaks in wrapped base64; an escape
+            # split across chunks waits for the next one
+            if text.endswith(b"\\") and not final:
+                self.carry = b""
+                self._decode(text[:-1], final=False)
+                self.carry += b"\\"
+                return
+            text = text.replace(b"\\/", b"/").replace(b"\\n", b"").replace(b"\\r", b"")
+        text = text.translate(None, b" \t\r\n")
+
+        usable = len(text) if final else len(text) - len(text) % 4
+        self.carry = text[usable:]
+        decoded = binascii.a2b_base64(text[:usable])
+
+        end = self.size + len(decoded)
+        if end > len(self.buffer):
+            # No or wrong Content-Length
+            self.buffer.extend(bytes(end - len(self.buffer)))
+        self.buffer[self.size:end] = decoded
+        self.size = end
+
+        if not self.sniffed:
+            with memoryview(self.buffer) as view:
+                dimensions = image_dimensions(view[:self.size])
+            check_dimensions(dimensions, self.route)
+            self.sniffed = dimensions is not None or self.size > HEADER_SNIFF_LIMIT
+
+    def finish(self):
+        # Returns (metadata without "image", image bytes or None)
+        if self.state == "image":
+            raise BadRequest("Unterminated image string")
+        try:
+            data = json.loads(bytes(self.head + self.tail)) if self.head.strip() else {}
+        except ValueError:
+            raise BadRequest("Failed to decode JSON object")
+        data = data or {}
+        data.pop("image", None)
+
+        del self.buffer[self.size:]
+        return data, self.buffer if self.size else None
+
+
+def normalize_metadata(data):
+    actions = data.get("actions")
+    if isinstance(actions, str):
+        data["actions"] = [a.strip() for a in actions.split(",") if a.strip()]
+
+    angle = data.get("angle")
+    if isinstance(angle, str) and angle.strip():
+        try:
+            data["angle"] = float(angle) if "." in angle else int(angle)
+        except ValueError:
+            raise BadRequest(f"Invalid angle: {angle}")
+
+    return data
+
+
+def _read_multipart(route):
+    data = {key: request.form.get(key) for key in request.form}
+    if "actions" in request.form:
+        data["actions"] = ",".join(request.form.getlist("actions"))
+
+    file = request.files.get("image")
+    image_bytes = file.read() if file else None
+    if image_bytes:
+        check_image_size(image_bytes, route)
+    return normalize_metadata(data), image_bytes
+
+
+def request_metadata():
+    # Query string plus X-* metadata headers, for bodies that aren't JSON
+    data = request.args.to_dict()
+    for field, header in METADATA_HEADERS.items():
+        if header in request.headers:
+            data[field] = request.headers[header]
+    return normalize_metadata(data)
+
+
+class LimitedInput:
+    # Byte counter over the raw WSGI input, for routes whose limit differs
+    # from the app's MAX_CONTENT_LENGTH (request.max_content_length can't be
+    # set per request before Flask 3.1)
+    def __init__(self, stream, content_length, limit):
+        self.stream = stream
+        self.remaining = content_length
+        self.limit = limit
+        self.received = 0
+
+    def read(self, size=-1):
+        if self.remaining is not None:
+            if self.remaining <= 0:
+                return b""
+            size = self.remaining if size is None or size < 0 else min(size, self.remaining)
+        chunk = self.stream.read(size) if size is not None and size >= 0 else self.stream.read()
+        self.received += len(chunk)
+        if self.remaining is not None:
+            self.remaining -= len(chunk)
+        if self.limit and self.received > self.limit:
+            raise RequestEntityTooLarge()
+        return chunk
+
+
+def limited_input(limit):
+    # The request body read directly from the server, bypassing the app-wide
+    # limit; chunked uploads are counted as they arrive
+    if limit and (request.content_length or 0) > limit:
+        raise RequestEntityTooLarge()
+    return LimitedInput(request.environ["wsgi.input"], request.content_length, limit)
+
+
+def _read_raw(route):
+    data = request_metadata()
+
+    body = request.get_data(cache=False)
+    if body:
+        check_image_size(body, route)
+    return data, body or None
+
+
+def _read_json(route):
+    if not request.is_json:
+        data = request.get_json() or {}
+        image_base64 = data.pop("image", None)
+        image_bytes = base64.b64decode(image_base64) if image_base64 else None
+        return data, image_bytes
+
+    limit = request.max_content_length
+    if limit is not None and (request.content_length or 0) > limit:
+        raise RequestEntityTooLarge()
+
+    reader = JSONImageReader(request.content_length, route)
+    received = 0
+    while True:
+        chunk = request.stream.read(STREAM_CHUNK_SIZE)
+        if not chunk:
+            break
+        received += len(chunk)
+        # Chunked uploads carry no Content-Length to check up front
+        if limit is not None and received > limit:
+            raise RequestEntityTooLarge()
+        reader.feed(chunk)
+    return reader.finish()
+
+
+def read_image_payload(route=None):
+    # Returns (metadata, encoded image bytes) for JSON, multipart and raw
+    # uploads without decoding the pixels yet. With a route, images over its
+    # pixel limit are rejected from their header
+    with metrics.stage("read"):
+        if request.mimetype == "multipart/form-data":
+            data, image_bytes = _read_multipart(route)
+        elif request.mimetype in RAW_MIMETYPES:
+            data, image_bytes = _read_raw(route)
+        else:
+            data, image_bytes = _read_json(route)
+    metrics.label(data.get("camera_id"), data.get("actions"))
+    return data, image_bytes
+
+
+def read_image_request(route=None):
+    # Returns (metadata, decoded image); the image is None when the request
+    # didn't carry one
+    data, image_bytes = read_image_payload(route)
+    with metrics.stage("decode"):
+        img = decode_image_from_bytes(image_bytes) if image_bytes else None
+    check_decoded_size(img, route)
+    return data, img
@@ -0,0 +1,208 @@
+import datetime
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+def image_digest(data):
+    # blake2b runs at memory speed and is in the standard library
+    return hashlib.blake2b(data, digest_size=16).hexdigest() if data else None
+
+
+def response_key(digest, blueprint_version, **fields):
+    # None when the response can't be keyed yet (blueprint not cached)
+    if not digest or not blueprint_version:
+        return None
+    payload = json.dumps([digest, blueprint_version, fields], sort_keys=True, default=str)
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class MemoryResponseBackend:
+    # LRU bounded by total body size and entry count; also the local
+    # stand-in for a shared backend
+    def __init__(self, max_bytes, max_entries):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.size = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[2] <= time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[0], entry[1]
+
+    def set(self, key, body, content_type, ttl):
+        # A body bigger than the whole budget would only flush everything else
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (body, content_type, time.monotonic() + ttl)
+            self.size += len(body)
+            while self._entries and (
+                self.size > self.max_bytes or len(self._entries) > self.max_entries
+            ):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        body, _, _ = self._entries.pop(key)
+        self.size -= len(body)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+            }
+
+
+class MongoResponseBackend:
+    # Shared by every worker and host, in its own collection with a TTL
+    # index. Lookups that fail are misses, never request errors
+    def __init__(self):
+        self._indexed_pid = None
+
+    def _collection(self):
+        from config.database import MongoDBClient
+
+        collection = MongoDBClient().get_client()["test"]["response_cache"]
+        if self._indexed_pid != os.getpid():
+            collection.create_index("expires_at", expireAfterSeconds=0)
+            self._indexed_pid = os.getpid()
+        return collection
+
+    def get(self, key):
+        from pymongo.errors import PyMongoError
+
+        try:
+            doc = self._collection().find_one({"_id": key})
+        except PyMongoError as e:
+            print(f"Error reading response cache: {e}")
+            return None
+        if doc is None or doc["expires_at"] <= datetime.datetime.utcnow():
+            return None
+        return bytes(doc["body"]), doc["content_type"]
+
+    def set(self, key, body, content_type, ttl):
+        from bson.binary import Binary
+        from pymongo.errors import PyMongoError
+
+        try:
+            self._collection().replace_one(
+                {"_id": key},
+                {
+                    "_id": key,
+                    "body": Binary(body),
+                    "content_type": content_type,
+                    "expires_at": datetime.datetime.utcnow() + datetime.timedelta(seconds=ttl),
+                },
+                upsert=True,
+            )
+        except PyMongoError as e:
+            print(f"Error writing response cache: {e}")
+
+    def stats(self):
+        return {"backend": "mongo"}
+
+
+SHARED_BACKENDS = {
+    "mongo": MongoResponseBackend,
+    # Stand-in with the shared interface, for development and single workers
+    "memory": lambda: MemoryResponseBackend(
+        int(float(os.getenv("RESPONSE_CACHE_SHARED_MB", "256")) * 1024 * 1024),
+        int(os.getenv("RESPONSE_CACHE_SHARED_ENTRIES", "65536")),
+    ),
+}
+
+
+class ResponseCache:
+    # Encoded /crop and /process responses keyed by the image bytes and
+    # everything else the response depends on, so a retried or duplicated
+    # frame is answered without decoding, cropping or encoding it again.
+    # An in-process LRU sits in front of an optional shared backend
+    def __init__(self, enabled=None, max_mb=None, max_entries=None, max_item_mb=None, ttl=None, shared=None):
+        self.enabled = (
+            str(enabled if enabled is not None else os.getenv("RESPONSE_CACHE_ENABLED", "true")).lower()
+            == "true"
+        )
+        self.ttl = float(ttl or os.getenv("RESPONSE_CACHE_TTL", "300"))
+        # Bigger responses (4K frames as PNG ROIs) would push out many small ones
+        self.max_item_bytes = int(float(max_item_mb or os.getenv("RESPONSE_CACHE_MAX_ITEM_MB", "8")) * 1024 * 1024)
+        self.local = MemoryResponseBackend(
+            int(float(max_mb or os.getenv("RESPONSE_CACHE_MB", "64")) * 1024 * 1024),
+            int(max_entries or os.getenv("RESPONSE_CACHE_ENTRIES", "4096")),
+        )
+        self._shared_name = (shared if shared is not None else os.getenv("RESPONSE_CACHE_SHARED", "")).lower()
+        self._shared = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    @property
+    def shared(self):
+        if self._shared is None and self._shared_name:
+            self._shared = SHARED_BACKENDS[self._shared_name]()
+        return self._shared
+
+    def digest(self, data):
+        # Skips hashing the image when the cache is off
+        return image_digest(data) if self.enabled else None
+
+    def get(self, key):
+        # (body, content_type) or None
+        if not self.enabled or key is None:
+            return None
+        cached = self.local.get(key)
+        if cached is None and self.shared is not None:
+            cached = self.shared.get(key)
+            if cached is not None:
+                self.local.set(key, cached[0], cached[1], self.ttl)
+                with self._lock:
+                    self.shared_hits += 1
+        with self._lock:
+            if cached is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return cached
+
+    def put(self, key, body, content_type):
+        if not self.enabled or key is None or len(body) > self.max_item_bytes:
+            return
+        self.local.set(key, body, content_type, self.ttl)
+        if self.shared is not None:
+            self.shared.set(key, body, content_type, self.ttl)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            stats = {
+                "enabled": self.enabled,
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+            }
+        stats["local"] = self.local.stats()
+        if self._shared is not None:
+            stats["shared"] = self._shared.stats()
+        return stats
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,123 @@
+import json
+import struct
+import uuid
+from flask import request, jsonify, Response
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+from utils.roi_encoder import roi_encoder, DEFAULT_OPTIONS, ENCODE_FORMATS
+from utils.response_cache import response_cache
+from utils.metrics import metrics
+
+JSON_FORMAT = "application/json"
+MULTIPART_FORMAT = "multipart/mixed"
+NDJSON_FORMAT = "application/x-ndjson"
+BUNDLE_FORMAT = "application/x-roi-bundle"
+
+# Bundle layout: magic, version, then a u32 big-endian length prefix before
+# the metadata JSON and before every ROI (length 0 for an empty crop)
+BUNDLE_MAGIC = b"ROIB"
+BUNDLE_VERSION = 1
+
+
+def negotiate_crop_format(accept=None):
+    # JSON stays the default, including for "*/*" and missing Accept headers.
+    # accept is a raw Accept header for callers outside a Flask request
+    if accept is None:
+        accept_mimetypes = request.accept_mimetypes
+    else:
+        accept_mimetypes = parse_accept_header(accept, MIMEAccept)
+    best = accept_mimetypes.best_match(
+        [JSON_FORMAT, MULTIPART_FORMAT, BUNDLE_FORMAT], default=JSON_FORMAT
+    )
+    return best or JSON_FORMAT
+
+
+def encode_crops(cropped_images, response_format, options=DEFAULT_OPTIONS):
+    # Returns (encoded ROIs, timing report): Base64 for JSON, raw bytes for
+    # the binary formats
+    return roi_encoder.encode(
+        cropped_images, options, as_base64=response_format == JSON_FORMAT
+    )
+
+
+def _split_rois(response):
+    # Separate the raw ROI bytes from the slot metadata
+    metadata = dict(response)
+    slots = []
+    rois = []
+    for i, slot in enumerate(response.get("slots", [])):
+        slot = dict(slot)
+        roi = slot.pop("roi", None) or b""
+        slot["roi_index"] = i
+        slot["roi_length"] = len(roi)
+        slots.append(slot)
+        rois.append(roi)
+    metadata["slots"] = slots
+    return metadata, rois
+
+
+def _build_multipart(metadata, rois):
+    boundary = uuid.uuid4().hex
+    roi_mimetype = ENCODE_FORMATS[metadata.get("roi_format", "jpeg")][2]
+    parts = [
+        f"--{boundary}\r\nContent-Type: application/json\r\n\r\n".encode("utf-8"),
+        json.dumps(metadata, default=str).encode("utf-8"),
+        b"\r\n",
+    ]
+    for slot, roi in zip(metadata["slots"], rois):
+        headers = (
+            f"--{boundary}\r\n"
+            f"Content-Type: {roi_mimetype}\r\n"
+            f"Content-ID: <{slot['roi_index']}>\r\n"
+            f"Content-Disposition: attachment; filename=\"{slot.get('file_name', '')}\"\r\n"
+            f"Content-Length: {len(roi)}\r\n\r\n"
+        )
+        parts.extend((headers.encode("utf-8"), roi, b"\r\n"))
+    parts.append(f"--{boundary}--\r\n".encode("utf-8"))
+    return b"".join(parts), f"{MULTIPART_FORMAT}; boundary={boundary}"
+
+
+def _build_bundle(metadata, rois):
+    meta_bytes = json.dumps(metadata, default=str).encode("utf-8")
+    parts = [BUNDLE_MAGIC, struct.pack(">BI", BUNDLE_VERSION, len(meta_bytes)), meta_bytes]
+    for roi in rois:
+        parts.append(struct.pack(">I", len(roi)))
+        parts.append(roi)
+    return b"".join(parts), BUNDLE_FORMAT
+
+
+def crop_response_body(response, response_format):
+    # Returns (body bytes, content type) for any of the negotiated formats
+    if response_format == JSON_FORMAT:
+        return json.dumps(response, default=str).encode("utf-8"), JSON_FORMAT
+    metadata, rois = _split_rois(response)
+    if response_format == MULTIPART_FORMAT:
+        return _build_multipart(metadata, rois)
+    return _build_bundle(metadata, rois)
+
+
+def make_crop_response(response, response_format):
+    # Binary formats expect the slots' "roi" fields to hold raw image bytes
+    if response_format == JSON_FORMAT:
+        return jsonify(response)
+    body, content_type = crop_response_body(response, response_format)
+    return Response(body, content_type=content_type)
+
+
+def cached_crop_response(cache_key):
+    # The stored response for cache_key, or None
+    with metrics.stage("response_cache"):
+        cached = response_cache.get(cache_key)
+    if cached is None:
+        return None
+    body, content_type = cached
+    response = Response(body, content_type=content_type)
+    response.headers["X-Response-Cache"] = "hit"
+    return response
+
+
+def make_cached_crop_response(response, response_format, cache_key):
+    # Encoded to bytes once, so a later hit returns exactly the same body
+    body, content_type = crop_response_body(response, response_format)
+    response_cache.put(cache_key, body, content_type)
+    return Response(body, content_type=content_type)
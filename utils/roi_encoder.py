@@ -0,0 +1,145 @@
+import base64
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+
+# format -> (extension, quality flag, mimetype)
+ENCODE_FORMATS = {
+    "jpeg": (".jpg", cv2.IMWRITE_JPEG_QUALITY, "image/jpeg"),
+    "png": (".png", cv2.IMWRITE_PNG_COMPRESSION, "image/png"),
+    "webp": (".webp", cv2.IMWRITE_WEBP_QUALITY, "image/webp"),
+}
+# Accepted quality values per format; PNG's is the zlib compression level
+QUALITY_RANGES = {"jpeg": (0, 100), "png": (0, 9), "webp": (1, 100)}
+# Resize buffers kept per encoder thread (least recently used dropped first)
+RESIZE_BUFFERS = int(os.getenv("ROI_RESIZE_BUFFERS", "8"))
+
+
+class EncodeOptions:
+    def __init__(self, format="jpeg", quality=None, max_dimension=None):
+        format = (format or "jpeg").lower()
+        if format == "jpg":
+            format = "jpeg"
+        if format not in ENCODE_FORMATS:
+            raise ValueError(f"Unsupported image format: {format}")
+        self.format = format
+        self.quality = int(quality) if quality is not None else None
+        self.max_dimension = int(max_dimension) if max_dimension else None
+        low, high = QUALITY_RANGES[format]
+        if self.quality is not None and not low <= self.quality <= high:
+            raise ValueError(f"Quality for {format} must be between {low} and {high}")
+        if self.max_dimension is not None and self.max_dimension < 1:
+            raise ValueError("max_dimension must be at least 1")
+
+    @property
+    def mimetype(self):
+        return ENCODE_FORMATS[self.format][2]
+
+    def imencode_args(self):
+        extension, quality_flag, _ = ENCODE_FORMATS[self.format]
+        params = [quality_flag, self.quality] if self.quality is not None else []
+        return extension, params
+
+    @classmethod
+    def from_request(cls, data):
+        return cls(
+            data.get("roi_format"),
+            data.get("roi_quality"),
+            data.get("roi_max_dimension"),
+        )
+
+
+DEFAULT_OPTIONS = EncodeOptions()
+
+
+class ROIEncoder:
+    # Encodes slot crops on a shared thread pool; cv2.imencode and cv2.resize
+    # release the GIL, so a frame's ROIs are spread over all cores
+    def __init__(self, max_workers=None):
+        self.max_workers = int(max_workers or os.getenv("ENCODE_WORKERS", str(os.cpu_count() or 4)))
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def executor(self):
+        # Pools don't survive a fork, so each gunicorn worker builds its own
+        pid = os.getpid()
+        if self._executor_pid != pid:
+            with self._lock:
+                if self._executor_pid != pid:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_workers, thread_name_prefix="roi-encoder"
+                    )
+                    self._executor_pid = pid
+        return self._executor
+
+    def _resize_buffer(self, shape, dtype):
+        # Downscaled ROIs of the same size reuse one buffer per thread; a
+        # small LRU, since a blueprint can produce many distinct sizes
+        buffers = getattr(self._local, "buffers", None)
+        if buffers is None:
+            buffers = self._local.buffers = OrderedDict()
+        key = (shape, dtype)
+        buffer = buffers.pop(key, None)
+        if buffer is None:
+            buffer = np.empty(shape, dtype=dtype)
+        buffers[key] = buffer
+        while len(buffers) > RESIZE_BUFFERS:
+            buffers.popitem(last=False)
+        return buffer
+
+    def _encode_one(self, roi, options, as_base64):
+        timings = {"resize": 0.0, "encode": 0.0, "base64": 0.0}
+        # Empty crops (slot outside the frame) have nothing to encode
+        if roi is None or roi.size == 0:
+            return None, timings
+
+        start = time.perf_counter()
+        if options.max_dimension and max(roi.shape[:2]) > options.max_dimension:
+            factor = options.max_dimension / max(roi.shape[:2])
+            size = (max(int(roi.shape[1] * factor), 1), max(int(roi.shape[0] * factor), 1))
+            buffer = self._resize_buffer((size[1], size[0]) + roi.shape[2:], roi.dtype)
+            roi = cv2.resize(roi, size, dst=buffer, interpolation=cv2.INTER_AREA)
+        timings["resize"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        extension, params = options.imencode_args()
+        ok, buffer = cv2.imencode(extension, roi, params)
+        if not ok:
+            raise ValueError(f"Could not encode ROI as {options.format}")
+        timings["encode"] = time.perf_counter() - start
+
+        if not as_base64:
+            return buffer.tobytes(), timings
+
+        start = time.perf_counter()
+        encoded = base64.b64encode(buffer).decode("utf-8")
+        timings["base64"] = time.perf_counter() - start
+        return encoded, timings
+
+    def encode(self, rois, options=DEFAULT_OPTIONS, as_base64=True):
+        # Returns (encoded ROIs in input order, timing report in milliseconds)
+        start = time.perf_counter()
+        if len(rois) > 1 and self.max_workers > 1:
+            results = list(
+                self.executor.map(lambda roi: self._encode_one(roi, options, as_base64), rois)
+            )
+        else:
+            results = [self._encode_one(roi, options, as_base64) for roi in rois]
+
+        report = {"resize_ms": 0.0, "encode_ms": 0.0, "base64_ms": 0.0}
+        for _, timings in results:
+            for stage, seconds in timings.items():
+                report[f"{stage}_ms"] += seconds * 1000
+        report["wall_ms"] = (time.perf_counter() - start) * 1000
+        report["empty"] = sum(1 for encoded, _ in results if encoded is None)
+        return [encoded for encoded, _ in results], report
+
+
+roi_encoder = ROIEncoder()
@@ -0,0 +1,135 @@
+import os
+import threading
+from collections import OrderedDict
+import cv2
+import numpy as np
+from utils.crop_engine import rect_sums
+
+CANNY_THRESHOLDS = (50, 150)
+# Slots are compared with their empty reference at this size
+THUMBNAIL_SIZE = (32, 32)
+# bins**3 floats per slot; the uint16 colour index also overflows past 40
+MAX_HISTOGRAM_BINS = 16
+
+
+def check_histogram_bins(bins):
+    bins = int(bins)
+    if not 1 <= bins <= MAX_HISTOGRAM_BINS:
+        raise ValueError(f"histogram_bins must be between 1 and {MAX_HISTOGRAM_BINS}")
+    return bins
+
+
+def _color_index(img, bins):
+    # Joint BGR bin of every pixel: bins**3 colours
+    if img.ndim == 2:
+        img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+    quantized = (img.astype(np.uint16) * bins) >> 8
+    return (quantized[..., 0] * bins + quantized[..., 1]) * bins + quantized[..., 2]
+
+
+def _thumbnail(gray):
+    if gray.size == 0:
+        return np.zeros(THUMBNAIL_SIZE[::-1], dtype=np.float32)
+    return cv2.resize(gray, THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA).astype(np.float32)
+
+
+def slot_features(img, rects, histogram_bins=4):
+    histogram_bins = check_histogram_bins(histogram_bins)
+    # Occupancy features for every slot from one pass over the region the
+    # slots cover: grayscale conversion, Canny and colour quantization run
+    # once, means/std/edge density come from integral images in O(1) per slot
+    count = len(rects)
+    features = {
+        "gray_mean": np.full(count, np.nan),
+        "gray_std": np.full(count, np.nan),
+        "edge_density": np.full(count, np.nan),
+        "histogram": np.zeros((count, histogram_bins**3), dtype=np.float32),
+        "thumbnail": np.zeros((count,) + THUMBNAIL_SIZE[::-1], dtype=np.float32),
+    }
+    valid = (rects[:, 2] > rects[:, 0]) & (rects[:, 3] > rects[:, 1])
+    if not valid.any():
+        return features
+
+    # Work on the bounding box of all slots, not the whole frame
+    bx1, by1 = rects[valid, 0].min(), rects[valid, 1].min()
+    bx2, by2 = rects[valid, 2].max(), rects[valid, 3].max()
+    region = img[by1:by2, bx1:bx2]
+    local = rects[valid] - np.array([bx1, by1, bx1, by1], dtype=rects.dtype)
+
+    gray = region if region.ndim == 2 else cv2.cvtColor(region, cv2.COLOR_BGR2GRAY)
+    edges = cv2.Canny(gray, *CANNY_THRESHOLDS)
+    integral, squared = cv2.integral2(gray, sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F)
+    edge_integral = cv2.integral(edges, sdepth=cv2.CV_64F)
+
+    areas = ((local[:, 2] - local[:, 0]) * (local[:, 3] - local[:, 1])).astype(np.float64)
+    mean = rect_sums(integral, local) / areas
+    features["gray_mean"][valid] = mean
+    features["gray_std"][valid] = np.sqrt(
+        np.maximum(rect_sums(squared, local) / areas - mean**2, 0)
+    )
+    # Canny marks edge pixels with 255
+    features["edge_density"][valid] = rect_sums(edge_integral, local) / 255 / areas
+
+    colors = _color_index(region, histogram_bins)
+    for i, area, (x1, y1, x2, y2) in zip(np.flatnonzero(valid), areas, local.tolist()):
+        counts = np.bincount(colors[y1:y2, x1:x2].ravel(), minlength=histogram_bins**3)
+        features["histogram"][i] = counts / area
+        features["thumbnail"][i] = _thumbnail(gray[y1:y2, x1:x2])
+
+    return features
+
+
+def roi_features(rois, histogram_bins=4):
+    # Same features for ROIs that aren't views into one frame (rotated slots)
+    per_roi = [
+        slot_features(
+            roi, np.array([[0, 0, roi.shape[1], roi.shape[0]]], dtype=np.int32), histogram_bins
+        )
+        for roi in rois
+    ]
+    if not per_roi:
+        return slot_features(np.zeros((1, 1), np.uint8), np.zeros((0, 4), np.int32), histogram_bins)
+    return {key: np.concatenate([f[key] for f in per_roi]) for key in per_roi[0]}
+
+
+def reference_differences(thumbnails, references):
+    # Mean absolute grey-level difference from each slot's empty reference;
+    # NaN where no reference has been captured
+    diffs = np.full(len(thumbnails), np.nan)
+    if references is None:
+        return diffs
+    known = ~np.isnan(references[:, 0, 0])
+    diffs[known] = np.abs(thumbnails[known] - references[known]).mean(axis=(1, 2))
+    return diffs
+
+
+class SlotReferenceStore:
+    # Empty-slot reference thumbnails per camera, indexed by blueprint slot
+    def __init__(self, max_cameras=None):
+        self.max_cameras = int(max_cameras or os.getenv("SLOT_REFERENCE_CAMERAS", "1024"))
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, camera_id, slot_count):
+        with self._lock:
+            references = self._entries.get(camera_id)
+            if references is None or len(references) != slot_count:
+                return None
+            self._entries.move_to_end(camera_id)
+            return references
+
+    def capture(self, camera_id, slot_count, slot_indices, thumbnails):
+        with self._lock:
+            references = self._entries.get(camera_id)
+            if references is None or len(references) != slot_count:
+                references = np.full((slot_count,) + THUMBNAIL_SIZE[::-1], np.nan, dtype=np.float32)
+            else:
+                references = references.copy()
+            references[slot_indices] = thumbnails
+            self._entries[camera_id] = references
+            self._entries.move_to_end(camera_id)
+            while len(self._entries) > self.max_cameras:
+                self._entries.popitem(last=False)
+
+
+slot_references = SlotReferenceStore()
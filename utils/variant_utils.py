@@ -1,41 +1,125 @@
-import random
+import os
 import numpy as np
 import cv2
-from skimage.util import random_noise
 
-def create_random_variants(image):
-    variants = []
-    num_random_variants = 5
+RANDOM_TRANSFORMS = ("brightness", "contrast", "hue", "noise")
+ROTATION_CODES = (
+    cv2.ROTATE_90_CLOCKWISE,
+    cv2.ROTATE_180,
+    cv2.ROTATE_90_COUNTERCLOCKWISE,
+)
 
-    for i in range(num_random_variants):
-        variant = image.copy()
 
-        # Random brightness adjustment
-        brightness_factor = random.uniform(0.5, 1.5)
-        variant = cv2.convertScaleAbs(variant, alpha=brightness_factor, beta=0)
+# Every variant is a full copy of the image plus float32 noise of its size
+MAX_VARIANTS = int(os.getenv("MAX_VARIANTS", "20"))
 
-        # Random contrast adjustment
-        contrast_factor = random.uniform(0.5, 1.5)
-        variant = cv2.convertScaleAbs(variant, alpha=contrast_factor, beta=0)
 
-        # Random color adjustment
-        hsv = cv2.cvtColor(variant, cv2.COLOR_BGR2HSV)
-        hue_factor = random.uniform(0.5, 1.5)
-        hsv[..., 0] = hsv[..., 0] * hue_factor
-        variant = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
+def check_variant_count(count):
+    count = int(count)
+    if not 0 <= count <= MAX_VARIANTS:
+        raise ValueError(f"count must be between 0 and {MAX_VARIANTS}")
+    return count
 
-        # Random grain (noise) addition
-        grain_amount = random.uniform(0.01, 0.05)
-        noise_img = random_noise(variant, mode='gaussian', var=grain_amount)
-        variant = np.array(255 * noise_img, dtype='uint8')
 
-        variants.append(variant)
+class VariantEngine:
+    # Builds all random variants of an image at once in a stacked
+    # (count, H, W, C) uint8 array; the same seed gives the same variants.
+    # Each variant draws from its own child generator, so generating them
+    # one at a time (iter_generate) gives the same images as the batch
+    def __init__(self, count=5, transforms=RANDOM_TRANSFORMS, seed=None):
+        unknown = set(transforms) - set(RANDOM_TRANSFORMS)
+        if unknown:
+            raise ValueError(f"Unknown variant transforms: {', '.join(sorted(unknown))}")
+        self.count = check_variant_count(count)
+        self.transforms = tuple(transforms)
+        self.rngs = [
+            np.random.default_rng(child)
+            for child in np.random.SeedSequence(seed).spawn(self.count)
+        ]
+
+    def _uniform(self, low, high):
+        # One value per variant, each from that variant's generator
+        return np.array([rng.uniform(low, high) for rng in self.rngs])
+
+    def _intensity_luts(self):
+        # Brightness and contrast were two saturating convertScaleAbs passes;
+        # a 256-entry table per variant gives the identical result in one lookup
+        values = np.arange(256, dtype=np.float64)
+        luts = np.tile(values, (self.count, 1))
+        for name in ("brightness", "contrast"):
+            if name in self.transforms:
+                factors = self._uniform(0.5, 1.5)[:, None]
+                luts = np.clip(np.rint(luts * factors), 0, 255)
+        return luts.astype(np.uint8)
+
+    def _shift_hue(self, stack):
+        # Hue lives in [0, 180) for 8-bit HSV, so scaled values wrap around
+        # instead of overflowing uint8
+        factors = self._uniform(0.5, 1.5)[:, None]
+        hue_luts = (np.rint(np.arange(256) * factors) % 180).astype(np.uint8)
+
+        n, h, w, c = stack.shape
+        hsv = cv2.cvtColor(stack.reshape(n * h, w, c), cv2.COLOR_BGR2HSV).reshape(n, h, w, c)
+        hsv[..., 0] = hue_luts[np.arange(n)[:, None, None], hsv[..., 0]]
+        return cv2.cvtColor(hsv.reshape(n * h, w, c), cv2.COLOR_HSV2BGR).reshape(n, h, w, c)
+
+    def _add_noise(self, stack):
+        # Gaussian grain with a per-variant variance, like skimage's random_noise
+        sigma = np.sqrt(self._uniform(0.01, 0.05)).astype(np.float32)
+        noisy = np.empty(stack.shape, dtype=np.float32)
+        for rng, out in zip(self.rngs, noisy):
+            rng.standard_normal(out=out, dtype=np.float32)
+        noisy *= sigma[:, None, None, None] * 255
+        noisy += stack
+        np.clip(noisy, 0, 255, out=noisy)
+        return noisy.astype(np.uint8)
+
+    def generate(self, image):
+        if image.ndim == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+
+        # Brightness + contrast: one fused table lookup builds the whole stack
+        luts = self._intensity_luts()
+        stack = luts[np.arange(self.count)[:, None, None, None], image[None]]
+
+        if "hue" in self.transforms:
+            stack = self._shift_hue(stack)
+        if "noise" in self.transforms:
+            stack = self._add_noise(stack)
+        return stack
+
+    def iter_generate(self, image):
+        # One variant at a time from its own generator, so only a single
+        # variant is alive while it's being consumed
+        single = VariantEngine(1, self.transforms)
+        for rng in self.rngs:
+            single.rngs = [rng]
+            yield single.generate(image)[0]
+
+
+def create_rotation_variants(image):
+    return [cv2.rotate(image, code) for code in ROTATION_CODES]
+
+
+def _iter_variants(engine, image, rotations):
+    yield from engine.iter_generate(image)
+
+    if rotations:
+        for code in ROTATION_CODES:
+            yield cv2.rotate(image, code)
+
+
+def iter_random_variants(image, count=5, transforms=RANDOM_TRANSFORMS, seed=None, rotations=True):
+    # Built eagerly so bad arguments fail before anything is streamed
+    engine = VariantEngine(count, transforms, seed)
+    return _iter_variants(engine, image, rotations)
+
+
+def create_random_variants(image, count=5, transforms=RANDOM_TRANSFORMS, seed=None, rotations=True):
+    variants = list(VariantEngine(count, transforms, seed).generate(image)) if count else []
 
     # Rotation variants
-    for angle in [90, 180, 270]:
-        rotated_variant = cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE if angle == 90 else
-                                             cv2.ROTATE_180 if angle == 180 else
-                                             cv2.ROTATE_90_COUNTERCLOCKWISE)
-        variants.append(rotated_variant)
+    if rotations:
+        variants.extend(create_rotation_variants(image))
 
     return variants
@@ -0,0 +1,210 @@
+import os
+import time
+import cv2
+import numpy as np
+from utils.pipeline import run_actions
+from utils.response_utils import JSON_FORMAT
+
+SOI = b"\xff\xd8"
+EOI = b"\xff\xd9"
+# A stream that never closes a JPEG shouldn't grow the buffer forever
+MAX_MJPEG_FRAME_BYTES = 32 * 1024 * 1024
+
+
+class FrameSampler:
+    # Picks frames by time (sample_fps) or by count (sample_every); with
+    # neither every frame is taken
+    def __init__(self, sample_fps=None, sample_every=None, max_frames=None):
+        sample_fps = float(sample_fps) if sample_fps not in (None, "") else None
+        self.sample_every = int(sample_every) if sample_every not in (None, "") else None
+        self.max_frames = int(max_frames) if max_frames not in (None, "") else None
+        if sample_fps is not None and sample_fps <= 0:
+            raise ValueError("sample_fps must be positive")
+        if self.sample_every is not None and self.sample_every < 1:
+            raise ValueError("sample_every must be at least 1")
+        if self.max_frames is not None and self.max_frames < 1:
+            raise ValueError("max_frames must be at least 1")
+        self.interval_ms = 1000.0 / sample_fps if sample_fps is not None else None
+        self.next_ms = 0.0
+        self.taken = 0
+
+    @property
+    def done(self):
+        return self.max_frames is not None and self.taken >= self.max_frames
+
+    def take(self, index, timestamp_ms):
+        if self.done:
+            return False
+        if self.sample_every:
+            take = index % self.sample_every == 0
+        elif self.interval_ms:
+            take = timestamp_ms >= self.next_ms
+            if take:
+                # Skip ahead whole intervals if frames arrived late
+                self.next_ms += self.interval_ms * max(
+                    1, int((timestamp_ms - self.next_ms) // self.interval_ms) + 1
+                )
+        else:
+            take = True
+        if take:
+            self.taken += 1
+        return take
+
+
+def sample_video(source, sampler):
+    # (index, timestamp_ms, frame) for a file or URL cv2 can open. The video
+    # is opened here so a bad source fails before anything is streamed
+    capture = cv2.VideoCapture(source)
+    if not capture.isOpened():
+        capture.release()
+        raise ValueError("Video could not be opened")
+    return _iter_capture(capture, sampler)
+
+
+def _iter_capture(capture, sampler):
+    # Frames that aren't sampled are only grabbed, never decoded
+    fps = capture.get(cv2.CAP_PROP_FPS) or 0
+    try:
+        index = 0
+        while not sampler.done and capture.grab():
+            timestamp_ms = capture.get(cv2.CAP_PROP_POS_MSEC)
+            if not timestamp_ms and fps:
+                timestamp_ms = index * 1000.0 / fps
+            if sampler.take(index, timestamp_ms):
+                ok, frame = capture.retrieve()
+                if ok:
+                    yield index, timestamp_ms, frame
+            index += 1
+    finally:
+        capture.release()
+
+
+def _jpeg_end(buffer, pos, in_scan):
+    # Walks the JPEG starting at buffer[0] by its segment lengths, so an EOI
+    # inside a segment (an EXIF thumbnail) doesn't end the frame early.
+    # Returns (end, pos, in_scan): end is the index after the EOI, None when
+    # more data is needed (resume from pos) or -1 when it isn't a JPEG
+    n = len(buffer)
+    while True:
+        if in_scan:
+            # Entropy-coded data: 0xFF only starts a marker when it isn't
+            # followed by a 0x00 stuff byte, a restart marker or more fill
+            while True:
+                if pos >= n:
+                    return None, pos, True
+                ff = buffer.find(b"\xff", pos)
+                if ff == -1:
+                    return None, n, True
+                if ff + 1 >= n:
+                    return None, ff, True
+                marker = buffer[ff + 1]
+                if marker == 0x00 or 0xD0 <= marker <= 0xD7:
+                    pos = ff + 2
+                elif marker == 0xFF:
+                    pos = ff + 1
+                else:
+                    pos, in_scan = ff, False
+                    break
+
+        if pos + 1 >= n:
+            return None, pos, False
+        if buffer[pos] != 0xFF:
+            return -1, pos, False
+        marker = buffer[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+        elif marker == 0xD9:
+            return pos + 2, pos, False
+        elif marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            pos += 2
+        else:
+            if pos + 3 >= n:
+                return None, pos, False
+            length = (buffer[pos + 2] << 8) | buffer[pos + 3]
+            if length < 2:
+                return -1, pos, False
+            pos += 2 + length
+            # Scan data follows the start-of-scan header
+            in_scan = marker == 0xDA
+            if pos > n:
+                return None, pos, in_scan
+
+
+def sample_mjpeg(chunks, sampler):
+    # Yields (index, timestamp_ms, frame) from a motion-JPEG byte stream,
+    # either bare concatenated JPEGs or multipart/x-mixed-replace parts.
+    # Timestamps are arrival times; only sampled frames are decoded
+    buffer = bytearray()
+    # Parse position in the frame at the start of the buffer, None while
+    # looking for the next SOI
+    pos = None
+    in_scan = False
+    index = 0
+    started = time.monotonic()
+    for chunk in chunks:
+        buffer += chunk
+        while True:
+            if pos is None:
+                start = buffer.find(SOI)
+                if start == -1:
+                    # Keep a trailing 0xFF in case the marker is split
+                    del buffer[:max(len(buffer) - 1, 0)]
+                    break
+                del buffer[:start]
+                pos, in_scan = 2, False
+
+            end, pos, in_scan = _jpeg_end(buffer, pos, in_scan)
+            if end is None:
+                if len(buffer) > MAX_MJPEG_FRAME_BYTES:
+                    raise ValueError("Motion-JPEG frame exceeds the size limit")
+                break
+            if end == -1:
+                # Not a JPEG after all; look for the next SOI
+                del buffer[:2]
+                pos = None
+                continue
+
+            jpeg = bytes(buffer[:end])
+            del buffer[:end]
+            pos = None
+            timestamp_ms = (time.monotonic() - started) * 1000
+            if sampler.take(index, timestamp_ms):
+                frame = cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR)
+                if frame is not None:
+                    yield index, timestamp_ms, frame
+            index += 1
+            if sampler.done:
+                return
+
+
+def frame_name(image_name, index):
+    base_name, _, extension = image_name.rpartition(".")
+    if not base_name:
+        base_name, extension = image_name, "jpg"
+    return f"{base_name}_frame_{index}.{extension}"
+
+
+def process_samples(samples, image_name, camera_id, actions, params):
+    # Runs the /process pipeline on every sampled frame. The blueprint and
+    # crop plan come from the per-worker cache, so the sequence costs one
+    # database lookup at most
+    for index, timestamp_ms, frame in samples:
+        item = {"frame": index, "timestamp_ms": round(timestamp_ms, 1)}
+        try:
+            item["result"] = run_actions(
+                frame, frame_name(image_name, index), camera_id, actions, params, JSON_FORMAT
+            )
+        except ValueError as e:
+            item["error"] = str(e)
+        except Exception as e:
+            # One bad frame (a cv2.error) shouldn't end the whole stream
+            item["error"] = "An error occurred: " + str(e)
+        yield item
+
+
+def sampler_from_request(data):
+    return FrameSampler(
+        data.get("sample_fps", os.getenv("VIDEO_SAMPLE_FPS", "1")),
+        data.get("sample_every"),
+        data.get("max_frames", os.getenv("VIDEO_MAX_FRAMES")),
+    )